@@ -1,130 +1,222 @@
 import streamlit as st
 import os
-import zipfile
-import io
 from datetime import datetime
-import base64
-import shutil
-import re
-import requests
-import msal
+import threading
+import time
+import onboarding
+from onboarding import EMAIL_ADDRESS, member_details_text, member_files, safe_name, submission_spec
+import onedrive
+import submission
+import images
+from blobstore import BlobStore, SessionBlobs
+import staging
+from journal import SubmissionJournal
+from memory_stats import format_bytes
+from rerun_timing import RerunTimings
+import tracing
 
 st.set_page_config(page_title="✨ Onboarding Portal", layout="wide")
 
-def safe_name(name):
-    return re.sub(r'[^A-Za-z0-9_]', '_', name.replace(' ', '_'))
+PREUPLOAD_MEMBERS = st.secrets.get("PREUPLOAD_MEMBERS", True)
+SHOW_RERUN_TIMINGS = st.secrets.get("SHOW_RERUN_TIMINGS", False)
+PREWARM_GRAPH = st.secrets.get("PREWARM_GRAPH", False)
+IMAGE_SETTINGS = onboarding.image_settings(st.secrets)
+
+@st.cache_resource
+def get_metrics_exporters():
+    # JSON span lines go to stderr; metrics go to a Prometheus textfile
+    # and/or a /metrics endpoint when configured.
+    tracing.configure_logging(st.secrets.get("TRACE_LOG_LEVEL", "INFO"))
+    exporters = []
+    if st.secrets.get("METRICS_FILE"):
+        exporters.append(tracing.MetricsFileWriter(st.secrets["METRICS_FILE"]))
+    if st.secrets.get("METRICS_PORT"):
+        exporters.append(tracing.serve_metrics(int(st.secrets["METRICS_PORT"])))
+    return exporters
+
+get_metrics_exporters()
+
+@st.cache_resource
+def get_graph_credential():
+    # Shared by every session in this server process.
+    return onboarding.graph_credential(st.secrets)
+
+@st.cache_resource
+def get_admission_controller():
+    # All sessions share one budget of Graph requests and upload slots.
+    return onboarding.admission_controller(st.secrets)
+
+@st.cache_resource
+def get_graph_client():
+    return onboarding.graph_client(st.secrets, get_graph_credential(), admission=get_admission_controller())
+
+@st.cache_resource
+def start_graph_prewarm():
+    # Token (with MSAL's authority discovery) and a pooled TLS connection,
+    # fetched off the script thread when the first session starts, so the
+    # first submission does not wait for them.
+    thread = threading.Thread(
+        target=onboarding.prewarm, args=(get_graph_client(), EMAIL_ADDRESS), daemon=True, name="graph-prewarm"
+    )
+    thread.start()
+    return thread
+
+@st.cache_resource
+def get_logo():
+    # Served by this process from memory instead of fetched from GitHub;
+    # twice the displayed width so it stays sharp on high-DPI screens.
+    with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), "logo.png"), "rb") as f:
+        return images.resize_png(f.read(), 240)
+
+@st.cache_resource
+def get_folder_cache():
+    return onedrive.FolderCache(ttl=3600)
+
+@st.cache_resource
+def get_blob_store():
+    return BlobStore(memory_budget=int(st.secrets.get("BLOB_MEMORY_BUDGET_MB", 256)) * 1024 * 1024)
+
+@st.cache_resource
+def get_thumbnail_cache():
+    return images.ThumbnailCache(IMAGE_SETTINGS)
+
+@st.cache_resource
+def get_member_stager():
+    return staging.MemberStager(
+        get_graph_client(), EMAIL_ADDRESS, get_blob_store(), folder_cache=get_folder_cache(),
+        image_settings=IMAGE_SETTINGS,
+    )
 
-EMAIL_ADDRESS = "contactus@sssdistributors.com"
-ONEDRIVE_CLIENT_ID = st.secrets["ONEDRIVE_CLIENT_ID"]
-ONEDRIVE_CLIENT_SECRET = st.secrets["ONEDRIVE_CLIENT_SECRET"]
-ONEDRIVE_TENANT_ID = st.secrets["ONEDRIVE_TENANT_ID"]
+@st.cache_resource
+def get_submission_journal():
+    return SubmissionJournal(st.secrets.get("SUBMISSION_JOURNAL_PATH", "data/submissions.sqlite3"))
 
-def send_email_graph_api(to, subject, body, attachment_bytes=None, attachment_filename=None):
-    authority = f"https://login.microsoftonline.com/{ONEDRIVE_TENANT_ID}"
-    app = msal.ConfidentialClientApplication(
-        ONEDRIVE_CLIENT_ID,
-        authority=authority,
-        client_credential=ONEDRIVE_CLIENT_SECRET,
+@st.cache_resource
+def get_submission_worker():
+    return submission.SubmissionWorker(
+        get_graph_client(), EMAIL_ADDRESS, max_workers=4, folder_cache=get_folder_cache(),
+        image_settings=IMAGE_SETTINGS, blob_store=get_blob_store(), stager=get_member_stager(),
+        journal=get_submission_journal(), share_link_days=int(st.secrets.get("SHARE_LINK_EXPIRY_DAYS", 7)),
     )
-    scopes = ["https://graph.microsoft.com/.default"]
-    token_result = app.acquire_token_for_client(scopes=scopes)
-    if "access_token" not in token_result:
-        st.error("Failed to authenticate with Microsoft Graph for email sending.")
-        return False
-
-    access_token = token_result["access_token"]
-    message = {
-        "message": {
-            "subject": subject,
-            "body": {
-                "contentType": "Text",
-                "content": body
-            },
-            "toRecipients": [
-                {"emailAddress": {"address": to}}
-            ],
-            "from": {"emailAddress": {"address": EMAIL_ADDRESS}},
-        },
-        "saveToSentItems": "false"
-    }
-
-    if attachment_bytes and attachment_filename:
-        b64content = base64.b64encode(attachment_bytes).decode()
-        attachment = {
-            "@odata.type": "#microsoft.graph.fileAttachment",
-            "name": attachment_filename,
-            "contentBytes": b64content
-        }
-        message["message"]["attachments"] = [attachment]
-
-    headers = {
-        "Authorization": f"Bearer {access_token}",
-        "Content-Type": "application/json"
-    }
-    sendmail_url = f"https://graph.microsoft.com/v1.0/users/{EMAIL_ADDRESS}/sendMail"
-    resp = requests.post(sendmail_url, headers=headers, json=message)
-    if resp.status_code != 202:
-        st.error(f"Failed to send email: {resp.status_code} {resp.text}")
-        return False
-    return True
-
-def create_onedrive_folder_if_not_exists(access_token, folder_path_list):
-    parent_id = None
-    for folder in folder_path_list:
-        if parent_id:
-            url = f"https://graph.microsoft.com/v1.0/users/{EMAIL_ADDRESS}/drive/items/{parent_id}/children"
-        else:
-            url = f"https://graph.microsoft.com/v1.0/users/{EMAIL_ADDRESS}/drive/root/children"
-        resp = requests.get(url, headers={"Authorization": f"Bearer {access_token}"})
-        if resp.status_code not in [200, 201]:
-            st.error(f"Failed to list folders in OneDrive: {resp.status_code} {resp.text}")
-            return None
-        folders = resp.json().get("value", [])
-        folder_item = next((f for f in folders if f['name'] == folder and f['folder']), None)
-        if folder_item:
-            parent_id = folder_item['id']
+
+STEP_LABELS = {
+    "archive": "Zip documents",
+    "upload": "Upload to OneDrive",
+    "admin_email": "Email SSS Distributors",
+    "applicant_email": "Email applicant",
+}
+STEP_ICONS = {
+    submission.STEP_PENDING: "⏳",
+    submission.STEP_RUNNING: "🔄",
+    submission.STEP_DONE: "✅",
+    submission.STEP_FAILED: "❌",
+}
+
+def render_submission_steps(snap):
+    for step, state in snap["steps"].items():
+        line = f"{STEP_ICONS[state]} {STEP_LABELS.get(step, step)}"
+        if step in snap["errors"]:
+            line += f" — {snap['errors'][step]}"
+        st.markdown(line)
+
+@st.fragment(run_every=1.0)
+def submission_progress(job_id, owner=True):
+    job = get_submission_worker().get(job_id)
+    if not job:
+        return
+    snap = job.snapshot()
+    if snap["status"] in (submission.STATUS_DONE, submission.STATUS_FAILED):
+        # Hand over to a full rerun so the final view renders outside the poller.
+        st.rerun()
+    st.info(f"Submission {snap['id']}: {snap['status']}...")
+    if not owner:
+        return
+    position = get_submission_worker().queue_position(job_id)
+    if position:
+        st.caption(f"⏳ You are #{position} in line; your documents upload as soon as a slot frees up.")
+    paused_for = get_admission_controller().stats()["paused_for"]
+    if paused_for:
+        st.caption(f"Microsoft Graph asked us to slow down; resuming in {paused_for:.0f}s.")
+    sent, total = snap["upload_progress"]
+    if total:
+        st.progress(sent / total, text="Uploading to OneDrive...")
+    render_submission_steps(snap)
+
+def render_submission(job_id, owner=True):
+    # owner is False when the job came from the ?job= URL rather than this
+    # session (a refresh, or a link someone passed on): the URL alone only
+    # shows the status, never the family's documents, links or errors.
+    job = get_submission_worker().get(job_id)
+    if not job:
+        st.warning("This submission is no longer available. Please submit again if needed.")
+        return
+    snap = job.snapshot()
+    if snap["status"] not in (submission.STATUS_DONE, submission.STATUS_FAILED):
+        submission_progress(job_id, owner)
+        return
+    if not owner:
+        if snap["status"] == submission.STATUS_DONE:
+            st.success(f"Submission {snap['id']} is complete. Confirmation emails have been sent.")
         else:
-            create_url = url
-            create_resp = requests.post(
-                create_url,
-                headers={"Authorization": f"Bearer {access_token}", "Content-Type": "application/json"},
-                json={"name": folder, "folder": {}, "@microsoft.graph.conflictBehavior": "rename"}
-            )
-            if create_resp.status_code not in [200, 201]:
-                st.error(f"Failed to create folder {folder} in OneDrive: {create_resp.status_code} {create_resp.text}")
-                return None
-            parent_id = create_resp.json()['id']
-    return parent_id
-
-def upload_to_onedrive(file_bytes, folder_path_list, filename):
-    authority = f"https://login.microsoftonline.com/{ONEDRIVE_TENANT_ID}"
-    app = msal.ConfidentialClientApplication(
-        ONEDRIVE_CLIENT_ID,
-        authority=authority,
-        client_credential=ONEDRIVE_CLIENT_SECRET,
+            st.warning(f"Submission {snap['id']} did not finish. Please submit again from a new session.")
+        return
+    if snap["duplicate"]:
+        st.info("These documents were already submitted, so nothing was uploaded or emailed again.")
+        if snap["share_link"] or snap["web_url"]:
+            st.markdown(f"[Open the submitted documents]({snap['share_link'] or snap['web_url']})")
+        return
+    if job.archive:
+        st.download_button(
+            "⬇️ Download All Documents (.zip)", job.archive.reader, file_name=job.spec["zip_name"], mime='application/zip'
+        )
+    if snap["steps"]["upload"] == submission.STEP_DONE:
+        st.success("Documents uploaded to OneDrive.")
+    if snap["status"] == submission.STATUS_DONE:
+        st.success("Confirmation emails sent!")
+        st.caption(
+            f"Archive {format_bytes(snap['archive_size'])} · peak memory {format_bytes(snap['peak_rss'])} "
+            f"(+{format_bytes(snap['peak_delta'])} during submission)"
+        )
+        st.markdown("""
+            ### Next Steps
+            - You'll receive an AOF (Account Opening Form) shortly for confirmation.
+            - Post confirmation, approve the following emails from BSE StarMF:
+                1. **E-log**: After verifying AOF details
+                2. **Nominee Authentication**
+                3. **E-Mandate** <span class="tooltip-wrap"><span class="tooltip-icon">ℹ️</span>
+                    <span class="tooltip-box">
+                        This mandate authorizes BSE Star MF to debit funds exclusively from your registered bank account for investment purposes.<br>
+                        The maximum transaction limit specified ensures that only you can initiate investments in your name.<br>
+                        This e-mandate will apply to all SIPs and lump sum transactions, and serves as a secure fallback should internet banking be temporarily unavailable.
+                    </span>
+                </span>: Authorizes BSE to debit your account for future SIPs or lump sum investments.
+            """, unsafe_allow_html=True)
+        st.info("The e-mandate provides a secure, single point of authorization for all your mutual fund investments through BSE Star MF.")
+    else:
+        st.error("Some steps of the submission failed. Completed steps will not be repeated on retry.")
+        render_submission_steps(snap)
+        if st.button("🔁 Retry failed steps", key=f"retry_{job_id}"):
+            get_submission_worker().retry(job_id)
+            st.rerun()
+
+def family_folder_path():
+    return onboarding.family_folder_path(st.session_state['family_head_name'])
+
+def stage_member(idx, member):
+    # Start uploading a locked member's documents so the final submit does not
+    # have to wait for them.
+    if not PREUPLOAD_MEMBERS or not st.session_state.get('family_head_name'):
+        return
+    member_staging = st.session_state.setdefault(
+        "staging", {"folder": staging.staging_folder_name(), "tasks": {}}
     )
-    scopes = ["https://graph.microsoft.com/.default"]
-    token_result = app.acquire_token_for_client(scopes=scopes)
-    if "access_token" not in token_result:
-        st.error("Failed to authenticate with Microsoft Graph for OneDrive upload.")
-        return None
-    access_token = token_result["access_token"]
-
-    parent_id = create_onedrive_folder_if_not_exists(access_token, folder_path_list)
-    if not parent_id:
-        st.error("Could not create/find OneDrive folders.")
-        return None
-
-    upload_url = f"https://graph.microsoft.com/v1.0/users/{EMAIL_ADDRESS}/drive/items/{parent_id}:/"+filename+":/content"
-    headers = {
-        "Authorization": f"Bearer {access_token}",
-        "Content-Type": "application/octet-stream"
-    }
-    resp = requests.put(upload_url, headers=headers, data=file_bytes)
-    if resp.status_code not in [200, 201]:
-        st.error(f"Failed to upload file to OneDrive: {resp.status_code} {resp.text}")
-        return None
-    return resp.json().get("webUrl", None)
+    path = family_folder_path() + [member_staging["folder"], safe_name(member['name'])]
+    member_staging["tasks"][idx] = get_member_stager().stage(path, member_files(session_blobs, idx, member))
+
+def discard_staging():
+    member_staging = st.session_state.pop("staging", None)
+    if member_staging and member_staging["tasks"] and st.session_state.get('family_head_name'):
+        get_member_stager().discard(family_folder_path() + [member_staging["folder"]])
 
 st.markdown("""
     <style>
@@ -139,20 +231,60 @@ st.markdown("""
 </div>
 """, unsafe_allow_html=True)
 
-with st.sidebar:
+# Uploaded documents live once in the shared blob store; the session keeps
+# only references to them.
+if "blobs" not in st.session_state:
+    st.session_state["blobs"] = SessionBlobs(get_blob_store())
+session_blobs = st.session_state["blobs"]
+
+if "rerun_timings" not in st.session_state:
+    st.session_state["rerun_timings"] = RerunTimings()
+rerun_timings = st.session_state["rerun_timings"]
+script_started = time.perf_counter()
+st.session_state["full_run_active"] = True
+
+def member_summary(members):
+    # What the sidebar and footer show for each member. A fragment that
+    # changes it has to rerun the whole page so they catch up.
+    return [(m.get("name"), m.get("avatar_data"), m.get("is_complete"), m.get("is_locked")) for m in members]
+
+def rerun_if_summary_changed():
+    # Only from a fragment's own rerun; during a full run the sidebar and
+    # footer are rendered from the same state anyway.
+    if st.session_state.get("full_run_active"):
+        return
+    if member_summary(st.session_state["members"]) != st.session_state.get("rendered_summary"):
+        st.rerun()
+
+def reset_members():
+    discard_staging()
+    session_blobs.clear()
+    st.session_state["members"] = [
+        {"name": "", "age": 0, "avatar": None, "avatar_data": None, "is_complete": False, "is_locked": False}
+        for _ in range(int(st.session_state["members_count"]))
+    ]
+    st.session_state["tab_names"] = []
+    st.session_state["active_tab"] = 0
+    if st.session_state["family_head_name"]:
+        st.session_state["members"][0]["name"] = st.session_state["family_head_name"]
+        st.session_state["members"][0]["age"] = st.session_state["family_head_age"]
+    # Member 1 is prefilled from the family form; drop the old widget values
+    # so the card shows the new ones.
+    for key in ("name_0", "age_0", "select_member_tab"):
+        st.session_state.pop(key, None)
+
+def render_sidebar():
     st.markdown("<div class='glass-sidebar'>", unsafe_allow_html=True)
-    st.image(
-        "https://raw.githubusercontent.com/rohitdev24/whatsapp_onboarding_v2/main/logo.png",
-        width=120
-    )
+    st.image(get_logo(), width=120)
     st.markdown("<div class='sidebar-title'>👨‍👩‍👧‍👦 Family Progress</div>", unsafe_allow_html=True)
     members = st.session_state.get('members', [])
+    st.session_state["rendered_summary"] = member_summary(members)
     for idx, member in enumerate(members):
         name = member.get("name", f"Member {idx+1}")
         avatar_data = member.get("avatar_data")
         completed = member.get("is_complete", False)
         avatar_html = (
-            f"<img src='data:image/png;base64,{avatar_data}' class='avatar'>" if avatar_data
+            f"<img src='data:image/jpeg;base64,{avatar_data}' class='avatar'>" if avatar_data
             else f"<div class='avatar'></div>"
         )
         status = (f"<span class='checkmark'>&#10004;</span>" if completed 
@@ -161,52 +293,48 @@ with st.sidebar:
             f"<div class='member-list-item'>{avatar_html}<span style='font-weight:500'>{name}</span> {status}</div>",
             unsafe_allow_html=True
         )
-    st.markdown("</div>", unsafe_allow_html=True)
-
-with st.container():
-    st.markdown("<div class='glass-card'>", unsafe_allow_html=True)
-    st.markdown("---")
-
-    if "members_count" not in st.session_state:
-        st.session_state["members_count"] = 1
-    if "family_head_name" not in st.session_state:
-        st.session_state["family_head_name"] = ""
-    if "family_head_age" not in st.session_state:
-        st.session_state["family_head_age"] = 0
-
-    with st.form("family_form", clear_on_submit=False):
-        cols = st.columns([2,1,1])
-        with cols[0]:
-            head_name = st.text_input("Primary Applicant Name", placeholder="Full name", value=st.session_state["family_head_name"])
-        with cols[1]:
-            head_age = st.number_input("Primary Applicant Age", min_value=0, max_value=120, step=1, value=st.session_state["family_head_age"])
-        with cols[2]:
-            members_count = st.number_input(
-                "How many members wish to invest?", min_value=1, max_value=10, step=1, value=st.session_state["members_count"]
+    blob_stats = session_blobs.stats()
+    if blob_stats["files"]:
+        store_stats = get_blob_store().stats()
+        st.caption(
+            f"Uploads: {blob_stats['files']} files, {format_bytes(blob_stats['unique_bytes'])} unique "
+            f"of {format_bytes(blob_stats['referenced_bytes'])} · shared store "
+            f"{format_bytes(store_stats['memory_bytes'])} in memory, {format_bytes(store_stats['disk_bytes'])} on disk"
+        )
+    if SHOW_RERUN_TIMINGS:
+        for section, stats in rerun_timings.summary().items():
+            st.caption(
+                f"⏱️ {section}: {stats['last_ms']:.0f} ms last, {stats['mean_ms']:.0f} ms mean over {stats['runs']} runs"
             )
-        family_submitted = st.form_submit_button("Confirm Family Info")
-        if family_submitted:
-            st.session_state["family_head_name"] = head_name
-            st.session_state["family_head_age"] = head_age
-            st.session_state["members_count"] = members_count
-
-    if "members" not in st.session_state or family_submitted:
-        st.session_state["members"] = [
-            {"name": "", "age": 0, "avatar": None, "avatar_data": None, "is_complete": False, "is_locked": False}
-            for _ in range(int(st.session_state["members_count"]))
-        ]
-        st.session_state["tab_names"] = []
-        st.session_state["active_tab"] = 0
-        if st.session_state["family_head_name"]:
-            st.session_state["members"][0]["name"] = st.session_state["family_head_name"]
-            st.session_state["members"][0]["age"] = st.session_state["family_head_age"]
-
-    if st.session_state.get("members") and st.session_state.get("family_head_name"):
-        if not st.session_state["members"][0]["name"]:
-            st.session_state["members"][0]["name"] = st.session_state["family_head_name"]
-        if not st.session_state["members"][0]["age"]:
-            st.session_state["members"][0]["age"] = st.session_state["family_head_age"]
+    st.markdown("</div>", unsafe_allow_html=True)
 
+@st.fragment
+def sidebar():
+    with rerun_timings.measure("sidebar"):
+        render_sidebar()
+
+@st.fragment
+def family_form():
+    with rerun_timings.measure("family_form"):
+        with st.form("family_form", clear_on_submit=False):
+            cols = st.columns([2,1,1])
+            with cols[0]:
+                head_name = st.text_input("Primary Applicant Name", placeholder="Full name", value=st.session_state["family_head_name"])
+            with cols[1]:
+                head_age = st.number_input("Primary Applicant Age", min_value=0, max_value=120, step=1, value=st.session_state["family_head_age"])
+            with cols[2]:
+                members_count = st.number_input(
+                    "How many members wish to invest?", min_value=1, max_value=10, step=1, value=st.session_state["members_count"]
+                )
+            family_submitted = st.form_submit_button("Confirm Family Info")
+    if family_submitted:
+        st.session_state["family_head_name"] = head_name
+        st.session_state["family_head_age"] = head_age
+        st.session_state["members_count"] = members_count
+        reset_members()
+        st.rerun()
+
+def render_member_card():
     members = st.session_state["members"]
 
     tab_names = [m["name"] if m["name"] else f"👤 Member {i+1}" for i, m in enumerate(members)]
@@ -216,6 +344,12 @@ with st.container():
     else:
         st.session_state.tab_names = tab_names
 
+    if "next_member_tab" in st.session_state:
+        # The radio owns its value once rendered, so moving to the next member
+        # drops that state and lets it pick up active_tab on this run.
+        st.session_state.active_tab = st.session_state.pop("next_member_tab")
+        st.session_state.pop("select_member_tab", None)
+
     selected_tab = st.radio(
         "Select Member",
         options=range(len(tab_names)),
@@ -227,8 +361,6 @@ with st.container():
     )
     st.session_state.active_tab = selected_tab
 
-    completed_forms = 0
-
     idx = selected_tab
     st.markdown("<div class='glass-card'>", unsafe_allow_html=True)
     st.subheader(f"Member {idx+1} Details")
@@ -241,12 +373,13 @@ with st.container():
         passport_photo = st.file_uploader("Passport Size Photo (optional for minors)", type=["png", "jpg", "jpeg"], key=f"photo_{idx}", disabled=members[idx].get("is_locked", False))
         avatar_data = members[idx].get("avatar_data")
         if passport_photo:
-            st.session_state[f"member_{idx}_passport_photo_bytes"] = passport_photo.getvalue()
-            st.session_state[f"member_{idx}_passport_photo_filename"] = passport_photo.name
-            avatar_data = base64.b64encode(passport_photo.getvalue()).decode()
+            passport_photo = session_blobs.put_upload(f"member_{idx}_passport_photo", passport_photo)
+            avatar_data = get_thumbnail_cache().get(
+                passport_photo.digest, lambda: get_blob_store().get(passport_photo.digest)
+            )
         if avatar_data:
             st.markdown(
-                f"<img src='data:image/png;base64,{avatar_data}' class='avatar' style='width:64px;height:64px;margin-top:0.5em;'>",
+                f"<img src='data:image/jpeg;base64,{avatar_data}' class='avatar' style='width:64px;height:64px;margin-top:0.5em;'>",
                 unsafe_allow_html=True
             )
     if not members[idx].get("is_locked", False):
@@ -259,12 +392,10 @@ with st.container():
         if age < 18:
             docs['Birth Certificate'] = st.file_uploader("Birth Certificate", key=f"birthcert_{idx}", disabled=members[idx].get("is_locked", False))
             if docs['Birth Certificate']:
-                st.session_state[f"member_{idx}_birthcert_bytes"] = docs['Birth Certificate'].getvalue()
-                st.session_state[f"member_{idx}_birthcert_filename"] = docs['Birth Certificate'].name
+                docs['Birth Certificate'] = session_blobs.put_upload(f"member_{idx}_birthcert", docs['Birth Certificate'])
             docs['Minor PAN Card (optional)'] = st.file_uploader("Minor PAN Card (optional)", type=["jpg", "jpeg", "png", "pdf"], key=f"minorpancard_{idx}", disabled=members[idx].get("is_locked", False))
             if docs['Minor PAN Card (optional)']:
-                st.session_state[f"member_{idx}_minorpancard_bytes"] = docs['Minor PAN Card (optional)'].getvalue()
-                st.session_state[f"member_{idx}_minorpancard_filename"] = docs['Minor PAN Card (optional)'].name
+                docs['Minor PAN Card (optional)'] = session_blobs.put_upload(f"member_{idx}_minorpancard", docs['Minor PAN Card (optional)'])
             guardian_list = []
             num_guardians = st.number_input(f"Number of guardians?", min_value=1, max_value=2, value=1, key=f"guardian_count_{idx}", disabled=members[idx].get("is_locked", False))
             for g in range(int(num_guardians)):
@@ -272,16 +403,13 @@ with st.container():
                     guardian = {}
                     guardian['Guardian PAN'] = st.file_uploader("Guardian PAN Card", key=f"guardian_pan_{idx}_{g}", disabled=members[idx].get("is_locked", False))
                     if guardian['Guardian PAN']:
-                        st.session_state[f"member_{idx}_guardian_{g}_pan_bytes"] = guardian['Guardian PAN'].getvalue()
-                        st.session_state[f"member_{idx}_guardian_{g}_pan_filename"] = guardian['Guardian PAN'].name
+                        guardian['Guardian PAN'] = session_blobs.put_upload(f"member_{idx}_guardian_{g}_pan", guardian['Guardian PAN'])
                     guardian['Guardian Aadhaar'] = st.file_uploader("Guardian Aadhaar", key=f"guardian_aadhaar_{idx}_{g}", disabled=members[idx].get("is_locked", False))
                     if guardian['Guardian Aadhaar']:
-                        st.session_state[f"member_{idx}_guardian_{g}_aadhaar_bytes"] = guardian['Guardian Aadhaar'].getvalue()
-                        st.session_state[f"member_{idx}_guardian_{g}_aadhaar_filename"] = guardian['Guardian Aadhaar'].name
+                        guardian['Guardian Aadhaar'] = session_blobs.put_upload(f"member_{idx}_guardian_{g}_aadhaar", guardian['Guardian Aadhaar'])
                     guardian['Guardian Bank Statement/Cheque'] = st.file_uploader("Guardian Bank Statement or Cancelled Cheque", key=f"guardian_bank_{idx}_{g}", disabled=members[idx].get("is_locked", False))
                     if guardian['Guardian Bank Statement/Cheque']:
-                        st.session_state[f"member_{idx}_guardian_{g}_bank_bytes"] = guardian['Guardian Bank Statement/Cheque'].getvalue()
-                        st.session_state[f"member_{idx}_guardian_{g}_bank_filename"] = guardian['Guardian Bank Statement/Cheque'].name
+                        guardian['Guardian Bank Statement/Cheque'] = session_blobs.put_upload(f"member_{idx}_guardian_{g}_bank", guardian['Guardian Bank Statement/Cheque'])
                     guardian_list.append(guardian)
             docs['Guardians'] = guardian_list
             all_fields = bool(docs['Birth Certificate']) and num_guardians >= 1
@@ -290,16 +418,13 @@ with st.container():
         else:
             docs['E-Aadhaar'] = st.file_uploader("E-Aadhaar (Masked PDF)", type=["pdf"], key=f"aadhaar_{idx}", disabled=members[idx].get("is_locked", False))
             if docs['E-Aadhaar']:
-                st.session_state[f"member_{idx}_aadhaar_bytes"] = docs['E-Aadhaar'].getvalue()
-                st.session_state[f"member_{idx}_aadhaar_filename"] = docs['E-Aadhaar'].name
+                docs['E-Aadhaar'] = session_blobs.put_upload(f"member_{idx}_aadhaar", docs['E-Aadhaar'])
             docs['PAN Card'] = st.file_uploader("PAN Card", type=["jpg", "jpeg", "png", "pdf"], key=f"pan_{idx}", disabled=members[idx].get("is_locked", False))
             if docs['PAN Card']:
-                st.session_state[f"member_{idx}_pan_bytes"] = docs['PAN Card'].getvalue()
-                st.session_state[f"member_{idx}_pan_filename"] = docs['PAN Card'].name
+                docs['PAN Card'] = session_blobs.put_upload(f"member_{idx}_pan", docs['PAN Card'])
             docs['Cancelled Cheque/Bank Statement'] = st.file_uploader("Cancelled Cheque or Bank Statement", key=f"cheque_{idx}", disabled=members[idx].get("is_locked", False))
             if docs['Cancelled Cheque/Bank Statement']:
-                st.session_state[f"member_{idx}_cheque_bytes"] = docs['Cancelled Cheque/Bank Statement'].getvalue()
-                st.session_state[f"member_{idx}_cheque_filename"] = docs['Cancelled Cheque/Bank Statement'].name
+                docs['Cancelled Cheque/Bank Statement'] = session_blobs.put_upload(f"member_{idx}_cheque", docs['Cancelled Cheque/Bank Statement'])
             docs['Passport Size Photo'] = passport_photo
             docs['Email'] = st.text_input("Email", key=f"email_{idx}", value=members[idx].get("email", ""), disabled=members[idx].get("is_locked", False))
             docs['Phone'] = st.text_input("Phone Number", key=f"phone_{idx}", value=members[idx].get("phone", ""), disabled=members[idx].get("is_locked", False))
@@ -314,8 +439,7 @@ with st.container():
                     nominee['Relation'] = st.text_input("Relation", key=f"nominee_relation_{idx}_{n}", disabled=members[idx].get("is_locked", False))
                     nominee['PAN Card'] = st.file_uploader("Nominee PAN Card", key=f"nominee_pan_{idx}_{n}", disabled=members[idx].get("is_locked", False))
                     if nominee['PAN Card']:
-                        st.session_state[f"member_{idx}_nominee_{n}_pan_bytes"] = nominee['PAN Card'].getvalue()
-                        st.session_state[f"member_{idx}_nominee_{n}_pan_filename"] = nominee['PAN Card'].name
+                        nominee['PAN Card'] = session_blobs.put_upload(f"member_{idx}_nominee_{n}_pan", nominee['PAN Card'])
                     nominee['Occupation'] = st.text_input("Occupation", key=f"nominee_occ_{idx}_{n}", disabled=members[idx].get("is_locked", False))
                     nominee['Income'] = st.text_input("Income", key=f"nominee_income_{idx}_{n}", disabled=members[idx].get("is_locked", False))
                     nominee_list.append(nominee)
@@ -341,28 +465,43 @@ with st.container():
                 members[idx]['is_locked'] = True
                 members[idx]['is_complete'] = True
                 members[idx]['docs'] = docs
+                stage_member(idx, members[idx])
                 if idx + 1 < len(members):
-                    st.session_state.active_tab = idx + 1
-                    st.experimental_rerun()
+                    st.session_state["next_member_tab"] = idx + 1
                 else:
-                    st.success("All members' data submitted. Now submit all documents for onboarding.")
+                    st.session_state["member_notice"] = "All members' data submitted. Now submit all documents for onboarding."
+                st.rerun()
             else:
                 st.warning("Please fill all required fields and upload all required documents before submitting.")
 
-    completed_forms = sum(1 for m in members if m.get("is_complete", False))
+    notice = st.session_state.pop("member_notice", None)
+    if notice:
+        st.success(notice)
+
+    staged_task_id = st.session_state.get("staging", {}).get("tasks", {}).get(idx)
+    staged_task = staged_task_id and get_member_stager().get(staged_task_id)
+    if staged_task:
+        if staged_task.status == staging.TASK_RUNNING:
+            st.caption("☁️ Uploading this member's documents in the background...")
+        elif staged_task.status == staging.TASK_DONE:
+            st.caption("☁️ This member's documents are already in OneDrive.")
+        else:
+            st.caption("☁️ Background upload failed; documents will be uploaded on final submit.")
     st.markdown("</div>", unsafe_allow_html=True)
 
-    st.markdown("---")
-    st.markdown("<span class='progress-label'>Form Completion</span>", unsafe_allow_html=True)
-    percent = completed_forms / max(1, len(members))
-    st.markdown(
-        f"<div class='animated-progress'><div class='animated-progress-bar' style='width:{int(percent*100)}%'></div></div>",
-        unsafe_allow_html=True
-    )
-    st.markdown(f"<span style='color:#b8e9ff;font-size:1.04em;'>{completed_forms} of {len(members)} complete</span>", unsafe_allow_html=True)
-    st.markdown("</div>", unsafe_allow_html=True)
+@st.fragment
+def member_card():
+    # Typing and uploads rerun only this card; the rest of the page reruns
+    # only when the member's name, photo or completion changes.
+    with rerun_timings.measure("member_card"):
+        render_member_card()
+    rerun_if_summary_changed()
 
-if members:
+def render_footer():
+    members = st.session_state["members"]
+    if not members:
+        return
+    completed_forms = sum(1 for m in members if m.get("is_complete", False))
     st.markdown(
         f"""
         <div class='sticky-footer'>
@@ -373,162 +512,101 @@ if members:
                 """,
         unsafe_allow_html=True
     )
-    if completed_forms == len(members):
+    owned_job_id = st.session_state.get("submission_job_id")
+    job_id = owned_job_id or st.query_params.get("job")
+    active_job = owned_job_id and get_submission_worker().get(owned_job_id)
+    job_running = active_job and active_job.status not in (submission.STATUS_DONE, submission.STATUS_FAILED)
+    if completed_forms == len(members) and not job_running:
         if st.button("🚀 Submit & Upload All Documents"):
-            with st.spinner("Collecting and zipping documents..."):
+            with st.spinner("Collecting documents..."):
                 timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
                 family_head_folder = safe_name(st.session_state['family_head_name'])
-                # In-memory zip
-                zip_buffer = io.BytesIO()
-                with zipfile.ZipFile(zip_buffer, "w") as zipf:
-                    for idx2, member in enumerate(members):
-                        name = member['name']
-                        member_folder = f"{family_head_folder}/{safe_name(name)}"
-                        details_lines = [
-                            f"Name: {name}",
-                            f"Age: {member.get('age', '')}",
-                        ]
-                        docs = member.get('docs', {})
-                        if member.get('age', 0) < 18:
-                            details_lines.append("Type: Minor")
-                            details_lines.append(f"Number of Guardians: {len(docs.get('Guardians', []))}")
-                            for idx_g, guardian in enumerate(docs.get('Guardians', [])):
-                                details_lines.append(f"  Guardian {idx_g+1}:")
-                                for gkey, gfile in guardian.items():
-                                    details_lines.append(f"    {gkey}: {'Uploaded' if gfile else 'Not uploaded'}")
-                            details_lines.append(f"Birth Certificate: {'Uploaded' if docs.get('Birth Certificate') else 'Not uploaded'}")
-                            details_lines.append(f"Minor PAN Card: {'Uploaded' if docs.get('Minor PAN Card (optional)') else 'Not uploaded'}")
-                        else:
-                            details_lines.append("Type: Adult")
-                            details_lines.append(f"E-Aadhaar: {'Uploaded' if docs.get('E-Aadhaar') else 'Not uploaded'}")
-                            details_lines.append(f"PAN Card: {'Uploaded' if docs.get('PAN Card') else 'Not uploaded'}")
-                            details_lines.append(f"Cancelled Cheque/Bank Statement: {'Uploaded' if docs.get('Cancelled Cheque/Bank Statement') else 'Not uploaded'}")
-                            details_lines.append(f"Passport Size Photo: {'Uploaded' if docs.get('Passport Size Photo') else 'Not uploaded'}")
-                            details_lines.append(f"Email: {docs.get('Email', '')}")
-                            details_lines.append(f"Phone: {docs.get('Phone', '')}")
-                            details_lines.append(f"Mother Name: {docs.get('Mother Name', '')}")
-                            details_lines.append(f"Place of Birth: {docs.get('Place of Birth', '')}")
-                            nominee_list = docs.get('Nominees', [])
-                            details_lines.append(f"Number of Nominees: {len(nominee_list)}")
-                            for idx_n, nominee in enumerate(nominee_list):
-                                details_lines.append(f"  Nominee {idx_n+1}:")
-                                for nkey, nval in nominee.items():
-                                    if hasattr(nval, 'name'):
-                                        details_lines.append(f"    {nkey}: Uploaded")
-                                    else:
-                                        details_lines.append(f"    {nkey}: {nval}")
-                        # Write details.txt into zip
-                        zipf.writestr(f"{member_folder}/details.txt", '\n'.join(details_lines))
-                        # Add files from session_state
-                        # Minor files
-                        if member.get('age', 0) < 18:
-                            bc_bytes = st.session_state.get(f"member_{idx2}_birthcert_bytes")
-                            bc_fn = st.session_state.get(f"member_{idx2}_birthcert_filename")
-                            if bc_bytes and bc_fn:
-                                zipf.writestr(f"{member_folder}/{bc_fn}", bc_bytes)
-                            pan_bytes = st.session_state.get(f"member_{idx2}_minorpancard_bytes")
-                            pan_fn = st.session_state.get(f"member_{idx2}_minorpancard_filename")
-                            if pan_bytes and pan_fn:
-                                zipf.writestr(f"{member_folder}/{pan_fn}", pan_bytes)
-                            for idx_g, guardian in enumerate(docs.get('Guardians', [])):
-                                gpan_bytes = st.session_state.get(f"member_{idx2}_guardian_{idx_g}_pan_bytes")
-                                gpan_fn = st.session_state.get(f"member_{idx2}_guardian_{idx_g}_pan_filename")
-                                if gpan_bytes and gpan_fn:
-                                    zipf.writestr(f"{member_folder}/guardian_{idx_g+1}_{gpan_fn}", gpan_bytes)
-                                gaadhaar_bytes = st.session_state.get(f"member_{idx2}_guardian_{idx_g}_aadhaar_bytes")
-                                gaadhaar_fn = st.session_state.get(f"member_{idx2}_guardian_{idx_g}_aadhaar_filename")
-                                if gaadhaar_bytes and gaadhaar_fn:
-                                    zipf.writestr(f"{member_folder}/guardian_{idx_g+1}_{gaadhaar_fn}", gaadhaar_bytes)
-                                gbank_bytes = st.session_state.get(f"member_{idx2}_guardian_{idx_g}_bank_bytes")
-                                gbank_fn = st.session_state.get(f"member_{idx2}_guardian_{idx_g}_bank_filename")
-                                if gbank_bytes and gbank_fn:
-                                    zipf.writestr(f"{member_folder}/guardian_{idx_g+1}_{gbank_fn}", gbank_bytes)
-                            photo_bytes = st.session_state.get(f"member_{idx2}_passport_photo_bytes")
-                            photo_fn = st.session_state.get(f"member_{idx2}_passport_photo_filename")
-                            if photo_bytes and photo_fn:
-                                zipf.writestr(f"{member_folder}/{photo_fn}", photo_bytes)
-                        # Adult files
-                        else:
-                            aadhaar_bytes = st.session_state.get(f"member_{idx2}_aadhaar_bytes")
-                            aadhaar_fn = st.session_state.get(f"member_{idx2}_aadhaar_filename")
-                            if aadhaar_bytes and aadhaar_fn:
-                                zipf.writestr(f"{member_folder}/{aadhaar_fn}", aadhaar_bytes)
-                            pan_bytes = st.session_state.get(f"member_{idx2}_pan_bytes")
-                            pan_fn = st.session_state.get(f"member_{idx2}_pan_filename")
-                            if pan_bytes and pan_fn:
-                                zipf.writestr(f"{member_folder}/{pan_fn}", pan_bytes)
-                            cheque_bytes = st.session_state.get(f"member_{idx2}_cheque_bytes")
-                            cheque_fn = st.session_state.get(f"member_{idx2}_cheque_filename")
-                            if cheque_bytes and cheque_fn:
-                                zipf.writestr(f"{member_folder}/{cheque_fn}", cheque_bytes)
-                            photo_bytes = st.session_state.get(f"member_{idx2}_passport_photo_bytes")
-                            photo_fn = st.session_state.get(f"member_{idx2}_passport_photo_filename")
-                            if photo_bytes and photo_fn:
-                                zipf.writestr(f"{member_folder}/{photo_fn}", photo_bytes)
-                            for idx_n, nominee in enumerate(docs.get('Nominees', [])):
-                                npan_bytes = st.session_state.get(f"member_{idx2}_nominee_{idx_n}_pan_bytes")
-                                npan_fn = st.session_state.get(f"member_{idx2}_nominee_{idx_n}_pan_filename")
-                                if npan_bytes and npan_fn:
-                                    zipf.writestr(f"{member_folder}/nominee_{idx_n+1}_{npan_fn}", npan_bytes)
-
-                zip_name = f"{safe_name(st.session_state['family_head_name'])}_onboarding.zip"
-                zip_buffer.seek(0)
-                st.download_button("⬇️ Download All Documents (.zip)", zip_buffer, file_name=zip_name, mime='application/zip')
-
-                st.info("Uploading to OneDrive...")
-                zip_buffer.seek(0)
-                onedrive_link = upload_to_onedrive(
-                    zip_buffer.read(),
-                    ["Client Data", safe_name(st.session_state['family_head_name'])],
-                    zip_name
-                )
-                if onedrive_link:
-                    st.success("Documents uploaded to OneDrive.")
-                else:
-                    st.error("Failed to upload to OneDrive.")
-
-                applicant_email = None
-                for m in members:
-                    if m.get('age', 0) >= 18:
-                        applicant_email = m.get('docs', {}).get('Email', None)
-                        break
-                subject = "✨ SSS Distributors Onboarding Submission Received"
-                admin_body = (
-                    f"New onboarding submission from {st.session_state['family_head_name']}.\n"
-                    f"Submission time: {timestamp}\n"
-                    f"Family members: {', '.join([m['name'] for m in members])}\n"
-                    f"Download all documents from OneDrive: {onedrive_link}\n"
-                )
-                applicant_body = (
-                    f"Dear {st.session_state['family_head_name']},\n\n"
-                    "Your onboarding submission is received. We will review and get back to you shortly.\n\n"
-                    "Best regards,\nSSS Distributors Onboarding Team"
-                )
-                emails_ok = send_email_graph_api(
-                    EMAIL_ADDRESS, subject, admin_body, attachment_bytes=zip_buffer.getvalue(), attachment_filename=zip_name
+                spec = submission_spec(
+                    st.session_state['family_head_name'], members,
+                    [member_files(session_blobs, i, m) for i, m in enumerate(members)], timestamp,
                 )
-                if applicant_email:
-                    emails_ok = emails_ok and send_email_graph_api(
-                        applicant_email, subject, applicant_body, attachment_bytes=zip_buffer.getvalue(), attachment_filename=zip_name
-                    )
-                if emails_ok:
-                    st.success("Confirmation emails sent!")
-                else:
-                    st.error("Failed to send emails (see above for details).")
-
-            st.markdown("""
-                ### Next Steps
-                - You'll receive an AOF (Account Opening Form) shortly for confirmation.
-                - Post confirmation, approve the following emails from BSE StarMF:
-                    1. **E-log**: After verifying AOF details
-                    2. **Nominee Authentication**
-                    3. **E-Mandate** <span class="tooltip-wrap"><span class="tooltip-icon">ℹ️</span>
-                        <span class="tooltip-box">
-                            This mandate authorizes BSE Star MF to debit funds exclusively from your registered bank account for investment purposes.<br>
-                            The maximum transaction limit specified ensures that only you can initiate investments in your name.<br>
-                            This e-mandate will apply to all SIPs and lump sum transactions, and serves as a secure fallback should internet banking be temporarily unavailable.
-                        </span>
-                    </span>: Authorizes BSE to debit your account for future SIPs or lump sum investments.
-                """, unsafe_allow_html=True)
-            st.info("The e-mandate provides a secure, single point of authorization for all your mutual fund investments through BSE Star MF.")
+                folder_path = spec["folder_path"]
+                member_staging = st.session_state.get("staging")
+                if member_staging and len(member_staging["tasks"]) == len(members):
+                    # Documents are already in OneDrive; the upload step only
+                    # adds details.txt and a manifest, then renames the folder.
+                    spec["staging"] = {
+                        "path": folder_path + [member_staging["folder"]],
+                        "tasks": [member_staging["tasks"][i] for i in range(len(members))],
+                        "final_name": f"{family_head_folder}_onboarding_{timestamp}",
+                        "details": [
+                            (f"{safe_name(m['name'])}/details.txt", member_details_text(m)) for m in members
+                        ],
+                        "manifest": {
+                            "family": st.session_state['family_head_name'],
+                            "submitted_at": timestamp,
+                            "members": [
+                                # "files" is filled in from what was uploaded.
+                                {"name": m['name'], "folder": safe_name(m['name'])}
+                                for m in members
+                            ],
+                        },
+                    }
+            try:
+                job_id = get_submission_worker().submit(spec)
+            except submission.QueueFullError as e:
+                st.error(str(e))
+            else:
+                st.session_state["submission_job_id"] = owned_job_id = job_id
+                st.query_params["job"] = job_id
+                # The job owns the staging folder now; the next family starts fresh.
+                st.session_state.pop("staging", None)
+    if job_id:
+        render_submission(job_id, owner=job_id == owned_job_id)
     st.markdown("</div></div>", unsafe_allow_html=True)
+
+@st.fragment
+def footer():
+    with rerun_timings.measure("footer"):
+        render_footer()
+
+if "members_count" not in st.session_state:
+    st.session_state["members_count"] = 1
+if "family_head_name" not in st.session_state:
+    st.session_state["family_head_name"] = ""
+if "family_head_age" not in st.session_state:
+    st.session_state["family_head_age"] = 0
+if "members" not in st.session_state:
+    reset_members()
+
+if st.session_state.get("members") and st.session_state.get("family_head_name"):
+    if not st.session_state["members"][0]["name"]:
+        st.session_state["members"][0]["name"] = st.session_state["family_head_name"]
+    if not st.session_state["members"][0]["age"]:
+        st.session_state["members"][0]["age"] = st.session_state["family_head_age"]
+
+with st.sidebar:
+    sidebar()
+
+with st.container():
+    st.markdown("<div class='glass-card'>", unsafe_allow_html=True)
+    st.markdown("---")
+    family_form()
+    member_card()
+
+    members = st.session_state["members"]
+    completed_forms = sum(1 for m in members if m.get("is_complete", False))
+    st.markdown("---")
+    st.markdown("<span class='progress-label'>Form Completion</span>", unsafe_allow_html=True)
+    percent = completed_forms / max(1, len(members))
+    st.markdown(
+        f"<div class='animated-progress'><div class='animated-progress-bar' style='width:{int(percent*100)}%'></div></div>",
+        unsafe_allow_html=True
+    )
+    st.markdown(f"<span style='color:#b8e9ff;font-size:1.04em;'>{completed_forms} of {len(members)} complete</span>", unsafe_allow_html=True)
+    st.markdown("</div>", unsafe_allow_html=True)
+
+footer()
+st.session_state["full_run_active"] = False
+rerun_seconds = time.perf_counter() - script_started
+rerun_timings.record("full_rerun", rerun_seconds)
+tracing.record("app.rerun", rerun_seconds, members=len(st.session_state["members"]))
+
+# After the page is out, so building the client never delays a render.
+if PREWARM_GRAPH:
+    start_graph_prewarm()
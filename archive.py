@@ -0,0 +1,245 @@
+import base64
+import io
+import os
+import tempfile
+import threading
+import time
+import zipfile
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+# Archives stay in memory up to this size and spill to a temp file beyond it.
+SPOOL_MAX_MEMORY = 8 * 1024 * 1024
+READ_CHUNK_SIZE = 3 * 256 * 1024
+
+# Formats that are already compressed gain nothing from deflate.
+STORED_EXTENSIONS = {
+    ".jpg", ".jpeg", ".png", ".gif", ".webp", ".heic", ".pdf", ".zip", ".gz", ".docx", ".xlsx",
+}
+PARALLEL_COMPRESS_THRESHOLD = 256 * 1024
+MIN_DEFLATE_SAVING = 0.05
+# Scans and details.txt shrink almost as much at 3 as at 6, in half the time.
+DEFLATE_LEVEL = 3
+COMPRESS_WORKERS = min(4, os.cpu_count() or 1)
+
+
+class SpooledArchive:
+    # One backing file per submission: the zip is written once and the upload,
+    # download and email attachment all read from it instead of copying it.
+    def __init__(self, max_memory=SPOOL_MAX_MEMORY, path=None):
+        # path: read an archive already written to disk, e.g. by another
+        # process, instead of spooling a new one.
+        if path:
+            self._file = open(path, "rb")
+        else:
+            self._file = tempfile.SpooledTemporaryFile(max_size=max_memory, suffix=".zip")
+        self._b64 = None
+        self._lock = threading.Lock()
+        self._b64_lock = threading.Lock()
+
+    def open_zip(self, mode="w", compression=zipfile.ZIP_STORED):
+        self._b64 = None
+        return zipfile.ZipFile(self._file, mode, compression=compression)
+
+    @property
+    def size(self):
+        with self._lock:
+            self._file.seek(0, os.SEEK_END)
+            return self._file.tell()
+
+    @property
+    def on_disk(self):
+        return bool(getattr(self._file, "_rolled", True))
+
+    def fileobj(self):
+        self._file.seek(0)
+        return self._file
+
+    def read_range(self, offset, length):
+        with self._lock:
+            self._file.seek(offset)
+            return self._file.read(length)
+
+    def reader(self):
+        # Independent read position, so the upload and the emails can read
+        # the same archive from different threads at once.
+        return ArchiveReader(self)
+
+    def iter_chunks(self, chunk_size=READ_CHUNK_SIZE):
+        offset = 0
+        while True:
+            chunk = self.read_range(offset, chunk_size)
+            if not chunk:
+                break
+            offset += len(chunk)
+            yield chunk
+
+    def read(self):
+        return b"".join(self.iter_chunks())
+
+    def b64(self):
+        # Encoded at most once per archive; chunk size is a multiple of 3 so
+        # the pieces concatenate into one valid base64 string.
+        with self._b64_lock:
+            if self._b64 is None:
+                self._b64 = "".join(base64.b64encode(chunk).decode() for chunk in self.iter_chunks())
+            return self._b64
+
+    def close(self):
+        self._b64 = None
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class ArchiveReader(io.RawIOBase):
+    def __init__(self, archive):
+        self._archive = archive
+        self._pos = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._pos
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        if whence == os.SEEK_SET:
+            self._pos = offset
+        elif whence == os.SEEK_CUR:
+            self._pos += offset
+        else:
+            self._pos = self._archive.size + offset
+        return self._pos
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = max(0, self._archive.size - self._pos)
+        data = self._archive.read_range(self._pos, size)
+        self._pos += len(data)
+        return data
+
+    def readinto(self, buffer):
+        data = self.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+
+def compression_for(arcname):
+    ext = os.path.splitext(arcname)[1].lower()
+    return zipfile.ZIP_STORED if ext in STORED_EXTENSIONS else zipfile.ZIP_DEFLATED
+
+
+def _deflate(data, level):
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+    return compressor.compress(data) + compressor.flush()
+
+
+class _Precompressed:
+    # Stands in for zipfile's compressor so an entry deflated on a worker
+    # thread can be written through the normal ZipFile.open() path, which
+    # still computes the CRC and sizes from the original bytes.
+    def __init__(self, payload):
+        self._payload = payload
+
+    def compress(self, data):
+        return b""
+
+    def flush(self):
+        payload, self._payload = self._payload, b""
+        return payload
+
+
+def _write_precompressed(zipf, zinfo, data, payload):
+    with zipf.open(zinfo, "w", force_zip64=len(data) > zipfile.ZIP64_LIMIT) as entry:
+        entry._compressor = _Precompressed(payload)
+        entry.write(data)
+
+
+def _precompressed_supported():
+    # _Precompressed swaps out a private attribute of zipfile's entry writer.
+    # Check once, by round-tripping a small entry, that this Python still
+    # writes it correctly; if not, ArchiveWriter falls back to writestr().
+    data = b"precompressed entry probe " * 64
+    buffer = io.BytesIO()
+    try:
+        with zipfile.ZipFile(buffer, "w") as zipf:
+            zinfo = zipfile.ZipInfo("probe.txt")
+            zinfo.compress_type = zipfile.ZIP_DEFLATED
+            _write_precompressed(zipf, zinfo, data, _deflate(data, DEFLATE_LEVEL))
+        with zipfile.ZipFile(buffer) as zipf:
+            return zipf.read("probe.txt") == data
+    except Exception:
+        return False
+
+
+PRECOMPRESSED_SUPPORTED = _precompressed_supported()
+
+
+class ArchiveWriter:
+    # Chooses a compression method per entry and deflates large entries on a
+    # thread pool (zlib releases the GIL). Entries are still written to the
+    # zip in the order they were added, so the output is a standard archive.
+    def __init__(self, zipf, max_workers=COMPRESS_WORKERS, level=DEFLATE_LEVEL):
+        self.zipf = zipf
+        self.level = level
+        self.max_workers = max_workers
+        # Parallel deflate needs the precompressed write path.
+        parallel = max_workers > 1 and PRECOMPRESSED_SUPPORTED
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="zip") if parallel else None
+        self._pending = []
+
+    def add(self, arcname, data):
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        method = compression_for(arcname)
+        if method == zipfile.ZIP_DEFLATED and self._pool and len(data) >= PARALLEL_COMPRESS_THRESHOLD:
+            future = self._pool.submit(_deflate, data, self.level)
+        else:
+            future = None
+        self._pending.append((arcname, data, method, future))
+        # Bound the number of compressed payloads held at once.
+        if len(self._pending) > self.max_workers * 2:
+            self._write(*self._pending.pop(0))
+
+    def _zinfo(self, arcname, method):
+        zinfo = zipfile.ZipInfo(arcname, date_time=time.localtime(time.time())[:6])
+        zinfo.compress_type = method
+        zinfo.external_attr = 0o600 << 16
+        return zinfo
+
+    def _write(self, arcname, data, method, future):
+        if future is not None:
+            return self._write_deflated(arcname, data, future.result())
+        if method == zipfile.ZIP_DEFLATED and len(data) >= PARALLEL_COMPRESS_THRESHOLD and PRECOMPRESSED_SUPPORTED:
+            # No pool: deflate inline, still storing when it does not pay off.
+            return self._write_deflated(arcname, data, _deflate(data, self.level))
+        self.zipf.writestr(self._zinfo(arcname, method), data, compresslevel=self.level)
+
+    def _write_deflated(self, arcname, data, payload):
+        if len(payload) > len(data) * (1 - MIN_DEFLATE_SAVING):
+            self.zipf.writestr(self._zinfo(arcname, zipfile.ZIP_STORED), data)
+            return
+        _write_precompressed(self.zipf, self._zinfo(arcname, zipfile.ZIP_DEFLATED), data, payload)
+
+    def close(self):
+        while self._pending:
+            self._write(*self._pending.pop(0))
+        if self._pool:
+            self._pool.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        if exc_type is None:
+            self.close()
+        elif self._pool:
+            self._pool.shutdown(cancel_futures=True)
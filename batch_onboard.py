@@ -0,0 +1,256 @@
+"""Onboard many families without the browser.
+
+Reads families from a directory or a JSON manifest, builds each family's
+archive in a process pool, then uploads and emails through the same
+SubmissionWorker, admission controller and journal as the app. Families whose
+identical documents were already submitted are skipped, so an interrupted run
+can simply be started again. Writes a CSV report with one row per family.
+
+Directory layout (one folder per family; member folders are optional for a
+one-person family):
+
+    families/
+      Ravi Kumar/
+        Ravi Kumar/  aadhaar.pdf  pan.jpg  cheque.pdf  photo.jpg  member.json
+        Asha Kumar/  ...
+
+member.json is optional: {"age": 40, "email": "...", "phone": "...",
+"mother": "...", "birthplace": "...", "nominees": [{"name": "...", "relation": "..."}]}.
+Members without an age are treated as adults.
+
+Manifest: {"families": [{"name": "...", "members": [{"name": "...", "age": 40,
+"email": "...", "files": ["docs/aadhaar.pdf", ...]}]}]}, with file paths
+relative to the manifest.
+
+Settings (Graph credentials, GRAPH_* endpoints and limits, image settings)
+come from .streamlit/secrets.toml, overridden by environment variables.
+
+    python batch_onboard.py families/ [--report report.csv] [--processes 4]
+        [--uploads 4] [--dry-run --archive-dir out/]
+"""
+import argparse
+import csv
+import json
+import os
+import pathlib
+import re
+import shutil
+import sys
+import tempfile
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+
+import journal
+import onboarding
+import onedrive
+import submission
+import tracing
+
+# Words in a file name that say which document it is, for details.txt.
+DOCUMENT_KEYWORDS = [
+    ("E-Aadhaar", {"aadhaar", "aadhar", "eaadhaar"}),
+    ("PAN Card", {"pan"}),
+    ("Cancelled Cheque/Bank Statement", {"cheque", "check", "bank", "statement"}),
+    ("Passport Size Photo", {"photo", "passport"}),
+    ("Birth Certificate", {"birth"}),
+]
+REPORT_FIELDS = [
+    "family", "status", "members", "files", "archive_bytes", "web_url", "share_link", "seconds", "errors",
+]
+
+
+def _member(name, info, paths):
+    docs = {}
+    for path in paths:
+        words = set(re.split(r"[^a-z0-9]+", path.stem.lower()))
+        for key, keywords in DOCUMENT_KEYWORDS:
+            if words & keywords:
+                docs.setdefault(key, True)
+    docs.update({
+        "Email": info.get("email", ""),
+        "Phone": info.get("phone", ""),
+        "Mother Name": info.get("mother", ""),
+        "Place of Birth": info.get("birthplace", ""),
+        "Nominees": [
+            {"Name": nominee.get("name", ""), "Relation": nominee.get("relation", "")}
+            for nominee in info.get("nominees", [])
+        ],
+    })
+    member = {"name": info.get("name", name), "age": int(info.get("age", 18)), "docs": docs}
+    files = [(onboarding.safe_name(path.stem) + path.suffix.lower(), path) for path in paths]
+    return member, files
+
+
+def _read_member_info(folder):
+    info_path = folder / "member.json"
+    if info_path.exists():
+        return json.loads(info_path.read_text())
+    return {}
+
+
+def families_from_directory(root):
+    families = []
+    for family_dir in sorted(p for p in pathlib.Path(root).iterdir() if p.is_dir()):
+        member_dirs = sorted(p for p in family_dir.iterdir() if p.is_dir())
+        if not member_dirs:
+            member_dirs = [family_dir]
+        members, files = [], []
+        for member_dir in member_dirs:
+            paths = sorted(p for p in member_dir.iterdir() if p.is_file() and p.name != "member.json")
+            member, member_files = _member(member_dir.name, _read_member_info(member_dir), paths)
+            members.append(member)
+            files.append(member_files)
+        families.append({"name": family_dir.name, "members": members, "files": files})
+    return families
+
+
+def families_from_manifest(path):
+    base = pathlib.Path(path).resolve().parent
+    with open(path) as f:
+        manifest = json.load(f)
+    families = []
+    for family in manifest["families"]:
+        members, files = [], []
+        for info in family["members"]:
+            paths = [base / file_path for file_path in info.get("files", [])]
+            member, member_files = _member(info["name"], info, paths)
+            members.append(member)
+            files.append(member_files)
+        families.append({"name": family["name"], "members": members, "files": files})
+    return families
+
+
+def run(families, config, args):
+    image_settings = onboarding.image_settings(config)
+    archive_dir = args.archive_dir or tempfile.mkdtemp(prefix="onboarding-archives-")
+    os.makedirs(archive_dir, exist_ok=True)
+    submission_journal = journal.SubmissionJournal(
+        args.journal or config.get("SUBMISSION_JOURNAL_PATH", "data/submissions.sqlite3")
+    )
+    worker = None
+    if not args.dry_run:
+        credential = onboarding.graph_credential(config)
+        client = onboarding.graph_client(config, credential, admission=onboarding.admission_controller(config))
+        worker = submission.SubmissionWorker(
+            client, onboarding.EMAIL_ADDRESS, max_workers=args.uploads, max_pending=len(families) + 1,
+            folder_cache=onedrive.FolderCache(ttl=3600), image_settings=image_settings, journal=submission_journal,
+            share_link_days=int(config.get("SHARE_LINK_EXPIRY_DAYS", 7)),
+        )
+
+    # Results are keyed by each family's position, not its name: two families
+    # may share a name (or one safe_name), and each gets its own archive
+    # directory so one family's zip never replaces another's.
+    rows = {}
+    jobs = {}
+    started = {}
+    with ProcessPoolExecutor(max_workers=args.processes) as pool:
+        # Documents are hashed in the pool too, so the journal check does not
+        # read every family's files serially before the first archive starts;
+        # the hash is handed to the worker rather than computed a third time.
+        hashes = {}
+        for index, family in enumerate(families):
+            name = family["name"]
+            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+            spec = onboarding.submission_spec(name, family["members"], family["files"], timestamp)
+            rows[index] = {
+                "family": name, "members": len(family["members"]),
+                "files": sum(len(member_files) for member_files in family["files"]),
+            }
+            started[index] = time.time()
+            hashes[pool.submit(journal.content_hash, spec["entries"])] = (index, spec)
+
+        futures = {}
+        for future in as_completed(hashes):
+            index, spec = hashes[future]
+            row = rows[index]
+            try:
+                entries_hash = future.result()
+            except Exception as e:
+                row.update(status="failed", errors=f"documents: {e}")
+                continue
+            record = submission_journal.lookup(journal.submission_key(spec["family_name"], entries_hash))
+            if record and record["completed_at"] and not args.dry_run:
+                row["status"] = "already submitted"
+                continue
+            family_dir = os.path.join(archive_dir, str(index + 1))
+            os.makedirs(family_dir, exist_ok=True)
+            path = os.path.join(family_dir, spec["zip_name"])
+            build = pool.submit(onboarding.build_archive_file, path, spec["entries"], image_settings)
+            futures[build] = (index, spec, path, entries_hash)
+
+        for future in as_completed(futures):
+            index, spec, path, entries_hash = futures[future]
+            row = rows[index]
+            try:
+                row["archive_bytes"] = future.result()
+            except Exception as e:
+                row.update(status="failed", errors=f"archive: {e}")
+                continue
+            if args.dry_run:
+                row.update(status="archived", seconds=round(time.time() - started[index], 2))
+                continue
+            # Uploads start as soon as each archive is ready, bounded by the
+            # worker's threads and the admission controller.
+            spec["archive_path"] = path
+            jobs[index] = worker.get(worker.submit(spec, entries_hash=entries_hash))
+            print(f"archived {spec['family_name']} ({len(jobs)}/{len(futures)})", file=sys.stderr)
+
+    while any(job.status not in (submission.STATUS_DONE, submission.STATUS_FAILED) for job in jobs.values()):
+        time.sleep(0.2)
+    for index, job in jobs.items():
+        snap = job.snapshot()
+        rows[index].update(
+            status="already submitted" if snap["duplicate"] else snap["status"],
+            web_url=snap["web_url"], share_link=snap["share_link"],
+            seconds=round((job.finished_at or time.time()) - started[index], 2),
+            errors="; ".join(f"{step}: {error}" for step, error in snap["errors"].items()),
+        )
+    for job in set(jobs.values()):
+        if job.archive:
+            job.archive.close()
+    if not args.archive_dir:
+        shutil.rmtree(archive_dir, ignore_errors=True)
+    submission_journal.close()
+    return [rows[index] for index in range(len(families))]
+
+
+def write_report(rows, path):
+    with open(path, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=REPORT_FIELDS)
+        writer.writeheader()
+        for row in rows:
+            writer.writerow({field: row.get(field, "") for field in REPORT_FIELDS})
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("source", help="directory of family folders, or a JSON manifest")
+    parser.add_argument("--report", default="onboarding_report.csv")
+    parser.add_argument("--processes", type=int, default=os.cpu_count() or 1, help="archive-building processes")
+    parser.add_argument("--uploads", type=int, default=4, help="families uploading and emailing at once")
+    parser.add_argument("--secrets", default=".streamlit/secrets.toml")
+    parser.add_argument("--journal", help="submission journal (default: SUBMISSION_JOURNAL_PATH)")
+    parser.add_argument("--archive-dir", help="keep the built archives here")
+    parser.add_argument("--dry-run", action="store_true", help="build archives only; no Graph calls")
+    args = parser.parse_args()
+
+    config = onboarding.load_config(args.secrets)
+    tracing.configure_logging(config.get("TRACE_LOG_LEVEL", "WARNING"))
+    if os.path.isdir(args.source):
+        families = families_from_directory(args.source)
+    else:
+        families = families_from_manifest(args.source)
+    start = time.perf_counter()
+    rows = run(families, config, args)
+    write_report(rows, args.report)
+    elapsed = time.perf_counter() - start
+    counts = Counter(row.get("status", "failed") for row in rows)
+    summary = ", ".join(f"{count} {status}" for status, count in sorted(counts.items()))
+    print(f"{len(rows)} families in {elapsed:.1f}s: {summary}. Report: {args.report}")
+    return 0 if all(row.get("status") in ("done", "archived", "already submitted") for row in rows) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,130 @@
+"""Compare the submission archive writer against the old serial ZIP_STORED zip.
+
+Builds a realistic 10-member family (photos, PDFs, a few uncompressed TIFF
+scans and details.txt files) and reports archive size and build time.
+
+    python benchmarks/bench_archive.py [--members 10] [--runs 5] [--workers 4]
+"""
+import argparse
+import io
+import os
+import random
+import statistics
+import sys
+import time
+import zipfile
+import zlib
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PIL import Image, ImageDraw  # noqa: E402
+
+from archive import ArchiveWriter, SpooledArchive  # noqa: E402
+
+
+def _photo(rng, size, quality=92):
+    # Noisy gradient so JPEG cannot shrink it to nothing, like a phone photo.
+    img = Image.radial_gradient("L").resize(size).convert("RGB")
+    noise = Image.frombytes("RGB", size, rng.randbytes(size[0] * size[1] * 3))
+    out = io.BytesIO()
+    Image.blend(img, noise, 0.25).save(out, "JPEG", quality=quality)
+    return out.getvalue()
+
+
+def _scan(rng, size, fmt):
+    # Mostly white page with lines of "text", as a flatbed scanner produces.
+    img = Image.new("L", size, 255)
+    draw = ImageDraw.Draw(img)
+    for y in range(40, size[1] - 40, 28):
+        x = 40
+        while x < size[0] - 80:
+            width = rng.randint(10, 60)
+            draw.rectangle([x, y, x + width, y + 12], fill=rng.randint(0, 80))
+            x += width + rng.randint(6, 14)
+    out = io.BytesIO()
+    img.save(out, fmt)
+    return out.getvalue()
+
+
+def _pdf(rng, size):
+    stream = zlib.compress(rng.randbytes(size))
+    header = b"%%PDF-1.4\n1 0 obj << /Length %d /Filter /FlateDecode >>\nstream\n" % len(stream)
+    return header + stream + b"\nendstream\nendobj\n%%EOF\n"
+
+
+def build_fixture(members, seed=7):
+    rng = random.Random(seed)
+    photo = _photo(rng, (3000, 4000))
+    entries = []
+    for idx in range(members):
+        folder = f"Family_Head/Member_{idx + 1}"
+        entries.append((f"{folder}/details.txt", "\n".join(
+            [f"Name: Member {idx + 1}", f"Age: {30 + idx}", "Type: Adult", "E-Aadhaar: Uploaded", "PAN Card: Uploaded"]
+            + [f"  Nominee {n + 1}: Name: Nominee {n + 1} Relation: Spouse" for n in range(2)]
+        )))
+        entries.append((f"{folder}/aadhaar.pdf", _pdf(rng, 600 * 1024)))
+        entries.append((f"{folder}/pan.jpg", _photo(rng, (1600, 1000), quality=90)))
+        entries.append((f"{folder}/passport_photo.jpg", photo if idx % 3 else _photo(rng, (3000, 4000))))
+        if idx % 3 == 0:
+            entries.append((f"{folder}/cheque.tiff", _scan(rng, (2480, 3508), "TIFF")))
+        elif idx % 3 == 1:
+            entries.append((f"{folder}/cheque.bmp", _scan(rng, (1700, 2200), "BMP")))
+        else:
+            entries.append((f"{folder}/cheque.png", _scan(rng, (1700, 2200), "PNG")))
+        entries.append((f"{folder}/nominee_1_pan.jpg", _photo(rng, (1600, 1000), quality=90)))
+    return entries
+
+
+def build_baseline(entries):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w") as zipf:
+        for arcname, data in entries:
+            zipf.writestr(arcname, data)
+    return buffer.getbuffer().nbytes
+
+
+def build_writer(entries, workers, verify=False):
+    archive = SpooledArchive()
+    with archive.open_zip() as zipf, ArchiveWriter(zipf, max_workers=workers) as writer:
+        for arcname, data in entries:
+            writer.add(arcname, data)
+    size = archive.size
+    if verify and zipfile.ZipFile(archive.reader()).testzip() is not None:
+        raise SystemExit("ArchiveWriter produced a corrupt zip")
+    archive.close()
+    return size
+
+
+def measure(func, runs):
+    times = []
+    size = 0
+    for _ in range(runs):
+        start = time.perf_counter()
+        size = func()
+        times.append(time.perf_counter() - start)
+    return size, statistics.median(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--members", type=int, default=10)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--workers", type=int, default=4)
+    args = parser.parse_args()
+
+    entries = build_fixture(args.members)
+    raw = sum(len(data) if isinstance(data, bytes) else len(data.encode()) for _, data in entries)
+    build_writer(entries, args.workers, verify=True)
+    print(f"fixture: {args.members} members, {len(entries)} files, {raw / 2**20:.1f} MiB raw, {os.cpu_count()} CPUs")
+    print(f"{'writer':<28}{'size MiB':>10}{'median s':>10}")
+    results = [
+        ("ZipFile STORED (before)", measure(lambda: build_baseline(entries), args.runs)),
+        ("ArchiveWriter, 1 thread", measure(lambda: build_writer(entries, 1), args.runs)),
+        (f"ArchiveWriter, {args.workers} threads", measure(lambda: build_writer(entries, args.workers), args.runs)),
+    ]
+    for label, (size, seconds) in results:
+        print(f"{label:<28}{size / 2**20:>10.2f}{seconds:>10.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""Time to first render of a cold app process.
+
+Every run starts a fresh Python process, which imports Streamlit's AppTest,
+then times the first AppTest.run() of the app: module imports, secrets,
+cached resources and the whole first page. No Graph calls are made before a
+submit, so no fake server is needed. Also reports whether msal and requests
+were imported before the first paint and which images the page loads from
+another host.
+
+--app compares another checkout, e.g. the tree before a change:
+
+    git worktree add /tmp/before HEAD~1
+    python benchmarks/bench_cold_start.py --app /tmp/before/app.py
+
+    python benchmarks/bench_cold_start.py [--runs 7] [--app app.py]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import textwrap
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Runs in the child process; prints one JSON line.
+PROBE = textwrap.dedent("""
+    import json, logging, sys, time
+    from streamlit.testing.v1 import AppTest
+
+    logging.getLogger("streamlit.runtime.scriptrunner_utils.script_run_context").disabled = True
+    at = AppTest.from_file(sys.argv[1], default_timeout=60)
+    for key in ("ONEDRIVE_CLIENT_ID", "ONEDRIVE_CLIENT_SECRET", "ONEDRIVE_TENANT_ID"):
+        at.secrets[key] = "cold-start"
+    start = time.perf_counter()
+    at.run()
+    first = time.perf_counter() - start
+    start = time.perf_counter()
+    at.run()
+    second = time.perf_counter() - start
+    urls = [img.url for element in at.get("image") for img in element.proto.imgs]
+    print(json.dumps({
+        "first": first,
+        "second": second,
+        "exception": bool(at.exception),
+        "msal": "msal" in sys.modules,
+        "requests": "requests" in sys.modules,
+        "external_images": [url for url in urls if url.startswith(("http://", "https://"))],
+    }))
+""")
+
+
+def probe(app):
+    # cwd is the app's checkout so its own modules are the ones imported.
+    result = subprocess.run(
+        [sys.executable, "-c", PROBE, app], cwd=os.path.dirname(app),
+        capture_output=True, text=True, check=True,
+    )
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=7)
+    parser.add_argument("--app", default=os.path.join(ROOT, "app.py"))
+    args = parser.parse_args()
+
+    app = os.path.abspath(args.app)
+    probe(app)  # warms the OS file cache and __pycache__
+    rows = [probe(app) for _ in range(args.runs)]
+    if any(row["exception"] for row in rows):
+        raise SystemExit("the app raised during the first run")
+    first = [row["first"] * 1000 for row in rows]
+    second = [row["second"] * 1000 for row in rows]
+    print(app)
+    print(f"first render:  median {statistics.median(first):.0f} ms, min {min(first):.0f} ms, "
+          f"max {max(first):.0f} ms over {args.runs} cold processes")
+    print(f"second render: median {statistics.median(second):.0f} ms")
+    print(f"imported before first paint: msal {rows[0]['msal']}, requests {rows[0]['requests']}")
+    print(f"external images: {', '.join(rows[0]['external_images']) or 'none'}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+"""Lookup latency of the local submission index.
+
+Fills a fresh journal with --submissions completed submissions (random
+families of 1-6 members with emails and phone numbers), then times
+SubmissionJournal.search for a family name, a member's email, a phone number
+typed with and without the country code, and the latest-submissions list.
+
+    python benchmarks/bench_index.py [--submissions 1000 10000 50000] [--queries 200]
+"""
+import argparse
+import hashlib
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import journal  # noqa: E402
+
+FIRST_NAMES = ["Ravi", "Asha", "Vikram", "Priya", "Arjun", "Meera", "Karan", "Divya", "Suresh", "Lakshmi",
+               "Rahul", "Anita", "Manoj", "Kavya", "Sanjay", "Neha", "Amit", "Pooja", "Rohit", "Sneha"]
+LAST_NAMES = ["Kumar", "Sharma", "Patel", "Iyer", "Reddy", "Nair", "Gupta", "Singh", "Rao", "Menon",
+              "Joshi", "Das", "Pillai", "Shah", "Verma", "Bose", "Kulkarni", "Mehta", "Chopra", "Naidu"]
+
+
+def fill(submission_journal, count, rng):
+    families = []
+    for index in range(count):
+        last = rng.choice(LAST_NAMES)
+        members = []
+        for position in range(rng.randint(1, 6)):
+            first = rng.choice(FIRST_NAMES)
+            members.append({
+                "name": f"{first} {last}", "age": rng.randint(1, 80),
+                "email": f"{first.lower()}.{last.lower()}{index}.{position}@example.com",
+                "phone": f"+91 {rng.randint(70000, 99999)} {rng.randint(10000, 99999)}",
+            })
+        family = members[0]["name"]
+        entries_hash = hashlib.sha256(f"{family}{index}".encode()).hexdigest()
+        key = journal.submission_key(family, entries_hash)
+        submission_journal.begin(key, family, entries_hash)
+        submission_journal.complete(key)
+        submission_journal.index_submission(
+            key, members, time.time() - rng.random() * 365 * 86400, rng.randint(2**20, 50 * 2**20),
+            f"ITEM{index}", f"https://contoso-my.sharepoint.com/personal/x/Documents/{index}.zip",
+        )
+        families.append(members)
+    return families
+
+
+def time_queries(submission_journal, queries):
+    samples = []
+    for query in queries:
+        start = time.perf_counter()
+        submission_journal.search(query, limit=20)
+        samples.append(time.perf_counter() - start)
+    samples.sort()
+    return statistics.median(samples), samples[min(len(samples) - 1, int(0.95 * len(samples)))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--submissions", type=int, nargs="+", default=[1000, 10000, 50000])
+    parser.add_argument("--queries", type=int, default=200)
+    args = parser.parse_args()
+
+    print(f"{'submissions':>12}{'fill s':>8}  {'query':<22}{'p50 ms':>8}{'p95 ms':>8}")
+    for count in args.submissions:
+        rng = random.Random(count)
+        with tempfile.TemporaryDirectory() as tmp:
+            submission_journal = journal.SubmissionJournal(os.path.join(tmp, "submissions.sqlite3"))
+            start = time.perf_counter()
+            families = fill(submission_journal, count, rng)
+            fill_seconds = time.perf_counter() - start
+            picks = [rng.choice(families) for _ in range(args.queries)]
+            phones = [rng.choice(members)["phone"] for members in picks]
+            kinds = [
+                ("family name", [members[0]["name"] for members in picks]),
+                ("email", [rng.choice(members)["email"] for members in picks]),
+                ("phone as typed", phones),
+                ("phone, 10 digits", [phone.replace(" ", "")[-10:] for phone in phones]),
+                ("latest 20", [""] * args.queries),
+            ]
+            for position, (kind, queries) in enumerate(kinds):
+                p50, p95 = time_queries(submission_journal, queries)
+                prefix = f"{count:>12}{fill_seconds:>8.1f}" if position == 0 else " " * 20
+                print(f"{prefix}  {kind:<22}{p50 * 1000:>8.3f}{p95 * 1000:>8.3f}", flush=True)
+            submission_journal.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+"""Measure what one interaction costs for a 10-member family.
+
+Drives an app through Streamlit's AppTest with a family of --members people,
+each with a name and passport photo, then edits a field on the first member
+card --runs times. Each app runs in its own process with its checkout's
+modules, as in bench_cold_start.py.
+
+AppTest always executes the whole script, so for the current app the numbers
+come from its own rerun timings: "member_card" is what the fragment rerun for
+the edit costs in a browser. --baseline measures the page from before it was
+split into fragments, e.g.:
+
+    git worktree add /tmp/before 187ce3e~1
+    python benchmarks/bench_reruns.py --baseline /tmp/before/app.py
+
+Without --baseline, "before" is only an estimate: the current script run
+whole ("full_rerun"), which is not the pre-fragment page.
+
+    python benchmarks/bench_reruns.py [--members 10] [--runs 20] [--app app.py] [--baseline APP]
+"""
+import argparse
+import io
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _photo():
+    from PIL import Image
+
+    out = io.BytesIO()
+    Image.radial_gradient("L").resize((1200, 1600)).convert("RGB").save(out, "JPEG", quality=90)
+    return out.getvalue()
+
+
+def measure(app, members, runs):
+    # Runs in the child process, whose cwd and sys.path[0] are the app's
+    # checkout; returns the median wall time and the app's own timings, if
+    # it has them.
+    from streamlit.testing.v1 import AppTest
+
+    from images import ImageSettings, make_thumbnail
+
+    at = AppTest.from_file(app, default_timeout=60)
+    for key in ("ONEDRIVE_CLIENT_ID", "ONEDRIVE_CLIENT_SECRET", "ONEDRIVE_TENANT_ID"):
+        at.secrets[key] = "benchmark"
+    at.secrets["PREUPLOAD_MEMBERS"] = False
+    at.run()
+
+    at.text_input[0].input("Ravi Kumar")
+    at.number_input[0].set_value(40)
+    at.number_input[1].set_value(members)
+    at.button[0].click()
+    at.run()
+    # Through the widgets too: before the fragments, member 1's card kept its
+    # stale empty name and age 0 (a minor, so no email field) after the
+    # family was confirmed.
+    at.text_input(key="name_0").input("Ravi Kumar")
+    at.number_input(key="age_0").set_value(40)
+    at.run()
+
+    thumbnail = make_thumbnail(_photo(), ImageSettings())
+    for idx, member in enumerate(at.session_state["members"]):
+        member["name"] = member["name"] or f"Member {idx + 1}"
+        member["age"] = member["age"] or 30
+        member["avatar_data"] = thumbnail
+    at.run()
+
+    wall = []
+    for run in range(runs):
+        start = time.perf_counter()
+        at.text_input(key="email_0").input(f"ravi{run}@example.com")
+        at.run()
+        wall.append(time.perf_counter() - start)
+    if at.exception:
+        raise SystemExit(f"app raised: {at.exception}")
+    timings = at.session_state["rerun_timings"].summary() if "rerun_timings" in at.session_state else {}
+    return {"wall_ms": statistics.median(wall) * 1000, "sections": timings}
+
+
+def probe(app, members, runs):
+    app = os.path.abspath(app)
+    result = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), "--measure", app, "--members", str(members), "--runs", str(runs)],
+        cwd=os.path.dirname(app), capture_output=True, text=True, check=True,
+    )
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--members", type=int, default=10)
+    parser.add_argument("--runs", type=int, default=20)
+    parser.add_argument("--app", default=os.path.join(ROOT, "app.py"))
+    parser.add_argument("--baseline", help="app.py of a checkout from before the fragments")
+    parser.add_argument("--measure", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.measure:
+        sys.path.insert(0, os.path.dirname(args.measure))
+        print(json.dumps(measure(args.measure, args.members, args.runs)))
+        return
+
+    current = probe(args.app, args.members, args.runs)
+    summary = current["sections"]
+    print(f"{args.members} members, {args.runs} edits of one member field")
+    print(f"  {'section':<14} {'mean':>9} {'last':>9}")
+    for section in ("full_rerun", "sidebar", "family_form", "member_card", "footer"):
+        stats = summary.get(section)
+        if stats:
+            print(f"  {section:<14} {stats['mean_ms']:>7.1f}ms {stats['last_ms']:>7.1f}ms")
+    print(f"  AppTest wall time per interaction (median): {current['wall_ms']:.1f}ms")
+
+    full, card = summary["full_rerun"]["mean_ms"], summary["member_card"]["mean_ms"]
+    if args.baseline:
+        before = probe(args.baseline, args.members, args.runs)["wall_ms"]
+        # The AppTest wall time includes the harness's own overhead; take the
+        # same overhead off the current run and add back only the card.
+        after = current["wall_ms"] - full + card
+        print(f"  before: {before:.1f}ms per interaction ({args.baseline}, whole page, measured)")
+        print(f"  after:  {after:.1f}ms per interaction (estimate: member card fragment plus AppTest overhead), "
+              f"{before / after:.1f}x less")
+    else:
+        print(f"  before: {full:.1f}ms per interaction (estimate: the current script run whole)")
+        print(f"  after:  {card:.1f}ms per interaction (member card fragment), {full / card:.1f}x less")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,231 @@
+"""How many concurrent sessions can one server hold?
+
+Drives --sessions simulated families through app.py with Streamlit's AppTest,
+with Microsoft Graph and the token endpoint served by benchmarks/fake_graph.py.
+Each session confirms the family form, fills every member tab (name, age,
+text fields, one rerun per uploaded document, as a browser would), locks the
+members and submits, then reruns until the confirmation appears. Sessions are
+interleaved one interaction at a time, so all of them hold their state
+together while the shared worker uploads and emails in the background.
+
+Every session count runs in a fresh process and reports:
+  - RSS per session: peak RSS growth over a warmed-up process, divided by the
+    number of sessions (AppTest keeps its own copy of each upload, so this is
+    an upper bound)
+  - rerun latency: p50/p95/max wall time of an interaction's rerun
+  - submissions per minute, from the first submit to the last confirmation
+
+    python benchmarks/bench_sessions.py [--sessions 1 5 10 20] [--members 3]
+        [--doc-kb 500] [--latency 0.02] [--no-preupload]
+"""
+import argparse
+import io
+import logging
+import multiprocessing
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from memory_stats import format_bytes  # noqa: E402
+
+SUBMIT_LABEL = "🚀 Submit & Upload All Documents"
+DONE_TEXT = "Confirmation emails sent!"
+FAILED_TEXT = "Some steps of the submission failed"
+
+
+def _jpeg(rng, size):
+    from PIL import Image
+
+    noise = Image.frombytes("RGB", size, rng.randbytes(size[0] * size[1] * 3))
+    out = io.BytesIO()
+    Image.blend(Image.radial_gradient("L").resize(size).convert("RGB"), noise, 0.2).save(out, "JPEG", quality=85)
+    return out.getvalue()
+
+
+def _pdf(rng, size):
+    return b"%PDF-1.4\n" + rng.randbytes(size) + b"\n%%EOF\n"
+
+
+def member_documents(rng, doc_size):
+    # (uploader key prefix, filename, bytes, mime); distinct bytes per session
+    # so the shared blob store cannot deduplicate across families.
+    return [
+        ("photo", "photo.jpg", _jpeg(rng, (600, 800)), "image/jpeg"),
+        ("aadhaar", "aadhaar.pdf", _pdf(rng, doc_size), "application/pdf"),
+        ("pan", "pan.jpg", _jpeg(rng, (1000, 640)), "image/jpeg"),
+        ("cheque", "cheque.pdf", _pdf(rng, doc_size), "application/pdf"),
+    ]
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+class Session:
+    def __init__(self, index, secrets, members, doc_size):
+        from streamlit.testing.v1 import AppTest
+
+        self.index = index
+        self.members = members
+        self.doc_size = doc_size
+        self.family = f"Load Family {index}"
+        self.at = AppTest.from_file(os.path.join(ROOT, "app.py"), default_timeout=120)
+        for key, value in secrets.items():
+            self.at.secrets[key] = value
+        self.rng = random.Random(index)
+        self.rerun_seconds = []
+        self.submitted_at = None
+        self.finished_at = None
+        self.failed = False
+        self._steps = self._script()
+
+    def _run(self, record=True):
+        start = time.perf_counter()
+        self.at.run()
+        if record:
+            self.rerun_seconds.append(time.perf_counter() - start)
+        if self.at.exception:
+            raise SystemExit(f"session {self.index}: app raised {self.at.exception[0].value}")
+
+    def _script(self):
+        at = self.at
+        self._run()
+        yield
+        at.text_input[0].input(self.family)
+        at.number_input[0].set_value(40)
+        at.number_input[1].set_value(self.members)
+        at.button[0].click()
+        self._run()
+        yield
+        for idx in range(self.members):
+            if idx:
+                at.text_input(key=f"name_{idx}").input(f"Member {idx + 1} of {self.index}")
+                at.number_input(key=f"age_{idx}").set_value(30 + idx)
+                self._run()
+                yield
+            for prefix, filename, data, mime in member_documents(self.rng, self.doc_size):
+                at.file_uploader(key=f"{prefix}_{idx}").upload(filename, data, mime)
+                self._run()
+                yield
+            for key, value in (
+                (f"email_{idx}", f"member{idx}.{self.index}@example.com"),
+                (f"phone_{idx}", "9999999999"),
+                (f"mother_{idx}", "Mother"),
+                (f"birthplace_{idx}", "Pune"),
+                (f"nominee_name_{idx}_0", "Nominee"),
+                (f"nominee_relation_{idx}_0", "Spouse"),
+            ):
+                at.text_input(key=key).input(value)
+                self._run()
+                yield
+            at.button(key=f"submit_member_{idx}").click()
+            self._run()
+            yield
+        next(button for button in at.button if button.label == SUBMIT_LABEL).click()
+        self._run()
+        self.submitted_at = time.perf_counter()
+        yield
+        # The page polls the job; these reruns are not user interactions.
+        while True:
+            self._run(record=False)
+            if any(DONE_TEXT in element.value for element in at.success):
+                break
+            if any(FAILED_TEXT in element.value for element in at.error):
+                self.failed = True
+                break
+            yield "polling"
+        self.finished_at = time.perf_counter()
+
+    def step(self):
+        # One interaction; False once the submission has finished.
+        try:
+            return next(self._steps) or True
+        except StopIteration:
+            return False
+
+
+def run_level(sessions, members, doc_size, latency, preupload):
+    from fake_graph import FakeGraph
+    from memory_stats import PeakRSSMonitor, current_rss
+
+    # Setting up an AppTest outside a script run warns once per session.
+    logging.getLogger("streamlit.runtime.scriptrunner_utils.script_run_context").disabled = True
+
+    with FakeGraph(latency=latency) as graph, tempfile.TemporaryDirectory() as tmp:
+        secrets = {
+            "ONEDRIVE_CLIENT_ID": "load-test",
+            "ONEDRIVE_CLIENT_SECRET": "load-test",
+            "ONEDRIVE_TENANT_ID": "load-test",
+            "GRAPH_BASE_URL": graph.graph_base_url,
+            "GRAPH_AUTHORITY_URL": graph.authority_base_url,
+            "GRAPH_CA_BUNDLE": graph.ca_path,
+            "SUBMISSION_JOURNAL_PATH": os.path.join(tmp, "submissions.sqlite3"),
+            "PREUPLOAD_MEMBERS": preupload,
+            "TRACE_LOG_LEVEL": "WARNING",
+        }
+        # One throwaway session pays for imports and the shared resources, so
+        # the RSS growth below belongs to the sessions themselves.
+        Session(-1, secrets, members, doc_size).step()
+        baseline = current_rss()
+
+        active = [Session(i, secrets, members, doc_size) for i in range(sessions)]
+        finished = []
+        with PeakRSSMonitor() as rss:
+            while active:
+                results = [(session, session.step()) for session in active]
+                active = [session for session, result in results if result]
+                finished.extend(session for session, result in results if not result)
+                if active and all(result == "polling" for _, result in results if result):
+                    time.sleep(0.05)
+
+    reruns = [seconds for session in finished for seconds in session.rerun_seconds]
+    window = max(s.finished_at for s in finished) - min(s.submitted_at for s in finished)
+    completed = sum(1 for s in finished if not s.failed)
+    return {
+        "sessions": sessions,
+        "rss_per_session": (rss.peak_rss - baseline) / sessions,
+        "peak_rss": rss.peak_rss,
+        "reruns": len(reruns),
+        "p50": statistics.median(reruns),
+        "p95": percentile(reruns, 0.95),
+        "max": max(reruns),
+        "submit_to_done": statistics.median(s.finished_at - s.submitted_at for s in finished),
+        "completed": completed,
+        "failed": sessions - completed,
+        "per_minute": completed / window * 60 if window > 0 else float("inf"),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sessions", type=int, nargs="+", default=[1, 5, 10, 20])
+    parser.add_argument("--members", type=int, default=3)
+    parser.add_argument("--doc-kb", type=int, default=500, help="size of each PDF document")
+    parser.add_argument("--latency", type=float, default=0.02, help="seconds added to every fake Graph request")
+    parser.add_argument("--no-preupload", action="store_true", help="disable member pre-upload (PREUPLOAD_MEMBERS)")
+    args = parser.parse_args()
+
+    print(f"{args.members} members per family, {args.doc_kb} KB PDFs, Graph latency {args.latency * 1000:.0f} ms, "
+          f"pre-upload {'off' if args.no_preupload else 'on'}")
+    print(f"{'sessions':>8}{'RSS/session':>13}{'peak RSS':>11}{'reruns':>8}{'p50 ms':>8}{'p95 ms':>8}{'max ms':>8}"
+          f"{'submit→done s':>15}{'subs/min':>10}{'failed':>8}")
+    # A fresh process per row so RSS from the previous row does not linger.
+    context = multiprocessing.get_context("spawn")
+    for sessions in args.sessions:
+        with context.Pool(1) as pool:
+            row = pool.apply(run_level, (sessions, args.members, args.doc_kb * 1024, args.latency, not args.no_preupload))
+        print(f"{row['sessions']:>8}{format_bytes(row['rss_per_session']):>13}{format_bytes(row['peak_rss']):>11}"
+              f"{row['reruns']:>8}{row['p50'] * 1000:>8.1f}{row['p95'] * 1000:>8.1f}{row['max'] * 1000:>8.1f}"
+              f"{row['submit_to_done']:>15.2f}{row['per_minute']:>10.1f}{row['failed']:>8}", flush=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+"""End-to-end submission benchmark against a local fake Graph/MSAL server.
+
+Starts benchmarks/fake_graph.py in-process, points a GraphCredential and
+GraphClient at it, and pushes whole submissions (archive, OneDrive upload,
+admin and applicant emails) through SubmissionWorker for every combination
+of family size and per-member document size. Reports submit-to-done latency,
+Graph round trips and peak RSS.
+
+--concurrency submits that many families at once against a fake tenant rate
+limit (--rate-limit), to compare the admission controller (--max-rps,
+--max-uploads) with every job retrying on its own (--max-rps 0).
+
+    python benchmarks/bench_submission.py [--members 1 5 10] [--doc-mb 0.5 2 8]
+        [--runs 3] [--latency 0.02] [--throttle 0.0]
+        [--concurrency 8 --rate-limit 20 --max-rps 15 --max-uploads 2]
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import onedrive  # noqa: E402
+import submission  # noqa: E402
+from fake_graph import FakeGraph  # noqa: E402
+from graph_admission import AdmissionController  # noqa: E402
+from graph_auth import GraphCredential  # noqa: E402
+from graph_client import GraphClient  # noqa: E402
+from memory_stats import format_bytes  # noqa: E402
+
+
+def build_spec(family_name, members, doc_size, rng):
+    # Random bytes do not compress, so the archive is as big as the documents.
+    entries = []
+    for idx in range(members):
+        folder = f"{family_name}/Member_{idx + 1}"
+        entries.append((f"{folder}/details.txt", f"Name: Member {idx + 1}\nAge: {30 + idx}\nType: Adult"))
+        entries.append((f"{folder}/aadhaar.pdf", rng.randbytes(doc_size // 2)))
+        entries.append((f"{folder}/pan.jpg", rng.randbytes(doc_size - doc_size // 2)))
+    return {
+        "family_name": family_name,
+        "zip_name": f"{family_name}_onboarding.zip",
+        "folder_path": ["Onboarding", family_name],
+        "entries": entries,
+        "emails": [
+            {"key": "admin_email", "to": "admin@example.com", "subject": "Submission", "body": family_name},
+            {"key": "applicant_email", "to": "applicant@example.com", "subject": "Submission", "body": family_name},
+        ],
+    }
+
+
+def run_submissions(worker, specs, timeout=600):
+    # Submits all specs at once; returns [(seconds to done or failure, job)].
+    start = time.perf_counter()
+    jobs = [worker.get(worker.submit(spec)) for spec in specs]
+    finished = {}
+    while len(finished) < len(jobs):
+        if time.perf_counter() - start > timeout:
+            raise SystemExit(f"submissions did not finish within {timeout}s")
+        for job in jobs:
+            if job.id not in finished and job.status in (submission.STATUS_DONE, submission.STATUS_FAILED):
+                finished[job.id] = time.perf_counter() - start
+        time.sleep(0.005)
+    return [(finished[job.id], job) for job in jobs]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--members", type=int, nargs="+", default=[1, 5, 10])
+    parser.add_argument("--doc-mb", type=float, nargs="+", default=[0.5, 2, 8],
+                        help="document bytes per member, in MiB")
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--latency", type=float, default=0.02, help="seconds added to every fake Graph request")
+    parser.add_argument("--throttle", type=float, default=0.0, help="fraction of Graph requests answered with 429")
+    parser.add_argument("--retry-after", type=int, default=0)
+    parser.add_argument("--concurrency", type=int, default=1, help="families submitted at the same time")
+    parser.add_argument("--rate-limit", type=int, default=None, help="fake tenant limit, Graph requests per second")
+    parser.add_argument("--max-rps", type=float, default=0, help="admission controller rate; 0 disables it")
+    parser.add_argument("--max-uploads", type=int, default=2, help="admission controller upload slots")
+    args = parser.parse_args()
+
+    rng = random.Random(7)
+    with FakeGraph(latency=args.latency, throttle=args.throttle, retry_after=args.retry_after, seed=7,
+                   rate_limit=args.rate_limit) as graph:
+        credential = GraphCredential(
+            "bench-client", "bench-secret", "bench-tenant",
+            authority_base_url=graph.authority_base_url, verify=graph.ca_path,
+        )
+        admission = None
+        if args.max_rps:
+            admission = AdmissionController(rate=args.max_rps, burst=max(1, int(args.max_rps)),
+                                            max_uploads=args.max_uploads)
+        client = GraphClient(credential, base_url=graph.graph_base_url, verify=graph.ca_path, backoff_base=0.05,
+                             admission=admission)
+        print(f"fake Graph at {graph.origin}, latency {args.latency * 1000:.0f} ms, throttle {args.throttle:.0%}, "
+              f"rate limit {args.rate_limit or 'none'}, admission "
+              f"{f'{args.max_rps:g} rps / {args.max_uploads} uploads' if admission else 'off'}, "
+              f"{args.concurrency} at once")
+        print(f"{'members':>8}{'doc MiB':>9}{'median s':>10}{'max s':>8}{'requests':>10}{'429s':>6}{'failed':>8}"
+              f"{'peak RSS':>11}{'peak +':>11}")
+        for members in args.members:
+            for doc_mb in args.doc_mb:
+                # A fresh worker and folder cache per row, so every run pays
+                # for the same folder lookups a first submission would.
+                worker = submission.SubmissionWorker(
+                    client, "sender@example.com", max_workers=max(4, args.concurrency),
+                    max_pending=max(50, args.concurrency), folder_cache=onedrive.FolderCache(),
+                )
+                times, requests, throttled, peaks, deltas = [], [], [], [], []
+                failed = 0
+                for run in range(args.runs):
+                    specs = [
+                        build_spec(f"Bench_{members}_{doc_mb}_{run}_{i}", members, int(doc_mb * 2**20), rng)
+                        for i in range(args.concurrency)
+                    ]
+                    graph.reset_stats()
+                    for elapsed, job in run_submissions(worker, specs):
+                        times.append(elapsed)
+                        peaks.append(job.peak_rss)
+                        deltas.append(job.peak_delta)
+                        failed += job.status == submission.STATUS_FAILED
+                    # Per family, so rows are comparable across --concurrency.
+                    requests.append((graph.total_requests() - graph.requests["throttled"]) / args.concurrency)
+                    throttled.append(graph.requests["throttled"])
+                print(f"{members:>8}{doc_mb:>9g}{statistics.median(times):>10.3f}{max(times):>8.3f}"
+                      f"{statistics.median(requests):>10.1f}{sum(throttled):>6}{failed:>8}"
+                      f"{format_bytes(max(peaks)):>11}{format_bytes(max(deltas)):>11}")
+        print(f"token fetches: {credential.stats()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,462 @@
+"""Local stand-in for the Microsoft identity platform and Graph.
+
+Serves, over HTTPS with a throwaway self-signed certificate:
+  - OpenID discovery and the client-credentials token endpoint MSAL uses
+  - drive path lookup, children listing/creation, simple and session uploads,
+    rename, delete and createLink
+  - sendMail, drafts with attachment upload sessions, and $batch over all
+    of the above
+with optional per-request latency, random 429s and a tenant-style rate limit. Counts every
+request so benchmarks can report round trips. inject() scripts faults (a status,
+a slow response, a connection dropped after the request was handled) for the
+next requests to a path, for the tests.
+
+Run on its own to point the app at it:
+
+    python benchmarks/fake_graph.py --port 8443 [--latency 0.05] [--throttle 0.02] [--rate-limit 20]
+"""
+import argparse
+import base64
+import datetime
+import ipaddress
+import json
+import os
+import random
+import re
+import shutil
+import ssl
+import tempfile
+import threading
+import time
+import uuid
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import unquote, urlparse
+
+
+def _self_signed_cert(directory):
+    # cryptography is already installed as an msal dependency.
+    from cryptography import x509
+    from cryptography.hazmat.primitives import hashes, serialization
+    from cryptography.hazmat.primitives.asymmetric import ec
+    from cryptography.x509.oid import NameOID
+
+    key = ec.generate_private_key(ec.SECP256R1())
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, "localhost")])
+    now = datetime.datetime.now(datetime.timezone.utc)
+    cert = (
+        x509.CertificateBuilder()
+        .subject_name(name)
+        .issuer_name(name)
+        .public_key(key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(now - datetime.timedelta(minutes=5))
+        .not_valid_after(now + datetime.timedelta(days=7))
+        .add_extension(x509.BasicConstraints(ca=True, path_length=None), critical=True)
+        .add_extension(x509.SubjectAlternativeName(
+            [x509.DNSName("localhost"), x509.IPAddress(ipaddress.ip_address("127.0.0.1"))]
+        ), critical=False)
+        .sign(key, hashes.SHA256())
+    )
+    cert_path = os.path.join(directory, "cert.pem")
+    key_path = os.path.join(directory, "key.pem")
+    with open(cert_path, "wb") as f:
+        f.write(cert.public_bytes(serialization.Encoding.PEM))
+    with open(key_path, "wb") as f:
+        f.write(key.private_bytes(
+            serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption()
+        ))
+    return cert_path, key_path
+
+
+class FakeDrive:
+    def __init__(self):
+        self.items = {"root": {"id": "root", "name": "root", "parent": None, "children": {}, "folder": True}}
+
+    def child(self, parent_id, name):
+        child_id = self.items[parent_id]["children"].get(name)
+        return self.items[child_id] if child_id else None
+
+    def walk(self, item_id, segments):
+        item = self.items.get(item_id)
+        for segment in segments:
+            if item is None:
+                return None
+            item = self.child(item["id"], segment)
+        return item
+
+    def add(self, parent_id, name, folder, content=b""):
+        item = {"id": uuid.uuid4().hex[:16], "name": name, "parent": parent_id, "children": {},
+                "folder": folder, "content": content}
+        self.items[item["id"]] = item
+        self.items[parent_id]["children"][name] = item["id"]
+        return item
+
+    def path(self, item):
+        parts = []
+        while item["parent"]:
+            parts.append(item["name"])
+            item = self.items[item["parent"]]
+        return "/".join(reversed(parts))
+
+    def meta(self, item):
+        meta = {"id": item["id"], "name": item["name"], "webUrl": f"https://fake.sharepoint/{self.path(item)}"}
+        if item["folder"]:
+            meta["folder"] = {"childCount": len(item["children"])}
+        else:
+            meta["size"] = len(item["content"])
+        return meta
+
+    def rename(self, item, name):
+        parent = self.items[item["parent"]]
+        if name in parent["children"]:
+            return 409, {"error": {"code": "nameAlreadyExists"}}
+        del parent["children"][item["name"]]
+        item["name"] = name
+        parent["children"][name] = item["id"]
+        return 200, self.meta(item)
+
+    def delete(self, item):
+        del self.items[item["parent"]]["children"][item["name"]]
+        return 204, None
+
+
+PATH_ROUTE = re.compile(r"/v1\.0/users/[^/]+/drive/(?:root|items/(?P<base>[^/:]+)):/(?P<path>.+?)(?P<suffix>:/content|:/createUploadSession|:/children|:)?$")
+CHILDREN_ROUTE = re.compile(r"/v1\.0/users/[^/]+/drive/(?:root|items/(?P<base>[^/]+))/children$")
+ITEM_ROUTE = re.compile(r"/v1\.0/users/[^/]+/drive/(?:root|items/(?P<id>[^/]+))$")
+LINK_ROUTE = re.compile(r"/v1\.0/users/[^/]+/drive/items/(?P<id>[^/]+)/createLink$")
+MESSAGE_ROUTE = re.compile(r"/v1\.0/users/[^/]+/messages(?:/(?P<id>[^/]+)(?P<action>/attachments/createUploadSession|/send)?)?$")
+SESSION_ROUTE = re.compile(r"/upload/(?P<id>\w+)$")
+CONTENT_RANGE = re.compile(r"bytes (\d+)-(\d+)/(\d+)")
+
+
+class FakeGraph:
+    def __init__(self, host="127.0.0.1", port=0, latency=0.0, throttle=0.0, retry_after=1, seed=None,
+                 rate_limit=None):
+        self.latency = latency
+        self.throttle = throttle
+        # Graph requests allowed per one-second window before answering 429,
+        # counting each request inside a $batch, as Graph does.
+        self.rate_limit = rate_limit
+        self._window = (0, 0)
+        self.retry_after = retry_after
+        self.drive = FakeDrive()
+        self.mails = []
+        self.links = []
+        self.requests = Counter()
+        self._sessions = {}
+        self.drafts = {}
+        self._faults = []
+        self._random = random.Random(seed)
+        self._lock = threading.RLock()
+        self._tmpdir = tempfile.mkdtemp(prefix="fake-graph-")
+        self.ca_path, key_path = _self_signed_cert(self._tmpdir)
+        self._server = ThreadingHTTPServer((host, port), self._handler())
+        self._server.daemon_threads = True
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        context.load_cert_chain(self.ca_path, key_path)
+        self._server.socket = context.wrap_socket(self._server.socket, server_side=True)
+        self.origin = f"https://{host}:{self._server.server_address[1]}"
+        self.graph_base_url = f"{self.origin}/v1.0"
+        self.authority_base_url = self.origin
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True, name="fake-graph")
+        self._thread.start()
+        return self
+
+    def close(self):
+        self._server.shutdown()
+        self._server.server_close()
+        shutil.rmtree(self._tmpdir, ignore_errors=True)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def reset_stats(self):
+        with self._lock:
+            self.requests.clear()
+            self.mails.clear()
+            self.links.clear()
+            self.drafts.clear()
+
+    def inject(self, path_pattern, *faults, method=None):
+        # The next requests whose path matches path_pattern (a regex searched
+        # in e.g. "/v1.0/users/x/sendMail", also inside $batch) get one fault
+        # each, in order: an int status, answered without touching any state
+        # (429 carries Retry-After); a float, seconds to wait before handling
+        # the request; or "drop", handle it and close the connection without
+        # answering, as when a response is lost on the way back.
+        with self._lock:
+            self._faults.append((re.compile(path_pattern), method, list(faults)))
+
+    def _take_fault(self, method, path):
+        with self._lock:
+            for pattern, fault_method, faults in self._faults:
+                if faults and pattern.search(path) and fault_method in (None, method):
+                    self._count("fault")
+                    return faults.pop(0)
+        return None
+
+    def _fault_response(self, status):
+        headers = {"Retry-After": str(self.retry_after)} if status == 429 else {}
+        return status, {"error": {"code": "InjectedFault", "status": status}}, headers
+
+    def total_requests(self):
+        with self._lock:
+            return sum(self.requests.values())
+
+    def _count(self, kind):
+        with self._lock:
+            self.requests[kind] += 1
+
+    def _throttled(self):
+        if self.rate_limit:
+            with self._lock:
+                second, count = self._window
+                now = int(time.monotonic())
+                self._window = (now, count + 1) if now == second else (now, 1)
+                if self._window[1] > self.rate_limit:
+                    return True
+        return self.throttle and self._random.random() < self.throttle
+
+    def _handler(self):
+        graph = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def _handle(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                body = self.rfile.read(length) if length else b""
+                path = unquote(urlparse(self.path).path)
+                if graph.latency:
+                    time.sleep(graph.latency)
+                fault = graph._take_fault(self.command, path)
+                if isinstance(fault, float):
+                    time.sleep(fault)
+                if isinstance(fault, int):
+                    status, payload, headers = graph._fault_response(fault)
+                else:
+                    status, payload, headers = graph.dispatch(self.command, path, self.headers, body)
+                if fault == "drop":
+                    self.close_connection = True
+                    return
+                data = payload if isinstance(payload, bytes) else (
+                    json.dumps(payload).encode() if payload is not None else b""
+                )
+                self.send_response(status)
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                if data and "Content-Type" not in headers:
+                    self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                try:
+                    self.end_headers()
+                    self.wfile.write(data)
+                except OSError:
+                    # The client gave up first (e.g. a read timeout).
+                    self.close_connection = True
+
+            do_GET = do_POST = do_PUT = do_PATCH = do_DELETE = _handle
+
+        return Handler
+
+    def dispatch(self, method, path, headers, body):
+        if path.endswith("/.well-known/openid-configuration"):
+            self._count("openid_configuration")
+            tenant = path.strip("/").split("/")[0]
+            return 200, {
+                "issuer": f"{self.origin}/{tenant}/v2.0",
+                "authorization_endpoint": f"{self.origin}/{tenant}/oauth2/v2.0/authorize",
+                "token_endpoint": f"{self.origin}/{tenant}/oauth2/v2.0/token",
+            }, {}
+        if path.endswith("/oauth2/v2.0/token"):
+            self._count("token")
+            return 200, {"token_type": "Bearer", "expires_in": 3599, "access_token": uuid.uuid4().hex}, {}
+        if path == "/v1.0/$batch":
+            self._count("batch")
+            return (*self._batch(json.loads(body)), {})
+        return self._graph(method, path, headers, body)
+
+    def _graph(self, method, path, headers, body):
+        if self._throttled():
+            self._count("throttled")
+            return 429, {"error": {"code": "TooManyRequests"}}, {"Retry-After": str(self.retry_after)}
+        with self._lock:
+            status, payload, kind = self._route(method, path, headers, body)
+        self._count(kind)
+        return status, payload, {}
+
+    def _batch(self, request_body):
+        responses = []
+        statuses = {}
+        for request in request_body["requests"]:
+            if any(not 200 <= statuses.get(dep, 0) < 300 for dep in request.get("dependsOn", [])):
+                statuses[request["id"]] = 424
+                responses.append({"id": request["id"], "status": 424, "body": {"error": {"code": "FailedDependency"}}})
+                continue
+            body = request.get("body")
+            if isinstance(body, str):
+                raw = base64.b64decode(body)
+            else:
+                raw = json.dumps(body).encode() if body is not None else b""
+            path = "/v1.0" + unquote(urlparse(request["url"]).path)
+            fault = self._take_fault(request["method"], path)
+            if isinstance(fault, int):
+                status, payload, headers = self._fault_response(fault)
+            else:
+                status, payload, headers = self._graph(request["method"], path, request.get("headers", {}), raw)
+            statuses[request["id"]] = status
+            responses.append({"id": request["id"], "status": status, "headers": headers, "body": payload})
+        return 200, {"responses": responses}
+
+    def _route(self, method, path, headers, body):
+        drive = self.drive
+        match = PATH_ROUTE.match(path)
+        if match:
+            base = match.group("base") or "root"
+            if base not in drive.items:
+                return 404, {"error": {"code": "itemNotFound"}}, "lookup"
+            segments = match.group("path").split("/")
+            suffix = match.group("suffix")
+            if suffix in (None, ":"):
+                item = drive.walk(base, segments)
+                if item is None:
+                    return 404, {"error": {"code": "itemNotFound"}}, "lookup"
+                if method == "PATCH":
+                    return (*drive.rename(item, json.loads(body)["name"]), "rename")
+                if method == "DELETE":
+                    return (*drive.delete(item), "delete")
+                return 200, drive.meta(item), "lookup"
+            if suffix == ":/children":
+                parent = drive.walk(base, segments)
+                return self._create_child(parent, body)
+            parent = drive.walk(base, segments[:-1])
+            if parent is None:
+                return 404, {"error": {"code": "itemNotFound"}}, "upload"
+            if suffix == ":/content":
+                item = drive.child(parent["id"], segments[-1]) or drive.add(parent["id"], segments[-1], False)
+                item["content"] = body
+                return 201, drive.meta(item), "simple_upload"
+            session_id = uuid.uuid4().hex
+            self._sessions[session_id] = {"parent": parent["id"], "name": segments[-1], "data": bytearray()}
+            return 200, {"uploadUrl": f"{self.origin}/upload/{session_id}"}, "upload_session"
+
+        match = CHILDREN_ROUTE.match(path)
+        if match and method == "POST":
+            return self._create_child(drive.items.get(match.group("base") or "root"), body)
+
+        match = LINK_ROUTE.match(path)
+        if match:
+            if match.group("id") not in drive.items:
+                return 404, {"error": {"code": "itemNotFound"}}, "create_link"
+            self.links.append(json.loads(body))
+            return 201, {"link": {"webUrl": f"https://fake.sharepoint/s/{match.group('id')}"}}, "create_link"
+
+        match = ITEM_ROUTE.match(path)
+        if match:
+            item = drive.items.get(match.group("id") or "root")
+            if item is None:
+                return 404, {"error": {"code": "itemNotFound"}}, "item"
+            if method == "PATCH":
+                return (*drive.rename(item, json.loads(body)["name"]), "rename")
+            if method == "DELETE":
+                return (*drive.delete(item), "delete")
+            return 200, drive.meta(item), "item"
+
+        match = SESSION_ROUTE.match(path)
+        if match:
+            return self._session_chunk(match.group("id"), method, headers, body)
+
+        match = MESSAGE_ROUTE.match(path)
+        if match and method == "POST" and (match.group("action") or not match.group("id")):
+            return self._message(match.group("id"), match.group("action"), body)
+        if match and method == "DELETE" and match.group("id") and not match.group("action"):
+            if self.drafts.pop(match.group("id"), None) is None:
+                return 404, {"error": {"code": "ErrorItemNotFound"}}, "delete_draft"
+            return 204, None, "delete_draft"
+
+        if path.endswith("/sendMail") and method == "POST":
+            self.mails.append(json.loads(body))
+            return 202, None, "send_mail"
+        return 404, {"error": {"code": "notImplemented", "path": path}}, "unknown"
+
+    def _create_child(self, parent, body):
+        if parent is None:
+            return 404, {"error": {"code": "itemNotFound"}}, "create_folder"
+        request = json.loads(body)
+        if self.drive.child(parent["id"], request["name"]):
+            return 409, {"error": {"code": "nameAlreadyExists"}}, "create_folder"
+        return 201, self.drive.meta(self.drive.add(parent["id"], request["name"], "folder" in request)), "create_folder"
+
+    def _message(self, message_id, action, body):
+        # Draft, attachment upload session and send, for attachments too big
+        # to inline.
+        if message_id is None:
+            message_id = uuid.uuid4().hex
+            self.drafts[message_id] = dict(json.loads(body), attachments=[])
+            return 201, {"id": message_id}, "create_draft"
+        draft = self.drafts.get(message_id)
+        if draft is None:
+            return 404, {"error": {"code": "ErrorItemNotFound"}}, "message"
+        if action == "/send":
+            self.mails.append({"message": self.drafts.pop(message_id)})
+            return 202, None, "send_draft"
+        item = json.loads(body)["AttachmentItem"]
+        session_id = uuid.uuid4().hex
+        self._sessions[session_id] = {"message": message_id, "name": item["name"], "data": bytearray()}
+        return 201, {"uploadUrl": f"{self.origin}/upload/{session_id}"}, "attachment_session"
+
+    def _session_chunk(self, session_id, method, headers, body):
+        session = self._sessions.get(session_id)
+        if session is None:
+            return 404, {"error": {"code": "itemNotFound"}}, "upload_chunk"
+        if method == "GET":
+            return 200, {"nextExpectedRanges": [f"{len(session['data'])}-"]}, "upload_status"
+        start, _, total = map(int, CONTENT_RANGE.match(headers["Content-Range"]).groups())
+        if start != len(session["data"]):
+            return 416, {"error": {"code": "invalidRange"}}, "upload_chunk"
+        session["data"].extend(body)
+        if len(session["data"]) < total:
+            # Drive sessions answer 202 to intermediate chunks, Outlook's 200.
+            status = 200 if "message" in session else 202
+            return status, {"nextExpectedRanges": [f"{len(session['data'])}-"]}, "upload_chunk"
+        del self._sessions[session_id]
+        if "message" in session:
+            self.drafts[session["message"]]["attachments"].append({"name": session["name"], "size": total})
+            return 201, None, "upload_chunk"
+        item = self.drive.child(session["parent"], session["name"]) or self.drive.add(session["parent"], session["name"], False)
+        item["content"] = bytes(session["data"])
+        return 201, self.drive.meta(item), "upload_chunk"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8443)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every request")
+    parser.add_argument("--throttle", type=float, default=0.0, help="fraction of Graph requests answered with 429")
+    parser.add_argument("--rate-limit", type=int, default=None, help="Graph requests per second before 429s")
+    args = parser.parse_args()
+    graph = FakeGraph(port=args.port, latency=args.latency, throttle=args.throttle, rate_limit=args.rate_limit).start()
+    print("Add to .streamlit/secrets.toml:")
+    print(f'GRAPH_BASE_URL = "{graph.graph_base_url}"')
+    print(f'GRAPH_AUTHORITY_URL = "{graph.authority_base_url}"')
+    print(f'GRAPH_CA_BUNDLE = "{graph.ca_path}"')
+    try:
+        while True:
+            time.sleep(10)
+            print(dict(graph.requests), flush=True)
+    except KeyboardInterrupt:
+        graph.close()
+
+
+if __name__ == "__main__":
+    main()
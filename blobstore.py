@@ -0,0 +1,145 @@
+import atexit
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+import weakref
+from collections import OrderedDict
+
+
+class BlobRef:
+    # What session state and member docs hold instead of the bytes.
+    __slots__ = ("digest", "name", "size")
+
+    def __init__(self, digest, name, size):
+        self.digest = digest
+        self.name = name
+        self.size = size
+
+    def __repr__(self):
+        return f"BlobRef({self.name!r}, {self.digest[:12]}, {self.size})"
+
+
+class BlobStore:
+    # Process-wide, content-addressed store for uploaded documents. Identical
+    # files share one copy; the least recently used blobs spill to a temp
+    # directory once the in-memory budget is exceeded. Blobs are reference
+    # counted and removed when the last session or job lets go of them.
+    def __init__(self, memory_budget=256 * 1024 * 1024, spill_dir=None):
+        self.memory_budget = memory_budget
+        self.spill_dir = spill_dir or tempfile.mkdtemp(prefix="onboarding-blobs-")
+        self._memory = OrderedDict()
+        self._disk = {}
+        self._sizes = {}
+        self._refs = {}
+        self._memory_bytes = 0
+        self._lock = threading.Lock()
+        atexit.register(shutil.rmtree, self.spill_dir, True)
+
+    def put(self, data):
+        digest = hashlib.sha256(data).hexdigest()
+        with self._lock:
+            self._refs[digest] = self._refs.get(digest, 0) + 1
+            if digest not in self._sizes:
+                self._sizes[digest] = len(data)
+                self._memory[digest] = bytes(data)
+                self._memory_bytes += len(data)
+                self._spill()
+        return digest
+
+    def acquire(self, digest):
+        with self._lock:
+            if digest not in self._sizes:
+                raise KeyError(digest)
+            self._refs[digest] += 1
+
+    def release(self, digest):
+        with self._lock:
+            count = self._refs.get(digest, 0) - 1
+            if count > 0:
+                self._refs[digest] = count
+                return
+            self._refs.pop(digest, None)
+            self._sizes.pop(digest, None)
+            data = self._memory.pop(digest, None)
+            if data is not None:
+                self._memory_bytes -= len(data)
+            path = self._disk.pop(digest, None)
+        if path:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def get(self, digest):
+        with self._lock:
+            data = self._memory.get(digest)
+            if data is not None:
+                self._memory.move_to_end(digest)
+                return data
+            path = self._disk.get(digest)
+        if path is None:
+            raise KeyError(digest)
+        with open(path, "rb") as f:
+            return f.read()
+
+    def _spill(self):
+        while self._memory_bytes > self.memory_budget and self._memory:
+            digest, data = self._memory.popitem(last=False)
+            path = os.path.join(self.spill_dir, digest)
+            with open(path, "wb") as f:
+                f.write(data)
+            self._disk[digest] = path
+            self._memory_bytes -= len(data)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "blobs": len(self._sizes),
+                "memory_bytes": self._memory_bytes,
+                "disk_bytes": sum(self._sizes[d] for d in self._disk),
+                "references": sum(self._refs.values()),
+            }
+
+
+def _release_all(store, slots):
+    for _, ref in slots.values():
+        store.release(ref.digest)
+    slots.clear()
+
+
+class SessionBlobs:
+    # Lives in st.session_state. Maps upload slots such as "member_0_pan" to
+    # blob references and releases them when the session is garbage collected.
+    def __init__(self, store):
+        self.store = store
+        self._slots = {}
+        weakref.finalize(self, _release_all, store, self._slots)
+
+    def put_upload(self, slot, uploaded_file):
+        file_id = getattr(uploaded_file, "file_id", None)
+        current = self._slots.get(slot)
+        if current and file_id and current[0] == file_id:
+            return current[1]
+        data = uploaded_file.getvalue()
+        ref = BlobRef(self.store.put(data), uploaded_file.name, len(data))
+        self._slots[slot] = (file_id, ref)
+        if current:
+            self.store.release(current[1].digest)
+        return ref
+
+    def get(self, slot):
+        current = self._slots.get(slot)
+        return current[1] if current else None
+
+    def clear(self):
+        _release_all(self.store, self._slots)
+
+    def stats(self):
+        refs = [ref for _, ref in self._slots.values()]
+        return {
+            "files": len(refs),
+            "referenced_bytes": sum(ref.size for ref in refs),
+            "unique_bytes": sum({ref.digest: ref.size for ref in refs}.values()),
+        }
@@ -0,0 +1,62 @@
+"""Look up past onboardings in the local submission index.
+
+Every completed submission (from the app or batch_onboard.py) is indexed in
+the submission journal with its family, members, archive hash and size, and
+OneDrive item. Any word of a name, email or phone number matches by prefix,
+newest first; with no query, lists the latest submissions.
+
+    python find_submission.py "ravi kumar"
+    python find_submission.py 98765 --json
+    python find_submission.py --limit 50
+    python find_submission.py --backfill   # index submissions made before the index existed
+"""
+import argparse
+import json
+import sys
+import time
+from datetime import datetime
+
+import journal
+import onboarding
+from memory_stats import format_bytes
+
+
+def format_row(row):
+    members = ", ".join(member["name"] for member in row["members"]) or "-"
+    submitted = datetime.fromtimestamp(row["submitted_at"]).strftime("%Y-%m-%d %H:%M")
+    size = format_bytes(row["archive_size"]) if row["archive_size"] else "-"
+    return (
+        f"{submitted}  {row['family']}  ({members})\n"
+        f"    {size}  sha256:{row['content_hash'][:12]}  {row['web_url'] or 'not uploaded'}"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("query", nargs="*", help="words of a name, email or phone number")
+    parser.add_argument("--limit", type=int, default=20)
+    parser.add_argument("--json", action="store_true", help="one JSON object per line")
+    parser.add_argument("--secrets", default=".streamlit/secrets.toml")
+    parser.add_argument("--journal", help="submission journal (default: SUBMISSION_JOURNAL_PATH)")
+    parser.add_argument("--backfill", action="store_true", help="index completed submissions missing from the index")
+    args = parser.parse_args()
+
+    config = onboarding.load_config(args.secrets)
+    submission_journal = journal.SubmissionJournal(
+        args.journal or config.get("SUBMISSION_JOURNAL_PATH", "data/submissions.sqlite3")
+    )
+    if args.backfill:
+        print(f"indexed {submission_journal.backfill_index()} earlier submissions", file=sys.stderr)
+    start = time.perf_counter()
+    rows = submission_journal.search(" ".join(args.query), limit=args.limit)
+    elapsed = time.perf_counter() - start
+    submission_journal.close()
+
+    for row in rows:
+        print(json.dumps(row) if args.json else format_row(row))
+    print(f"{len(rows)} submissions in {elapsed * 1000:.2f} ms", file=sys.stderr)
+    return 0 if rows else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
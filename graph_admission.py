@@ -0,0 +1,102 @@
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+import tracing
+
+
+class AdmissionController:
+    # Process-wide gate for Graph traffic, shared by every session: a token
+    # bucket caps requests per second, a FIFO queue caps concurrent large
+    # uploads, and a 429 seen by any caller pauses all of them until its
+    # Retry-After has passed, instead of each retrying into the same limit.
+    def __init__(self, rate=10.0, burst=20, max_uploads=2):
+        self.rate = float(rate)
+        self.burst = max(1, int(burst))
+        self.max_uploads = max(1, int(max_uploads))
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._waiting = 0
+        self._active_uploads = 0
+        self._upload_queue = deque()
+        self._cond = threading.Condition()
+
+    def _refill(self, now):
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self, cost=1):
+        # Blocks until the request may go out. A $batch call costs one token
+        # per request inside it, since Graph throttles those individually.
+        cost = min(max(cost, 1), self.burst)
+        start = time.monotonic()
+        with self._cond:
+            self._waiting += 1
+            try:
+                while True:
+                    now = time.monotonic()
+                    self._refill(now)
+                    delay = self._paused_until - now
+                    if delay <= 0:
+                        if self.rate <= 0 or self._tokens >= cost:
+                            self._tokens -= cost
+                            break
+                        delay = (cost - self._tokens) / self.rate
+                    self._cond.wait(delay)
+            finally:
+                self._waiting -= 1
+        waited = time.monotonic() - start
+        tracing.METRICS.observe("onboarding_graph_admission_wait_seconds", waited, kind="request")
+        current = tracing.current_span()
+        if current and waited > 0.001:
+            current.add("admission_wait_ms", round(waited * 1000, 1))
+        return waited
+
+    def pause(self, seconds):
+        with self._cond:
+            until = time.monotonic() + seconds
+            if until > self._paused_until:
+                self._paused_until = until
+                tracing.METRICS.inc("onboarding_graph_pauses_total")
+            self._cond.notify_all()
+
+    @contextmanager
+    def upload_slot(self, owner=None):
+        # owner (e.g. a submission id) lets the UI ask for its place in line.
+        ticket = [owner]
+        start = time.monotonic()
+        with self._cond:
+            self._upload_queue.append(ticket)
+            try:
+                while self._upload_queue[0] is not ticket or self._active_uploads >= self.max_uploads:
+                    self._cond.wait()
+            finally:
+                self._upload_queue.remove(ticket)
+                self._cond.notify_all()
+            self._active_uploads += 1
+        tracing.METRICS.observe("onboarding_graph_admission_wait_seconds", time.monotonic() - start, kind="upload")
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._active_uploads -= 1
+                self._cond.notify_all()
+
+    def position(self, owner):
+        # 1-based place in the upload queue, or 0 if not waiting.
+        with self._cond:
+            for index, ticket in enumerate(self._upload_queue):
+                if ticket[0] == owner:
+                    return index + 1
+        return 0
+
+    def stats(self):
+        with self._cond:
+            return {
+                "waiting_requests": self._waiting,
+                "waiting_uploads": len(self._upload_queue),
+                "active_uploads": self._active_uploads,
+                "paused_for": max(0.0, self._paused_until - time.monotonic()),
+            }
@@ -0,0 +1,88 @@
+import functools
+import threading
+import time
+
+import tracing
+
+GRAPH_SCOPES = ["https://graph.microsoft.com/.default"]
+AUTHORITY_BASE_URL = "https://login.microsoftonline.com"
+
+
+class GraphAuthError(Exception):
+    pass
+
+
+class GraphCredential:
+    # One MSAL app and token per process; tokens are refreshed a little
+    # before they expire so in-flight requests never carry a stale one.
+    def __init__(self, client_id, client_secret, tenant_id,
+                 authority_base_url=AUTHORITY_BASE_URL, scopes=None, refresh_margin=300, verify=True):
+        self.scopes = list(scopes or GRAPH_SCOPES)
+        self.refresh_margin = refresh_margin
+        # Deferred like requests in graph_client: msal is only needed once
+        # the first Graph call builds the credential.
+        import msal
+
+        authority_base_url = authority_base_url.rstrip("/")
+        http_client = None
+        if verify is not True:
+            # Same as MSAL's default client, but with verify pinned per request
+            # so REQUESTS_CA_BUNDLE cannot override it.
+            import requests
+            http_client = requests.Session()
+            http_client.request = functools.partial(http_client.request, verify=verify)
+        self._app = msal.ConfidentialClientApplication(
+            client_id,
+            authority=f"{authority_base_url}/{tenant_id}",
+            client_credential=client_secret,
+            token_cache=msal.TokenCache(),
+            # Instance discovery only knows Microsoft's public cloud; skip it
+            # for sovereign clouds and local stand-ins.
+            instance_discovery=authority_base_url == AUTHORITY_BASE_URL,
+            http_client=http_client,
+        )
+        self._lock = threading.Lock()
+        self._access_token = None
+        self._expires_at = 0.0
+        self.cache_hits = 0
+        self.network_fetches = 0
+
+    def _token_is_fresh(self):
+        return self._access_token and time.time() < self._expires_at - self.refresh_margin
+
+    def _count(self, source):
+        # Called under self._lock. stats() reports the counters for this
+        # credential; the metric is exported on /metrics.
+        if source == "cache":
+            self.cache_hits += 1
+        else:
+            self.network_fetches += 1
+        tracing.METRICS.inc("onboarding_graph_tokens_total", source=source)
+
+    def get_token(self):
+        if self._token_is_fresh():
+            with self._lock:
+                self._count("cache")
+            return self._access_token
+        with self._lock:
+            # Another thread may have refreshed while we waited on the lock.
+            if self._token_is_fresh():
+                self._count("cache")
+                return self._access_token
+            with tracing.span("graph.token") as token_span:
+                token_result = self._app.acquire_token_for_client(scopes=self.scopes)
+                if "access_token" not in token_result:
+                    raise GraphAuthError(
+                        token_result.get("error_description") or "Failed to authenticate with Microsoft Graph."
+                    )
+                token_span.set(source=token_result.get("token_source", "identity_provider"))
+            self._count("cache" if token_result.get("token_source") == "cache" else "network")
+            self._access_token = token_result["access_token"]
+            self._expires_at = time.time() + int(token_result.get("expires_in", 3599))
+            return self._access_token
+
+    def stats(self):
+        return {
+            "token_cache_hits": self.cache_hits,
+            "token_network_fetches": self.network_fetches,
+        }
@@ -0,0 +1,139 @@
+import base64
+import json
+
+from graph_client import IDEMPOTENT_METHODS, GraphError, should_retry
+
+# Graph accepts at most 20 requests in one $batch call, and requests may
+# only depend on other requests in the same call.
+MAX_BATCH_REQUESTS = 20
+FAILED_DEPENDENCY = 424
+
+
+class BatchResponse:
+    # Quacks like a requests.Response for the status checks the helpers make.
+    def __init__(self, request_id, status_code, headers=None, body=None):
+        self.id = request_id
+        self.status_code = status_code
+        self.headers = headers or {}
+        self.body = body
+
+    @property
+    def ok(self):
+        return 200 <= self.status_code < 300
+
+    @property
+    def text(self):
+        if self.body is None:
+            return ""
+        return self.body if isinstance(self.body, str) else json.dumps(self.body)
+
+    def json(self):
+        return self.body
+
+
+class GraphBatch:
+    # Collects independent Graph calls and sends them through /$batch, 20 at a
+    # time. Each request can depend on earlier ones; requests throttled inside
+    # the batch (and whatever depended on them) are resent after Retry-After.
+    def __init__(self, client, max_retries=None):
+        self.client = client
+        self.max_retries = client.max_retries if max_retries is None else max_retries
+        self._requests = []
+        self._bodies = {}
+
+    def __len__(self):
+        return len(self._requests)
+
+    def add(self, method, path, json=None, data=None, headers=None, depends_on=None):
+        request_id = str(len(self._requests) + 1)
+        request = {"id": request_id, "method": method.upper(), "url": "/" + path.lstrip("/")}
+        headers = dict(headers or {})
+        if json is not None:
+            request["body"] = json
+            self._bodies[request_id] = {"json": json}
+            headers.setdefault("Content-Type", "application/json")
+        elif data is not None:
+            self._bodies[request_id] = {"data": data}
+            # Non-JSON bodies travel base64 encoded and need a Content-Type.
+            request["body"] = base64.b64encode(data).decode()
+            headers.setdefault("Content-Type", "application/octet-stream")
+        if headers:
+            request["headers"] = headers
+        if depends_on:
+            request["dependsOn"] = list(depends_on)
+        self._requests.append(request)
+        return request_id
+
+    def execute(self):
+        results = {}
+        pending = list(self._requests)
+        for attempt in range(self.max_retries + 1):
+            self._send_all(pending, results)
+            retry = self._retryable(pending, results)
+            if not retry or attempt == self.max_retries:
+                break
+            throttled = [results[r["id"]] for r in retry if results[r["id"]].status_code != FAILED_DEPENDENCY]
+            self.client._backoff(
+                max(self.client._retry_delay(attempt, resp) for resp in throttled),
+                throttled=any(resp.status_code == 429 for resp in throttled),
+            )
+            pending = retry
+        return results
+
+    def _retryable(self, pending, results):
+        retry_ids = set()
+        for request in pending:
+            status = results[request["id"]].status_code
+            if should_retry(status, request["method"] in IDEMPOTENT_METHODS):
+                retry_ids.add(request["id"])
+            elif status == FAILED_DEPENDENCY and retry_ids.intersection(request.get("dependsOn", ())):
+                retry_ids.add(request["id"])
+        return [request for request in pending if request["id"] in retry_ids]
+
+    def _send_all(self, pending, results):
+        chunk = []
+        for request in pending:
+            if len(chunk) == MAX_BATCH_REQUESTS:
+                self._send(chunk, results)
+                chunk = []
+            in_chunk = {queued["id"] for queued in chunk}
+            earlier = [dep for dep in request.get("dependsOn", ()) if dep not in in_chunk]
+            if any(dep in results and not results[dep].ok for dep in earlier):
+                results[request["id"]] = BatchResponse(request["id"], FAILED_DEPENDENCY)
+                continue
+            # Dependencies sent in an earlier call have already succeeded.
+            request = dict(request)
+            depends_on = [dep for dep in request.pop("dependsOn", ()) if dep in in_chunk]
+            if depends_on:
+                request["dependsOn"] = depends_on
+            chunk.append(request)
+        if chunk:
+            self._send(chunk, results)
+
+    def _send(self, chunk, results):
+        if len(chunk) == 1:
+            # A lone request gains nothing from the batch envelope.
+            request = chunk[0]
+            resp = self.client.request(
+                request["method"], request["url"], headers=request.get("headers"), **self._bodies.get(request["id"], {})
+            )
+            try:
+                body = resp.json() if resp.content else None
+            except ValueError:
+                body = resp.text
+            results[request["id"]] = BatchResponse(request["id"], resp.status_code, resp.headers, body)
+            return
+        resp = self.client.post(
+            "$batch", json={"requests": chunk}, cost=len(chunk),
+            idempotent=all(request["method"] in IDEMPOTENT_METHODS for request in chunk),
+        )
+        if resp.status_code != 200:
+            raise GraphError(f"Graph batch request failed: {resp.status_code} {resp.text}", resp.status_code, resp.text)
+        answered = set()
+        for item in resp.json().get("responses", []):
+            results[item["id"]] = BatchResponse(item["id"], item["status"], item.get("headers"), item.get("body"))
+            answered.add(item["id"])
+        for request in chunk:
+            # Graph should answer every request; treat a missing one as failed.
+            if request["id"] not in answered:
+                results[request["id"]] = BatchResponse(request["id"], 500)
@@ -0,0 +1,170 @@
+import random
+import time
+from contextlib import nullcontext
+
+import tracing
+
+GRAPH_BASE_URL = "https://graph.microsoft.com/v1.0"
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+IDEMPOTENT_METHODS = {"GET", "PUT", "DELETE", "HEAD"}
+
+
+class GraphError(Exception):
+    def __init__(self, message, status_code=None, body=None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.body = body
+
+
+def should_retry(status_code, idempotent):
+    # A 5xx is retried only for idempotent calls; a 429 means the request
+    # was refused, so it is always safe to replay.
+    return status_code in RETRY_STATUS_CODES and (idempotent or status_code == 429)
+
+
+def _never_sent(error):
+    # True when the request cannot have reached Graph: DNS failure, refused
+    # connection or connect timeout. Anything later (e.g. "Connection
+    # aborted" after the body went out) may already have taken effect.
+    import requests
+    from urllib3.exceptions import NewConnectionError
+
+    if isinstance(error, requests.ConnectTimeout):
+        return True
+    reason = error.args[0] if error.args else None
+    return isinstance(getattr(reason, "reason", reason), NewConnectionError)
+
+
+class GraphClient:
+    # Every Graph call goes through one pooled session so TLS connections are
+    # reused, each request has a timeout, and throttling is retried politely.
+    def __init__(self, credential, base_url=GRAPH_BASE_URL, pool_size=20,
+                 connect_timeout=5, read_timeout=60, max_retries=5,
+                 backoff_base=0.5, backoff_max=30, verify=True, admission=None):
+        self.credential = credential
+        self.base_url = base_url.rstrip("/")
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        # True, False or a CA bundle path (e.g. for a local stand-in server).
+        # Passed per request because requests lets REQUESTS_CA_BUNDLE override
+        # a session-wide setting.
+        self.verify = verify
+        # Optional graph_admission.AdmissionController shared by every client
+        # in the process.
+        self.admission = admission
+        # requests is imported here rather than at module level so the app's
+        # first render does not pay for it; the client is built on first use.
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def url(self, path):
+        if path.startswith("http://") or path.startswith("https://"):
+            return path
+        return f"{self.base_url}/{path.lstrip('/')}"
+
+    def _retry_delay(self, attempt, resp=None):
+        if resp is not None:
+            retry_after = resp.headers.get("Retry-After")
+            if retry_after:
+                try:
+                    return min(float(retry_after), self.backoff_max)
+                except ValueError:
+                    pass
+        delay = min(self.backoff_base * (2 ** attempt), self.backoff_max)
+        return delay * random.uniform(0.5, 1.0)
+
+    def _backoff(self, delay, throttled=False, admitted=False):
+        # Throttling applies to the whole tenant, so under admission control
+        # a 429 pauses every caller and the next acquire() does the waiting.
+        # Requests that skip acquire() (upload-session chunks) still sleep.
+        if throttled and self.admission:
+            self.admission.pause(delay)
+            if admitted:
+                return
+        time.sleep(delay)
+
+    def upload_slot(self, owner=None):
+        return self.admission.upload_slot(owner) if self.admission else nullcontext()
+
+    def _count(self, method, status=None, retry_reason=None):
+        # Totals go to the metrics registry; the enclosing span (if any)
+        # gets this call's status, request count and retries.
+        current = tracing.current_span()
+        if status is not None:
+            tracing.METRICS.inc("onboarding_graph_requests_total", method=method, status=status)
+            if current:
+                current.add("http_requests")
+                current.set(http_status=status)
+        if retry_reason is not None:
+            tracing.METRICS.inc("onboarding_graph_retries_total", method=method, reason=retry_reason)
+            if current:
+                current.add("retries")
+                if retry_reason == "429":
+                    current.add("throttled")
+
+    def request(self, method, path, auth=True, headers=None, timeout=None, cost=1, idempotent=None, **kwargs):
+        # idempotent overrides the method's default, e.g. for a $batch POST
+        # made only of GETs.
+        import requests
+
+        url = self.url(path)
+        method = method.upper()
+        if idempotent is None:
+            idempotent = method in IDEMPOTENT_METHODS
+        headers = dict(headers or {})
+        last_error = None
+        for attempt in range(self.max_retries + 1):
+            # Upload-session chunks (auth=False) go to pre-authenticated
+            # storage URLs; the upload slots bound those instead.
+            if self.admission and auth:
+                self.admission.acquire(cost)
+            if auth:
+                headers["Authorization"] = f"Bearer {self.credential.get_token()}"
+            resp = None
+            try:
+                resp = self.session.request(
+                    method, url, headers=headers, timeout=timeout or self.timeout, verify=self.verify, **kwargs
+                )
+            except (requests.ConnectionError, requests.Timeout) as e:
+                # A POST or PATCH (e.g. sendMail) that failed after it was
+                # sent may already have taken effect, so only idempotent calls
+                # are replayed then.
+                reason = "timeout" if isinstance(e, requests.Timeout) else "connection"
+                if not idempotent and not _never_sent(e):
+                    self._count(method, status=reason)
+                    raise GraphError(f"{method} {url} failed: {e}") from e
+                last_error = e
+            else:
+                self._count(method, status=resp.status_code)
+                if not should_retry(resp.status_code, idempotent):
+                    return resp
+                reason = str(resp.status_code)
+            if attempt == self.max_retries:
+                break
+            self._count(method, retry_reason=reason)
+            self._backoff(self._retry_delay(attempt, resp), throttled=reason == "429", admitted=auth)
+        if resp is not None:
+            return resp
+        raise GraphError(f"{method} {url} failed after {self.max_retries + 1} attempts: {last_error}")
+
+    def get(self, path, **kwargs):
+        return self.request("GET", path, **kwargs)
+
+    def post(self, path, **kwargs):
+        return self.request("POST", path, **kwargs)
+
+    def put(self, path, **kwargs):
+        return self.request("PUT", path, **kwargs)
+
+    def patch(self, path, **kwargs):
+        return self.request("PATCH", path, **kwargs)
+
+    def delete(self, path, **kwargs):
+        return self.request("DELETE", path, **kwargs)
@@ -0,0 +1,122 @@
+import base64
+import hashlib
+import io
+import os
+import threading
+from collections import OrderedDict
+
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+NORMALIZABLE_EXTENSIONS = {".jpg", ".jpeg", ".png"}
+
+
+class ImageSettings:
+    def __init__(self, normalize=False, max_dimension=2000, target_dpi=200,
+                 jpeg_quality=85, thumbnail_size=128, thumbnail_quality=80):
+        self.normalize = normalize
+        self.max_dimension = max_dimension
+        self.target_dpi = target_dpi
+        self.jpeg_quality = jpeg_quality
+        self.thumbnail_size = thumbnail_size
+        self.thumbnail_quality = thumbnail_quality
+
+
+def content_hash(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def _flatten(img):
+    # JPEG has no alpha channel; composite transparent PNGs onto white.
+    if img.mode in ("RGBA", "LA", "P"):
+        img = img.convert("RGBA")
+        background = Image.new("RGB", img.size, (255, 255, 255))
+        background.paste(img, mask=img.getchannel("A"))
+        return background
+    return img.convert("RGB") if img.mode != "RGB" else img
+
+
+def make_thumbnail(data, settings):
+    with Image.open(io.BytesIO(data)) as img:
+        img = ImageOps.exif_transpose(img)
+        img.thumbnail((settings.thumbnail_size, settings.thumbnail_size))
+        out = io.BytesIO()
+        _flatten(img).save(out, "JPEG", quality=settings.thumbnail_quality, optimize=True)
+    return base64.b64encode(out.getvalue()).decode()
+
+
+def resize_png(data, max_dimension):
+    # For static assets shown small: st.image re-checks (and re-encodes) an
+    # oversized image on every rerun, a small one it passes straight through.
+    with Image.open(io.BytesIO(data)) as img:
+        if max(img.size) <= max_dimension:
+            return data
+        img.thumbnail((max_dimension, max_dimension))
+        out = io.BytesIO()
+        img.save(out, "PNG", optimize=True)
+    return out.getvalue()
+
+
+def normalize_image(data, filename, settings):
+    # Opt-in (NORMALIZE_UPLOADED_IMAGES): downsamples oversized phone photos
+    # and scans to the configured pixel size and DPI, recompressing them
+    # lossily. Returns the original bytes when the file is not an image
+    # we handle or recompression would not make it smaller.
+    ext = os.path.splitext(filename)[1].lower()
+    if not settings.normalize or ext not in NORMALIZABLE_EXTENSIONS:
+        return data
+    try:
+        with Image.open(io.BytesIO(data)) as img:
+            img = ImageOps.exif_transpose(img)
+            dpi = img.info.get("dpi", (0, 0))[0] or 0
+            scale = 1.0
+            if settings.target_dpi and dpi > settings.target_dpi:
+                scale = settings.target_dpi / dpi
+            longest = max(img.size) * scale
+            if longest > settings.max_dimension:
+                scale *= settings.max_dimension / longest
+            if scale < 1.0:
+                img = img.resize(
+                    (max(1, round(img.width * scale)), max(1, round(img.height * scale))), Image.LANCZOS
+                )
+            save_kwargs = {}
+            if settings.target_dpi:
+                save_kwargs["dpi"] = (min(dpi, settings.target_dpi) or settings.target_dpi,) * 2
+            out = io.BytesIO()
+            if ext == ".png":
+                # optimize=True tries every filter and takes seconds on a
+                # large scan for a few percent.
+                img.save(out, "PNG", **save_kwargs)
+            else:
+                _flatten(img).save(out, "JPEG", quality=settings.jpeg_quality, optimize=True, **save_kwargs)
+    except (UnidentifiedImageError, OSError, ValueError):
+        return data
+    result = out.getvalue()
+    return result if len(result) < len(data) else data
+
+
+class ThumbnailCache:
+    # Avatar thumbnails keyed by content hash, shared by every session, so a
+    # photo is decoded and resized once rather than on every rerun.
+    def __init__(self, settings, max_entries=512):
+        self.settings = settings
+        self.max_entries = max_entries
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, digest, load):
+        # load() returns the photo's bytes; it is only called on a miss, so
+        # a rerun never reads a photo (possibly spilled to disk) it has
+        # already thumbnailed.
+        with self._lock:
+            if digest in self._items:
+                self._items.move_to_end(digest)
+                return self._items[digest]
+        try:
+            thumbnail = make_thumbnail(load(), self.settings)
+        except (UnidentifiedImageError, OSError, ValueError):
+            return None
+        with self._lock:
+            self._items[digest] = thumbnail
+            while len(self._items) > self.max_entries:
+                self._items.popitem(last=False)
+        return thumbnail
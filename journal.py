@@ -0,0 +1,236 @@
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS submissions (
+    submission_key TEXT PRIMARY KEY,
+    family TEXT NOT NULL,
+    content_hash TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    completed_at REAL
+);
+CREATE TABLE IF NOT EXISTS submission_steps (
+    submission_key TEXT NOT NULL REFERENCES submissions(submission_key),
+    step TEXT NOT NULL,
+    result TEXT,
+    completed_at REAL NOT NULL,
+    PRIMARY KEY (submission_key, step)
+);
+CREATE TABLE IF NOT EXISTS submission_index (
+    submission_key TEXT PRIMARY KEY REFERENCES submissions(submission_key),
+    family TEXT NOT NULL,
+    members TEXT NOT NULL,
+    submitted_at REAL NOT NULL,
+    content_hash TEXT NOT NULL,
+    archive_size INTEGER,
+    item_id TEXT,
+    web_url TEXT
+);
+CREATE INDEX IF NOT EXISTS submission_index_submitted_at ON submission_index (submitted_at);
+CREATE VIRTUAL TABLE IF NOT EXISTS submission_search USING fts5 (
+    family, names, emails, phones, tokenize = "unicode61 tokenchars '.@+_-'"
+);
+"""
+
+
+def _file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def content_hash(entries):
+    # Hash of what goes into the archive (names and contents), not of the zip
+    # bytes, which change with every build because of entry timestamps.
+    digest = hashlib.sha256()
+    for arcname, data in sorted(entries, key=lambda entry: entry[0]):
+        if hasattr(data, "digest"):
+            data_hash = data.digest
+        elif isinstance(data, os.PathLike):
+            data_hash = _file_hash(data)
+        else:
+            raw = data.encode("utf-8") if isinstance(data, str) else data
+            data_hash = hashlib.sha256(raw).hexdigest()
+        digest.update(f"{arcname}\0{data_hash}\n".encode("utf-8"))
+    return digest.hexdigest()
+
+
+def _phone_terms(phone):
+    # The number as typed, all its digits, and the last ten (no country
+    # code), so "+91 98765 43210", "919876543210" and "9876543210" all match.
+    digits = re.sub(r"\D", "", phone or "")
+    return " ".join(term for term in (phone, digits, digits[-10:]) if term)
+
+
+def _match_query(query):
+    # Emails and phone numbers are single tokens (see the tokenizer's
+    # tokenchars), so "ravi.k@example.com" is one prefix term rather than
+    # "example" and "com" matching every row. A term with "@" or "." is
+    # looked up in emails, any other word in names only (a prefix over every
+    # email would be slow), and a query that looks like a phone number
+    # matches on its digits.
+    if re.fullmatch(r"[\d\s()+-]+", query) and re.search(r"\d", query):
+        digits = re.sub(r"\D", "", query)
+        terms = {digits, digits[-10:]}
+        return " OR ".join(f'phones : "{term}"*' for term in sorted(terms))
+    clauses = []
+    for term in query.lower().split():
+        term = term.strip(".-_")
+        if not term or '"' in term:
+            continue
+        columns = "emails" if "@" in term or "." in term else "{family names}"
+        clauses.append(f'{columns} : "{term}"*')
+    return " AND ".join(clauses)
+
+
+def submission_key(family, entries_hash):
+    return f"{family.strip().lower()}:{entries_hash}"
+
+
+class SubmissionJournal:
+    # Local record of which steps of a submission have completed, so a retry
+    # (or a second click, or a restarted server) skips work already done and
+    # never re-uploads or re-sends for identical content.
+    def __init__(self, path):
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(SCHEMA)
+        self._lock = threading.Lock()
+
+    def begin(self, key, family, entries_hash):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR IGNORE INTO submissions (submission_key, family, content_hash, created_at) VALUES (?, ?, ?, ?)",
+                (key, family, entries_hash, time.time()),
+            )
+        return self.lookup(key)
+
+    def lookup(self, key):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT family, content_hash, created_at, completed_at FROM submissions WHERE submission_key = ?",
+                (key,),
+            ).fetchone()
+            if not row:
+                return None
+            steps = self._conn.execute(
+                "SELECT step, result FROM submission_steps WHERE submission_key = ?", (key,)
+            ).fetchall()
+        return {
+            "family": row[0],
+            "content_hash": row[1],
+            "created_at": row[2],
+            "completed_at": row[3],
+            "steps": {step: json.loads(result) if result else None for step, result in steps},
+        }
+
+    def record_step(self, key, step, result=None):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO submission_steps (submission_key, step, result, completed_at) VALUES (?, ?, ?, ?)",
+                (key, step, json.dumps(result) if result is not None else None, time.time()),
+            )
+
+    def complete(self, key):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "UPDATE submissions SET completed_at = ? WHERE submission_key = ? AND completed_at IS NULL",
+                (time.time(), key),
+            )
+
+    def index_submission(self, key, members, submitted_at, archive_size=None, item_id=None, web_url=None):
+        # One searchable row per completed submission; members is
+        # [{"name", "age", "email", "phone"}] as in the spec. The search row
+        # shares the index row's rowid.
+        with self._lock, self._conn:
+            row = self._conn.execute(
+                "SELECT family, content_hash FROM submissions WHERE submission_key = ?", (key,)
+            ).fetchone()
+            if not row:
+                return False
+            family, entries_hash = row
+            previous = self._conn.execute(
+                "SELECT rowid FROM submission_index WHERE submission_key = ?", (key,)
+            ).fetchone()
+            if previous:
+                self._conn.execute("DELETE FROM submission_search WHERE rowid = ?", previous)
+            rowid = self._conn.execute(
+                "INSERT OR REPLACE INTO submission_index (submission_key, family, members, submitted_at, content_hash, "
+                "archive_size, item_id, web_url) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (key, family, json.dumps(members), submitted_at, entries_hash, archive_size, item_id, web_url),
+            ).lastrowid
+            self._conn.execute(
+                "INSERT INTO submission_search (rowid, family, names, emails, phones) VALUES (?, ?, ?, ?, ?)",
+                (
+                    rowid, family,
+                    " ".join(member.get("name") or "" for member in members),
+                    " ".join(member.get("email") or "" for member in members),
+                    " ".join(_phone_terms(member.get("phone")) for member in members),
+                ),
+            )
+        return True
+
+    def backfill_index(self):
+        # Submissions completed before the index existed: family, archive and
+        # OneDrive item from the journal's own steps, no member details.
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT s.submission_key, s.completed_at, a.result, u.result FROM submissions s "
+                "LEFT JOIN submission_steps a ON a.submission_key = s.submission_key AND a.step = 'archive' "
+                "LEFT JOIN submission_steps u ON u.submission_key = s.submission_key AND u.step = 'upload' "
+                "WHERE s.completed_at IS NOT NULL AND s.submission_key NOT IN (SELECT submission_key FROM submission_index)"
+            ).fetchall()
+        for key, completed_at, archive, upload in rows:
+            archive = json.loads(archive) if archive else {}
+            upload = json.loads(upload) if upload else {}
+            self.index_submission(
+                key, [], completed_at, archive.get("size"), upload.get("item_id"), upload.get("web_url")
+            )
+        return len(rows)
+
+    def search(self, query="", limit=20):
+        # Newest first; names, emails and phone numbers match by word prefix.
+        # An empty query lists the latest submissions.
+        columns = (
+            "i.submission_key, i.family, i.members, i.submitted_at, i.content_hash, i.archive_size, i.item_id, i.web_url"
+        )
+        match = _match_query(query)
+        with self._lock:
+            if match:
+                rows = self._conn.execute(
+                    f"SELECT {columns} FROM submission_search JOIN submission_index i ON i.rowid = submission_search.rowid "
+                    "WHERE submission_search MATCH ? ORDER BY i.submitted_at DESC LIMIT ?",
+                    (match, limit),
+                ).fetchall()
+            elif query.strip():
+                rows = []
+            else:
+                rows = self._conn.execute(
+                    f"SELECT {columns} FROM submission_index i ORDER BY i.submitted_at DESC LIMIT ?", (limit,)
+                ).fetchall()
+        return [
+            {
+                "submission_key": row[0],
+                "family": row[1],
+                "members": json.loads(row[2]),
+                "submitted_at": row[3],
+                "content_hash": row[4],
+                "archive_size": row[5],
+                "item_id": row[6],
+                "web_url": row[7],
+            }
+            for row in rows
+        ]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,184 @@
+import json
+
+from graph_batch import GraphBatch
+from graph_client import GraphError
+
+# Graph rejects inline fileAttachments much above 3 MB. Between that and
+# LINK_ONLY_THRESHOLD the file goes through an attachment upload session on
+# a draft; beyond it (or beyond Graph's 150 MB cap) only a link is sent.
+INLINE_ATTACHMENT_LIMIT = 3 * 1024 * 1024
+LINK_ONLY_THRESHOLD = 25 * 1024 * 1024
+MAX_ATTACHMENT_SIZE = 150 * 1024 * 1024
+ATTACHMENT_CHUNK_SIZE = 4 * 1024 * 1024
+# Keep a whole $batch of messages comfortably under Graph's request size cap.
+BATCH_PAYLOAD_LIMIT = 4 * 1024 * 1024
+
+MODE_PLAIN = "plain"
+MODE_INLINE = "inline"
+MODE_UPLOAD_SESSION = "upload_session"
+MODE_LINK = "link"
+
+
+def choose_attachment_mode(size, share_link=None):
+    if size <= INLINE_ATTACHMENT_LIMIT:
+        return MODE_INLINE
+    if share_link and size > LINK_ONLY_THRESHOLD:
+        return MODE_LINK
+    if size <= MAX_ATTACHMENT_SIZE:
+        return MODE_UPLOAD_SESSION
+    if share_link:
+        return MODE_LINK
+    raise GraphError(f"Attachment of {size} bytes is too large to email and no OneDrive link is available.")
+
+
+def build_message(sender, to, subject, body):
+    return {
+        "subject": subject,
+        "body": {
+            "contentType": "Text",
+            "content": body
+        },
+        "toRecipients": [
+            {"emailAddress": {"address": to}}
+        ],
+        "from": {"emailAddress": {"address": sender}},
+    }
+
+
+def _send(client, sender, message):
+    resp = client.post(f"users/{sender}/sendMail", json={"message": message, "saveToSentItems": "false"})
+    if resp.status_code != 202:
+        raise GraphError(f"Failed to send email: {resp.status_code} {resp.text}", resp.status_code, resp.text)
+
+
+def _send_with_upload_session(client, sender, message, attachment, attachment_name):
+    resp = client.post(f"users/{sender}/messages", json=message)
+    if resp.status_code != 201:
+        raise GraphError(f"Failed to create email draft: {resp.status_code} {resp.text}", resp.status_code, resp.text)
+    message_id = resp.json()["id"]
+    try:
+        _attach_and_send(client, sender, message_id, attachment, attachment_name)
+    except Exception:
+        # The draft holds the family's documents; a retry makes a new one,
+        # so this one must not be left in the sender's mailbox.
+        _delete_draft(client, sender, message_id)
+        raise
+
+
+def _delete_draft(client, sender, message_id):
+    try:
+        client.delete(f"users/{sender}/messages/{message_id}")
+    except GraphError:
+        pass
+
+
+def _attach_and_send(client, sender, message_id, attachment, attachment_name):
+    size = attachment.size
+    resp = client.post(
+        f"users/{sender}/messages/{message_id}/attachments/createUploadSession",
+        json={"AttachmentItem": {"attachmentType": "file", "name": attachment_name, "size": size}},
+    )
+    if resp.status_code != 201:
+        raise GraphError(f"Failed to create attachment upload session: {resp.status_code} {resp.text}", resp.status_code, resp.text)
+    upload_url = resp.json()["uploadUrl"]
+
+    offset = 0
+    with client.upload_slot():
+        for chunk in attachment.iter_chunks(ATTACHMENT_CHUNK_SIZE):
+            end = offset + len(chunk) - 1
+            resp = client.put(
+                upload_url,
+                auth=False,
+                headers={"Content-Length": str(len(chunk)), "Content-Range": f"bytes {offset}-{end}/{size}",
+                         "Content-Type": "application/octet-stream"},
+                data=chunk,
+            )
+            if resp.status_code not in [200, 201]:
+                raise GraphError(f"Failed to upload email attachment: {resp.status_code} {resp.text}", resp.status_code, resp.text)
+            offset = end + 1
+
+    resp = client.post(f"users/{sender}/messages/{message_id}/send")
+    if resp.status_code != 202:
+        raise GraphError(f"Failed to send email: {resp.status_code} {resp.text}", resp.status_code, resp.text)
+
+
+def _prepare(sender, to, subject, body, attachment, attachment_name, share_link):
+    # Returns (mode, message); the upload-session mode needs the attachment
+    # added separately after the draft exists.
+    if attachment is None or not attachment_name:
+        return MODE_PLAIN, build_message(sender, to, subject, body)
+
+    mode = choose_attachment_mode(attachment.size, share_link)
+    if mode == MODE_LINK:
+        if share_link not in body:
+            body = f"{body}\nDownload all documents: {share_link}\n"
+    message = build_message(sender, to, subject, body)
+    if mode == MODE_INLINE:
+        message["attachments"] = [{
+            "@odata.type": "#microsoft.graph.fileAttachment",
+            "name": attachment_name,
+            "contentBytes": attachment.b64()
+        }]
+    return mode, message
+
+
+def send_email(client, sender, to, subject, body, attachment=None, attachment_name=None, share_link=None):
+    # attachment is anything with size, b64() and iter_chunks(), normally a
+    # SpooledArchive, so every recipient shares one encoded payload.
+    mode, message = _prepare(sender, to, subject, body, attachment, attachment_name, share_link)
+    if mode == MODE_UPLOAD_SESSION:
+        _send_with_upload_session(client, sender, message, attachment, attachment_name)
+    else:
+        _send(client, sender, message)
+    return mode
+
+
+def send_emails(client, sender, emails, attachment=None, attachment_name=None, share_link=None):
+    # emails: [{"key", "to", "subject", "body"}], optionally with their own
+    # "share_link" in place of share_link and "attachment" in place of
+    # attachment (None for no attachment). Messages that fit together
+    # go out in one $batch call; upload-session ones are sent on their own.
+    # Returns {key: mode or GraphError} so each recipient fails separately.
+    results = {}
+    batch = GraphBatch(client)
+    batched = {}
+    payload = 0
+    for email in emails:
+        email_attachment = email.get("attachment", attachment)
+        try:
+            mode, message = _prepare(
+                sender, email["to"], email["subject"], email["body"], email_attachment, attachment_name,
+                email.get("share_link", share_link),
+            )
+        except GraphError as e:
+            results[email["key"]] = e
+            continue
+        size = len(json.dumps(message)) if mode == MODE_INLINE else len(email["body"])
+        if mode != MODE_UPLOAD_SESSION and payload + size <= BATCH_PAYLOAD_LIMIT:
+            payload += size
+            request_id = batch.add("POST", f"users/{sender}/sendMail", json={"message": message, "saveToSentItems": "false"})
+            batched[request_id] = (email["key"], mode)
+            continue
+        try:
+            if mode == MODE_UPLOAD_SESSION:
+                _send_with_upload_session(client, sender, message, email_attachment, attachment_name)
+            else:
+                _send(client, sender, message)
+            results[email["key"]] = mode
+        except GraphError as e:
+            results[email["key"]] = e
+
+    if batched:
+        try:
+            responses = batch.execute()
+        except GraphError as e:
+            responses = {}
+            for key, _ in batched.values():
+                results[key] = e
+        for request_id, resp in responses.items():
+            key, mode = batched[request_id]
+            if resp.status_code == 202:
+                results[key] = mode
+            else:
+                results[key] = GraphError(f"Failed to send email: {resp.status_code} {resp.text}", resp.status_code, resp.text)
+    return results
@@ -0,0 +1,281 @@
+import os
+import re
+import tomllib
+import zipfile
+from collections import Counter
+
+import images
+import tracing
+from archive import ArchiveWriter, SpooledArchive
+from graph_admission import AdmissionController
+from graph_auth import AUTHORITY_BASE_URL, GraphAuthError, GraphCredential
+from graph_client import GRAPH_BASE_URL, GraphClient, GraphError
+
+# Sender of every email and recipient of the admin copy.
+EMAIL_ADDRESS = "contactus@sssdistributors.com"
+EMAIL_SUBJECT = "✨ SSS Distributors Onboarding Submission Received"
+
+
+# The app passes st.secrets and the command-line tools load_config's dict
+# (secrets.toml overridden by environment variables), so both read the same
+# keys with the same defaults.
+def load_config(secrets_path):
+    config = {}
+    if secrets_path and os.path.exists(secrets_path):
+        with open(secrets_path, "rb") as f:
+            config.update(tomllib.load(f))
+    for key in ("ONEDRIVE_CLIENT_ID", "ONEDRIVE_CLIENT_SECRET", "ONEDRIVE_TENANT_ID", "GRAPH_BASE_URL",
+                "GRAPH_AUTHORITY_URL", "GRAPH_CA_BUNDLE", "GRAPH_MAX_REQUESTS_PER_SECOND", "GRAPH_REQUEST_BURST",
+                "GRAPH_MAX_CONCURRENT_UPLOADS", "NORMALIZE_UPLOADED_IMAGES", "IMAGE_MAX_DIMENSION",
+                "IMAGE_TARGET_DPI", "IMAGE_JPEG_QUALITY", "SUBMISSION_JOURNAL_PATH", "TRACE_LOG_LEVEL",
+                "SHARE_LINK_EXPIRY_DAYS"):
+        if key in os.environ:
+            config[key] = os.environ[key]
+    if isinstance(config.get("NORMALIZE_UPLOADED_IMAGES"), str):
+        config["NORMALIZE_UPLOADED_IMAGES"] = config["NORMALIZE_UPLOADED_IMAGES"].lower() not in ("0", "false", "no")
+    return config
+
+
+def image_settings(config):
+    return images.ImageSettings(
+        normalize=config.get("NORMALIZE_UPLOADED_IMAGES", False),
+        max_dimension=int(config.get("IMAGE_MAX_DIMENSION", 2000)),
+        target_dpi=int(config.get("IMAGE_TARGET_DPI", 200)),
+        jpeg_quality=int(config.get("IMAGE_JPEG_QUALITY", 85)),
+        thumbnail_size=int(config.get("AVATAR_THUMBNAIL_SIZE", 128)),
+    )
+
+
+def graph_credential(config):
+    # GRAPH_AUTHORITY_URL, GRAPH_BASE_URL and GRAPH_CA_BUNDLE point at a
+    # sovereign cloud or at benchmarks/fake_graph.py.
+    return GraphCredential(
+        config["ONEDRIVE_CLIENT_ID"], config["ONEDRIVE_CLIENT_SECRET"], config["ONEDRIVE_TENANT_ID"],
+        authority_base_url=config.get("GRAPH_AUTHORITY_URL", AUTHORITY_BASE_URL),
+        verify=config.get("GRAPH_CA_BUNDLE", True),
+    )
+
+
+def admission_controller(config):
+    return AdmissionController(
+        rate=float(config.get("GRAPH_MAX_REQUESTS_PER_SECOND", 10)),
+        burst=int(config.get("GRAPH_REQUEST_BURST", 20)),
+        max_uploads=int(config.get("GRAPH_MAX_CONCURRENT_UPLOADS", 2)),
+    )
+
+
+def graph_client(config, credential, admission=None):
+    return GraphClient(
+        credential, base_url=config.get("GRAPH_BASE_URL", GRAPH_BASE_URL),
+        verify=config.get("GRAPH_CA_BUNDLE", True), admission=admission,
+    )
+
+
+def prewarm(client, user=EMAIL_ADDRESS):
+    # One cheap authenticated call fetches the token (and runs MSAL's
+    # authority discovery) and leaves a TLS connection in the client's pool.
+    with tracing.span("graph.prewarm"):
+        try:
+            client.get(f"users/{user}/drive/root", params={"$select": "id"})
+        except (GraphError, GraphAuthError, OSError) as e:
+            tracing.logger.warning("Graph prewarm failed: %s", e)
+
+
+def safe_name(name):
+    return re.sub(r'[^A-Za-z0-9_]', '_', name.replace(' ', '_'))
+
+
+def family_folder_path(family_name):
+    return ["Client Data", safe_name(family_name)]
+
+
+def member_details_text(member):
+    details_lines = [
+        f"Name: {member['name']}",
+        f"Age: {member.get('age', '')}",
+    ]
+    docs = member.get('docs', {})
+    if member.get('age', 0) < 18:
+        details_lines.append("Type: Minor")
+        details_lines.append(f"Number of Guardians: {len(docs.get('Guardians', []))}")
+        for idx_g, guardian in enumerate(docs.get('Guardians', [])):
+            details_lines.append(f"  Guardian {idx_g+1}:")
+            for gkey, gfile in guardian.items():
+                details_lines.append(f"    {gkey}: {'Uploaded' if gfile else 'Not uploaded'}")
+        details_lines.append(f"Birth Certificate: {'Uploaded' if docs.get('Birth Certificate') else 'Not uploaded'}")
+        details_lines.append(f"Minor PAN Card: {'Uploaded' if docs.get('Minor PAN Card (optional)') else 'Not uploaded'}")
+    else:
+        details_lines.append("Type: Adult")
+        details_lines.append(f"E-Aadhaar: {'Uploaded' if docs.get('E-Aadhaar') else 'Not uploaded'}")
+        details_lines.append(f"PAN Card: {'Uploaded' if docs.get('PAN Card') else 'Not uploaded'}")
+        details_lines.append(f"Cancelled Cheque/Bank Statement: {'Uploaded' if docs.get('Cancelled Cheque/Bank Statement') else 'Not uploaded'}")
+        details_lines.append(f"Passport Size Photo: {'Uploaded' if docs.get('Passport Size Photo') else 'Not uploaded'}")
+        details_lines.append(f"Email: {docs.get('Email', '')}")
+        details_lines.append(f"Phone: {docs.get('Phone', '')}")
+        details_lines.append(f"Mother Name: {docs.get('Mother Name', '')}")
+        details_lines.append(f"Place of Birth: {docs.get('Place of Birth', '')}")
+        nominee_list = docs.get('Nominees', [])
+        details_lines.append(f"Number of Nominees: {len(nominee_list)}")
+        for idx_n, nominee in enumerate(nominee_list):
+            details_lines.append(f"  Nominee {idx_n+1}:")
+            for nkey, nval in nominee.items():
+                if hasattr(nval, 'name'):
+                    details_lines.append(f"    {nkey}: Uploaded")
+                else:
+                    details_lines.append(f"    {nkey}: {nval}")
+    return '\n'.join(details_lines)
+
+
+def member_files(blobs, idx, member):
+    # (name inside the member folder, BlobRef) for every uploaded document
+    files = []
+    docs = member.get('docs', {})
+    # Minor files
+    if member.get('age', 0) < 18:
+        bc_ref = blobs.get(f"member_{idx}_birthcert")
+        if bc_ref:
+            files.append((bc_ref.name, bc_ref))
+        pan_ref = blobs.get(f"member_{idx}_minorpancard")
+        if pan_ref:
+            files.append((pan_ref.name, pan_ref))
+        for idx_g, guardian in enumerate(docs.get('Guardians', [])):
+            gpan_ref = blobs.get(f"member_{idx}_guardian_{idx_g}_pan")
+            if gpan_ref:
+                files.append((f"guardian_{idx_g+1}_{gpan_ref.name}", gpan_ref))
+            gaadhaar_ref = blobs.get(f"member_{idx}_guardian_{idx_g}_aadhaar")
+            if gaadhaar_ref:
+                files.append((f"guardian_{idx_g+1}_{gaadhaar_ref.name}", gaadhaar_ref))
+            gbank_ref = blobs.get(f"member_{idx}_guardian_{idx_g}_bank")
+            if gbank_ref:
+                files.append((f"guardian_{idx_g+1}_{gbank_ref.name}", gbank_ref))
+        photo_ref = blobs.get(f"member_{idx}_passport_photo")
+        if photo_ref:
+            files.append((photo_ref.name, photo_ref))
+    # Adult files
+    else:
+        aadhaar_ref = blobs.get(f"member_{idx}_aadhaar")
+        if aadhaar_ref:
+            files.append((aadhaar_ref.name, aadhaar_ref))
+        pan_ref = blobs.get(f"member_{idx}_pan")
+        if pan_ref:
+            files.append((pan_ref.name, pan_ref))
+        cheque_ref = blobs.get(f"member_{idx}_cheque")
+        if cheque_ref:
+            files.append((cheque_ref.name, cheque_ref))
+        photo_ref = blobs.get(f"member_{idx}_passport_photo")
+        if photo_ref:
+            files.append((photo_ref.name, photo_ref))
+        for idx_n, nominee in enumerate(docs.get('Nominees', [])):
+            npan_ref = blobs.get(f"member_{idx}_nominee_{idx_n}_pan")
+            if npan_ref:
+                files.append((f"nominee_{idx_n+1}_{npan_ref.name}", npan_ref))
+    return files
+
+
+def admin_email_body(family_name, timestamp, member_names, documents_line):
+    return (
+        f"New onboarding submission from {family_name}.\n"
+        f"Submission time: {timestamp}\n"
+        f"Family members: {', '.join(member_names)}\n"
+        f"{documents_line}\n"
+    )
+
+
+def submission_spec(family_name, members, files, timestamp, admin_address=EMAIL_ADDRESS):
+    # The plain-dict job SubmissionWorker runs. files[i] is member i's
+    # [(filename, contents)], contents being a BlobRef, bytes or a file path.
+    family_head_folder = safe_name(family_name)
+    # Snapshot of (path in zip, contents); the worker zips it.
+    entries = []
+    for member, member_docs in zip(members, files):
+        member_folder = f"{family_head_folder}/{safe_name(member['name'])}"
+        entries.append((f"{member_folder}/details.txt", member_details_text(member)))
+        for filename, data in member_docs:
+            entries.append((f"{member_folder}/{filename}", data))
+
+    zip_name = f"{family_head_folder}_onboarding.zip"
+    folder_path = family_folder_path(family_name)
+
+    applicant_email = None
+    for m in members:
+        if m.get('age', 0) >= 18:
+            applicant_email = m.get('docs', {}).get('Email', None)
+            break
+    # The admin email goes out alongside the upload, so it names the
+    # OneDrive location rather than waiting for the item's webUrl.
+    admin_body = admin_email_body(
+        family_name, timestamp, [m['name'] for m in members],
+        f"Documents are attached and saved to OneDrive: {'/'.join(folder_path)}/{zip_name}",
+    )
+    applicant_body = (
+        f"Dear {family_name},\n\n"
+        "Your onboarding submission is received. We will review and get back to you shortly.\n\n"
+        "Best regards,\nSSS Distributors Onboarding Team"
+    )
+    emails = [{"key": "admin_email", "to": admin_address, "subject": EMAIL_SUBJECT, "body": admin_body}]
+    if applicant_email:
+        emails.append({"key": "applicant_email", "to": applicant_email, "subject": EMAIL_SUBJECT, "body": applicant_body})
+    return {
+        "family_name": family_name,
+        "timestamp": timestamp,
+        "zip_name": zip_name,
+        "folder_path": folder_path,
+        "entries": entries,
+        "emails": emails,
+        # Who is in the submission, for the journal's search index.
+        "members": [
+            {
+                "name": m["name"], "age": m.get("age"),
+                "email": m.get("docs", {}).get("Email", ""), "phone": m.get("docs", {}).get("Phone", ""),
+            }
+            for m in members
+        ],
+    }
+
+
+def write_archive(zipf, entries, read_blob=None, image_settings=None):
+    # entries: [(arcname, contents)], contents being text, bytes, a file path
+    # or a BlobRef (read through read_blob). The same document (e.g. one
+    # guardian's PAN for two minors) is read and normalized once, however
+    # many member folders it appears in.
+    def prepare(data, arcname):
+        if image_settings:
+            return images.normalize_image(data, arcname, image_settings)
+        return data
+
+    counts = Counter(data.digest for _, data in entries if hasattr(data, "digest"))
+    repeated = {digest for digest, count in counts.items() if count > 1}
+    prepared = {}
+    with ArchiveWriter(zipf) as writer:
+        for arcname, data in entries:
+            if hasattr(data, "digest"):
+                digest = data.digest
+                data = prepared.get(digest)
+                if data is None:
+                    data = prepare(read_blob(digest), arcname)
+                    if digest in repeated:
+                        prepared[digest] = data
+            elif isinstance(data, os.PathLike):
+                with open(data, "rb") as f:
+                    data = prepare(f.read(), arcname)
+            elif isinstance(data, bytes):
+                data = prepare(data, arcname)
+            with tracing.span("archive.add", file=arcname, bytes=len(data)):
+                writer.add(arcname, data)
+
+
+def build_archive(entries, read_blob=None, image_settings=None):
+    archive = SpooledArchive()
+    with archive.open_zip() as zipf:
+        write_archive(zipf, entries, read_blob, image_settings)
+    return archive
+
+
+def build_archive_file(path, entries, image_settings=None):
+    # For process pools: entries should be text and file paths so nothing
+    # large is pickled, and the zip lands on disk for SpooledArchive(path=).
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f, zipfile.ZipFile(f, "w") as zipf:
+        write_archive(zipf, entries, image_settings=image_settings)
+    os.replace(tmp_path, path)
+    return os.path.getsize(path)
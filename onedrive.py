@@ -0,0 +1,316 @@
+import io
+import os
+import threading
+import time
+from datetime import timezone
+from urllib.parse import quote
+
+import tracing
+from graph_batch import GraphBatch
+from graph_client import GraphError
+
+# Graph's simple PUT upload is documented up to 4 MB; anything larger goes
+# through an upload session. Session chunks must be multiples of 320 KiB.
+SIMPLE_UPLOAD_LIMIT = 4 * 1024 * 1024
+UPLOAD_CHUNK_SIZE = 16 * 320 * 1024
+MAX_UPLOAD_RESUMES = 5
+
+
+def _file_size(fileobj):
+    pos = fileobj.tell()
+    fileobj.seek(0, os.SEEK_END)
+    size = fileobj.tell()
+    fileobj.seek(pos)
+    return size
+
+
+class FolderCache:
+    # Process-wide map of "Client Data/<family>" style paths to drive item
+    # IDs, so repeat submissions for a family skip folder resolution.
+    def __init__(self, ttl=3600):
+        self.ttl = ttl
+        self._items = {}
+        self._lock = threading.Lock()
+
+    def get(self, path):
+        with self._lock:
+            entry = self._items.get(path)
+            if not entry:
+                return None
+            item_id, expires_at = entry
+            if time.time() >= expires_at:
+                del self._items[path]
+                return None
+            return item_id
+
+    def put(self, path, item_id):
+        with self._lock:
+            self._items[path] = (item_id, time.time() + self.ttl)
+
+    def invalidate(self, path):
+        with self._lock:
+            for key in list(self._items):
+                if key == path or key.startswith(path + "/"):
+                    del self._items[key]
+
+
+def item_path_url(user, parent_id, segments):
+    relative = "/".join(quote(segment) for segment in segments)
+    if parent_id:
+        return f"users/{user}/drive/items/{parent_id}:/{relative}"
+    return f"users/{user}/drive/root:/{relative}"
+
+
+def _children_url(user, parent_id, segments=None):
+    if segments:
+        return f"{item_path_url(user, parent_id, segments)}:/children"
+    if parent_id:
+        return f"users/{user}/drive/items/{parent_id}/children"
+    return f"users/{user}/drive/root/children"
+
+
+def get_item_by_path(client, user, parent_id, segments):
+    resp = client.get(item_path_url(user, parent_id, segments), params={"$select": "id,name,folder"})
+    if resp.status_code == 404:
+        return None
+    if resp.status_code != 200:
+        raise GraphError(f"Failed to look up OneDrive folder: {resp.status_code} {resp.text}", resp.status_code, resp.text)
+    return resp.json()
+
+
+def _create_folder(client, user, parent_id, folder):
+    resp = client.post(
+        _children_url(user, parent_id),
+        json={"name": folder, "folder": {}, "@microsoft.graph.conflictBehavior": "fail"}
+    )
+    if resp.status_code in [200, 201]:
+        return resp.json()['id']
+    if resp.status_code == 409:
+        # Created concurrently by another submission; use that one.
+        item = get_item_by_path(client, user, parent_id, [folder])
+        if item:
+            return item['id']
+    raise GraphError(
+        f"Failed to create folder {folder} in OneDrive: {resp.status_code} {resp.text}", resp.status_code, resp.text
+    )
+
+
+def create_onedrive_folder_if_not_exists(client, user, folder_path_list, folder_cache=None):
+    segments = list(folder_path_list)
+    if not segments:
+        return None
+    full_path = "/".join(segments)
+    if folder_cache:
+        cached = folder_cache.get(full_path)
+        if cached:
+            return cached
+    with tracing.span("onedrive.folder", path=full_path):
+        return _ensure_folder(client, user, segments, folder_cache)
+
+
+def _ensure_folder(client, user, segments, folder_cache):
+    full_path = "/".join(segments)
+
+    # Start from the deepest ancestor we already know, then resolve the rest
+    # of the path with a single lookup.
+    base_depth, base_id = 0, None
+    if folder_cache:
+        for depth in range(len(segments) - 1, 0, -1):
+            cached = folder_cache.get("/".join(segments[:depth]))
+            if cached:
+                base_depth, base_id = depth, cached
+                break
+
+    try:
+        parent_id = _resolve_folders(client, user, segments, base_depth, base_id, folder_cache)
+    except GraphError as e:
+        if base_id and e.status_code == 404:
+            # A cached ancestor was deleted or moved; resolve from the root.
+            folder_cache.invalidate("/".join(segments[:base_depth]))
+            return _ensure_folder(client, user, segments, folder_cache)
+        raise
+    if folder_cache:
+        folder_cache.put(full_path, parent_id)
+    return parent_id
+
+
+def _resolve_folders(client, user, segments, base_depth, base_id, folder_cache):
+    # One batch looks up every level below the known ancestor; a second
+    # creates the missing levels as a dependsOn chain, addressing each new
+    # folder by path since its ID is not known until the batch runs.
+    remaining = segments[base_depth:]
+    lookups = GraphBatch(client)
+    for depth in range(1, len(remaining) + 1):
+        lookups.add("GET", item_path_url(user, base_id, remaining[:depth]) + "?$select=id,name,folder")
+    found = lookups.execute()
+    parent_id, existing = base_id, 0
+    for depth in range(1, len(remaining) + 1):
+        resp = found[str(depth)]
+        if resp.status_code == 404:
+            break
+        if resp.status_code != 200:
+            raise GraphError(f"Failed to look up OneDrive folder: {resp.status_code} {resp.text}", resp.status_code, resp.text)
+        parent_id, existing = resp.json()["id"], depth
+        if folder_cache:
+            folder_cache.put("/".join(segments[:base_depth + depth]), parent_id)
+    if existing == len(remaining):
+        return parent_id
+
+    creates = GraphBatch(client)
+    previous = None
+    for depth in range(existing, len(remaining)):
+        previous = creates.add(
+            "POST", _children_url(user, parent_id, remaining[existing:depth]),
+            json={"name": remaining[depth], "folder": {}, "@microsoft.graph.conflictBehavior": "fail"},
+            depends_on=[previous] if previous else None,
+        )
+    created = creates.execute()
+    for offset, depth in enumerate(range(existing, len(remaining)), start=1):
+        resp = created[str(offset)]
+        if resp.status_code in [200, 201]:
+            parent_id = resp.json()["id"]
+        elif resp.status_code in [409, 424]:
+            # Another submission created part of the chain concurrently; walk
+            # the rest one level at a time, reusing what it made.
+            for remaining_depth in range(depth, len(remaining)):
+                parent_id = _create_folder(client, user, parent_id, remaining[remaining_depth])
+                if folder_cache:
+                    folder_cache.put("/".join(segments[:base_depth + remaining_depth + 1]), parent_id)
+            return parent_id
+        else:
+            raise GraphError(
+                f"Failed to create folder {remaining[depth]} in OneDrive: {resp.status_code} {resp.text}",
+                resp.status_code, resp.text
+            )
+        if folder_cache:
+            folder_cache.put("/".join(segments[:base_depth + depth + 1]), parent_id)
+    return parent_id
+
+
+def upload_small_file(client, user, parent_id, filename, data):
+    resp = client.put(
+        f"users/{user}/drive/items/{parent_id}:/{quote(filename)}:/content",
+        headers={"Content-Type": "application/octet-stream"},
+        data=data,
+    )
+    if resp.status_code not in [200, 201]:
+        raise GraphError(f"Failed to upload file to OneDrive: {resp.status_code} {resp.text}", resp.status_code, resp.text)
+    return resp.json()
+
+
+def create_upload_session(client, user, parent_id, filename):
+    resp = client.post(
+        f"users/{user}/drive/items/{parent_id}:/{quote(filename)}:/createUploadSession",
+        json={"item": {"@microsoft.graph.conflictBehavior": "replace"}},
+    )
+    if resp.status_code != 200:
+        raise GraphError(f"Failed to create upload session: {resp.status_code} {resp.text}", resp.status_code, resp.text)
+    return resp.json()["uploadUrl"]
+
+
+def _next_expected_offset(client, upload_url):
+    # Asks the session which bytes it still needs, so a dropped connection
+    # resumes from the last acknowledged range instead of from zero.
+    resp = client.get(upload_url, auth=False)
+    if resp.status_code == 404:
+        return None
+    if resp.status_code != 200:
+        raise GraphError(f"Failed to query upload session: {resp.status_code} {resp.text}", resp.status_code, resp.text)
+    ranges = resp.json().get("nextExpectedRanges") or ["0-"]
+    return int(ranges[0].split("-")[0])
+
+
+def upload_large_file(client, user, parent_id, filename, fileobj, size,
+                      chunk_size=UPLOAD_CHUNK_SIZE, progress=None):
+    upload_url = create_upload_session(client, user, parent_id, filename)
+    offset = 0
+    resumes = 0
+    while True:
+        fileobj.seek(offset)
+        chunk = fileobj.read(chunk_size)
+        end = offset + len(chunk) - 1
+        try:
+            resp = client.put(
+                upload_url,
+                auth=False,
+                headers={"Content-Length": str(len(chunk)), "Content-Range": f"bytes {offset}-{end}/{size}"},
+                data=chunk,
+            )
+        except GraphError:
+            resp = None
+        if resp is not None and resp.status_code in [200, 201]:
+            if progress:
+                progress(size, size)
+            return resp.json()
+        if resp is not None and resp.status_code == 202:
+            ranges = resp.json().get("nextExpectedRanges") or [f"{end + 1}-"]
+            offset = int(ranges[0].split("-")[0])
+            if progress:
+                progress(offset, size)
+            continue
+        resumes += 1
+        if resumes > MAX_UPLOAD_RESUMES:
+            detail = f"{resp.status_code} {resp.text}" if resp is not None else "connection lost"
+            raise GraphError(f"Failed to upload file to OneDrive: {detail}",
+                             resp.status_code if resp is not None else None)
+        offset = _next_expected_offset(client, upload_url)
+        if offset is None:
+            # The session expired; start a fresh one from the beginning.
+            upload_url = create_upload_session(client, user, parent_id, filename)
+            offset = 0
+
+
+def upload_to_onedrive(client, user, file, folder_path_list, filename, progress=None, folder_cache=None, owner=None):
+    fileobj = io.BytesIO(file) if isinstance(file, (bytes, bytearray)) else file
+    size = _file_size(fileobj)
+    with tracing.span("onedrive.upload", file=filename, bytes=size,
+                      method="simple" if size <= SIMPLE_UPLOAD_LIMIT else "session"):
+        return _upload(client, user, fileobj, size, folder_path_list, filename, progress, folder_cache, owner)
+
+
+def _upload(client, user, fileobj, size, folder_path_list, filename, progress, folder_cache, owner):
+    for attempt in range(2):
+        parent_id = create_onedrive_folder_if_not_exists(client, user, folder_path_list, folder_cache)
+        if not parent_id:
+            raise GraphError("Could not create/find OneDrive folders.")
+        try:
+            if size <= SIMPLE_UPLOAD_LIMIT:
+                fileobj.seek(0)
+                item = upload_small_file(client, user, parent_id, filename, fileobj.read())
+                if progress:
+                    progress(size, size)
+                return item
+            # Session uploads wait for one of the process-wide upload slots;
+            # owner lets the UI show the submission's place in line.
+            with client.upload_slot(owner):
+                return upload_large_file(client, user, parent_id, filename, fileobj, size, progress=progress)
+        except GraphError as e:
+            if attempt or not folder_cache or e.status_code != 404:
+                raise
+            # The cached folder no longer exists; forget it and resolve again.
+            folder_cache.invalidate("/".join(folder_path_list))
+
+
+def create_sharing_link(client, user, item_id, link_type="view", scope="organization", expires_at=None):
+    # An anonymous link to identity documents should always get expires_at
+    # (an aware datetime); the tenant may cap it to a shorter lifetime.
+    body = {"type": link_type, "scope": scope}
+    if expires_at:
+        body["expirationDateTime"] = expires_at.astimezone(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+    resp = client.post(f"users/{user}/drive/items/{item_id}/createLink", json=body)
+    if resp.status_code not in [200, 201]:
+        raise GraphError(f"Failed to create sharing link: {resp.status_code} {resp.text}", resp.status_code, resp.text)
+    return resp.json()["link"]["webUrl"]
+
+
+def rename_item(client, user, item_id, new_name):
+    resp = client.patch(f"users/{user}/drive/items/{item_id}", json={"name": new_name})
+    if resp.status_code != 200:
+        raise GraphError(f"Failed to rename OneDrive item: {resp.status_code} {resp.text}", resp.status_code, resp.text)
+    return resp.json()
+
+
+def delete_item(client, user, item_id):
+    resp = client.delete(f"users/{user}/drive/items/{item_id}")
+    if resp.status_code not in [204, 404]:
+        raise GraphError(f"Failed to delete OneDrive item: {resp.status_code} {resp.text}", resp.status_code, resp.text)
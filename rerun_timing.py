@@ -0,0 +1,37 @@
+import time
+from collections import deque
+from contextlib import contextmanager
+
+import tracing
+
+
+class RerunTimings:
+    # Lives in st.session_state. Wall time of each rendered section over the
+    # session's recent reruns, so the cost of an interaction can be read off
+    # per fragment rather than only for the whole script.
+    def __init__(self, max_samples=50):
+        self.max_samples = max_samples
+        self._samples = {}
+
+    @contextmanager
+    def measure(self, section):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(section, time.perf_counter() - start)
+
+    def record(self, section, seconds):
+        tracing.METRICS.observe("onboarding_rerun_seconds", seconds, section=section)
+        self._samples.setdefault(section, deque(maxlen=self.max_samples)).append(seconds)
+
+    def summary(self):
+        return {
+            section: {
+                "runs": len(samples),
+                "last_ms": samples[-1] * 1000,
+                "mean_ms": sum(samples) / len(samples) * 1000,
+            }
+            for section, samples in self._samples.items()
+            if samples
+        }
@@ -0,0 +1,158 @@
+import json
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor, wait
+
+import images
+import onedrive
+from graph_auth import GraphAuthError
+from graph_batch import GraphBatch
+from graph_client import GraphError
+
+TASK_RUNNING = "running"
+TASK_DONE = "done"
+TASK_FAILED = "failed"
+
+STAGING_PREFIX = "_staging_"
+
+
+def staging_folder_name():
+    return f"{STAGING_PREFIX}{uuid.uuid4().hex[:12]}"
+
+
+class StagingTask:
+    def __init__(self, folder_path, files):
+        self.id = uuid.uuid4().hex[:12]
+        self.folder_path = list(folder_path)
+        self.files = files
+        self.status = TASK_RUNNING
+        self.error = None
+        # {"name", "sha256", "size"} of each file as uploaded, which differs
+        # from the original when images are normalized.
+        self.uploaded = []
+        self.future = None
+
+
+class MemberStager:
+    # Uploads a member's documents to "<family>/_staging_<id>/<member>" as soon
+    # as the member is locked, so the final submit only has to add the small
+    # details/manifest files and rename the staging folder into place.
+    def __init__(self, client, sender, blob_store, folder_cache=None, max_workers=2, image_settings=None):
+        self.client = client
+        self.sender = sender
+        self.blob_store = blob_store
+        self.folder_cache = folder_cache
+        # The same settings the archive uses, so the OneDrive copy and the
+        # zip hold the same (possibly downsampled) images.
+        self.image_settings = image_settings
+        self._tasks = {}
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="staging")
+
+    def stage(self, folder_path, files):
+        # files: [(filename, BlobRef)]; the task keeps the blobs alive until
+        # they are uploaded, even if the session goes away.
+        for _, ref in files:
+            self.blob_store.acquire(ref.digest)
+        task = StagingTask(folder_path, files)
+        with self._lock:
+            self._tasks[task.id] = task
+        task.future = self._pool.submit(self._run, task)
+        return task.id
+
+    def get(self, task_id):
+        with self._lock:
+            return self._tasks.get(task_id)
+
+    def _run(self, task):
+        try:
+            for filename, ref in task.files:
+                data = original = self.blob_store.get(ref.digest)
+                if self.image_settings:
+                    data = images.normalize_image(original, filename, self.image_settings)
+                onedrive.upload_to_onedrive(
+                    self.client, self.sender, data, task.folder_path, filename, folder_cache=self.folder_cache
+                )
+                task.uploaded.append({
+                    "name": filename,
+                    "sha256": ref.digest if data is original else images.content_hash(data),
+                    "size": len(data),
+                })
+        except (GraphError, GraphAuthError, OSError, KeyError) as e:
+            task.error = str(e) or e.__class__.__name__
+            task.status = TASK_FAILED
+        else:
+            task.status = TASK_DONE
+        finally:
+            for _, ref in task.files:
+                self.blob_store.release(ref.digest)
+
+    def wait(self, task_ids, timeout=None):
+        tasks = [self.get(task_id) for task_id in task_ids]
+        if any(task is None for task in tasks):
+            return False
+        wait([task.future for task in tasks], timeout=timeout)
+        return all(task.status == TASK_DONE for task in tasks)
+
+    def forget(self, task_ids):
+        with self._lock:
+            for task_id in task_ids:
+                self._tasks.pop(task_id, None)
+
+    def promote(self, staging_path, final_name, details, manifest, task_ids=()):
+        # details: [(relative path under the staging folder, text)]. The small
+        # files and the rename go out as one $batch, the rename depending on
+        # the uploads; anything the batch could not place is redone one by one.
+        # task_ids are the members' staging tasks, in manifest order; their
+        # uploaded files fill in each member's "files".
+        tasks = [self.get(task_id) for task_id in task_ids]
+        if tasks and all(tasks):
+            manifest = dict(manifest, members=[
+                dict(member, files=task.uploaded) for member, task in zip(manifest["members"], tasks)
+            ])
+        files = [(relative_path.split("/"), text.encode("utf-8")) for relative_path, text in details]
+        files.append((["manifest.json"], json.dumps(manifest, indent=2).encode("utf-8")))
+        batch = GraphBatch(self.client)
+        uploads = [
+            batch.add(
+                "PUT", onedrive.item_path_url(self.sender, None, staging_path + segments) + ":/content",
+                data=data, headers={"Content-Type": "text/plain"}
+            )
+            for segments, data in files
+        ]
+        rename = batch.add(
+            "PATCH", onedrive.item_path_url(self.sender, None, staging_path),
+            json={"name": final_name}, depends_on=uploads
+        )
+        results = batch.execute()
+        for request_id, (segments, data) in zip(uploads, files):
+            if not results[request_id].ok:
+                # e.g. a member with no documents has no staged folder yet.
+                *subfolders, filename = segments
+                onedrive.upload_to_onedrive(
+                    self.client, self.sender, data, staging_path + subfolders, filename,
+                    folder_cache=self.folder_cache
+                )
+        if results[rename].ok:
+            item = results[rename].json()
+        else:
+            folder_id = onedrive.create_onedrive_folder_if_not_exists(
+                self.client, self.sender, staging_path, self.folder_cache
+            )
+            item = onedrive.rename_item(self.client, self.sender, folder_id, final_name)
+        if self.folder_cache:
+            self.folder_cache.invalidate("/".join(staging_path))
+        return item
+
+    def discard(self, staging_path):
+        # Best effort: an abandoned staging folder is only clutter.
+        def run():
+            try:
+                item = onedrive.get_item_by_path(self.client, self.sender, None, staging_path)
+                if item:
+                    onedrive.delete_item(self.client, self.sender, item["id"])
+            except (GraphError, GraphAuthError):
+                pass
+            if self.folder_cache:
+                self.folder_cache.invalidate("/".join(staging_path))
+        self._pool.submit(run)
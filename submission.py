@@ -0,0 +1,501 @@
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor, wait
+from datetime import datetime, timedelta, timezone
+from functools import partial
+
+import journal
+import mail
+import onboarding
+import onedrive
+import tracing
+from archive import SpooledArchive
+from blobstore import BlobRef
+from graph_auth import GraphAuthError
+from graph_client import GraphError
+from memory_stats import PeakRSSMonitor
+
+STATUS_QUEUED = "queued"
+STATUS_ZIPPING = "zipping"
+STATUS_UPLOADING = "uploading"
+STATUS_EMAILING = "emailing"
+STATUS_DONE = "done"
+STATUS_FAILED = "failed"
+
+STEP_PENDING = "pending"
+STEP_RUNNING = "running"
+STEP_DONE = "done"
+STEP_FAILED = "failed"
+
+JOB_TTL = 3600
+STAGING_WAIT_SECONDS = 300
+
+
+class QueueFullError(Exception):
+    pass
+
+
+class SubmissionJob:
+    # spec is a plain dict snapshot (see onboarding.submission_spec):
+    #   family_name, zip_name, folder_path,
+    #   entries [(arcname, BlobRef|bytes|str|file path)],
+    #   emails [{"key", "to", "subject", "body"}],
+    #   optionally members [{"name", "age", "email", "phone"}] for the
+    #   search index, archive_path (a prebuilt zip) and staging
+    def __init__(self, spec):
+        self.id = uuid.uuid4().hex[:12]
+        self.spec = spec
+        self.status = STATUS_QUEUED
+        self.steps = {"archive": STEP_PENDING, "upload": STEP_PENDING}
+        for email in spec["emails"]:
+            self.steps[email["key"]] = STEP_PENDING
+        self.errors = {}
+        self.upload_progress = (0, 0)
+        self.archive = None
+        self.archive_size = 0
+        self.upload_item = None
+        self.web_url = None
+        self.share_link = None
+        # OneDrive folder the pre-uploaded documents were promoted to, when
+        # the upload went through staging rather than the zip.
+        self.staged_location = None
+        self.peak_rss = 0
+        self.peak_delta = 0
+        self.key = None
+        self.duplicate = False
+        self.span = None
+        self.created_at = time.time()
+        self.finished_at = None
+        self.lock = threading.Lock()
+
+    def set_step(self, step, state, error=None):
+        with self.lock:
+            self.steps[step] = state
+            if error:
+                self.errors[step] = error
+            elif state == STEP_DONE:
+                self.errors.pop(step, None)
+            running = [name for name, value in self.steps.items() if value == STEP_RUNNING]
+            if "archive" in running:
+                self.status = STATUS_ZIPPING
+            elif "upload" in running:
+                self.status = STATUS_UPLOADING
+            elif running:
+                self.status = STATUS_EMAILING
+
+    def pending_steps(self):
+        with self.lock:
+            return [name for name, value in self.steps.items() if value != STEP_DONE]
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                "id": self.id,
+                "status": self.status,
+                "steps": dict(self.steps),
+                "errors": dict(self.errors),
+                "upload_progress": self.upload_progress,
+                "archive_size": self.archive_size,
+                "web_url": self.web_url,
+                "share_link": self.share_link,
+                "peak_rss": self.peak_rss,
+                "peak_delta": self.peak_delta,
+                "duplicate": self.duplicate,
+            }
+
+
+class SubmissionWorker:
+    # Process-wide pool that runs submissions off the Streamlit script thread.
+    # A job survives browser refreshes, and a retry reruns only failed steps.
+    def __init__(self, client, sender, max_workers=4, max_pending=50, folder_cache=None,
+                 image_settings=None, blob_store=None, stager=None, journal=None, share_link_days=7):
+        self.client = client
+        self.sender = sender
+        self.folder_cache = folder_cache
+        self.image_settings = image_settings
+        self.blob_store = blob_store
+        self.stager = stager
+        self.journal = journal
+        self.share_link_days = share_link_days
+        self.max_pending = max_pending
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="submission")
+        # Upload and emails of one job run side by side on a separate pool so
+        # a saturated job pool can never deadlock waiting on its own steps.
+        self._step_pool = ThreadPoolExecutor(max_workers=max_workers * 3, thread_name_prefix="submission-step")
+
+    def _active_count(self):
+        return sum(1 for job in self._jobs.values() if job.status not in (STATUS_DONE, STATUS_FAILED))
+
+    def _prune(self):
+        cutoff = time.time() - JOB_TTL
+        for job_id, job in list(self._jobs.items()):
+            if job.finished_at and job.finished_at < cutoff:
+                if job.archive:
+                    job.archive.close()
+                self._release_blobs(job)
+                del self._jobs[job_id]
+
+    def _blob_refs(self, job):
+        return [data for _, data in job.spec["entries"] if isinstance(data, BlobRef)]
+
+    def _release_blobs(self, job):
+        for ref in self._blob_refs(job):
+            self.blob_store.release(ref.digest)
+        job.spec["entries"] = []
+
+    def submit(self, spec, entries_hash=None):
+        # entries_hash: journal.content_hash(spec["entries"]) if the caller
+        # already has it, so large documents are not read again here.
+        if entries_hash is None:
+            entries_hash = journal.content_hash(spec["entries"])
+        job = SubmissionJob(spec)
+        job.key = journal.submission_key(spec["family_name"], entries_hash)
+        with self._lock:
+            self._prune()
+            existing = next((other for other in self._jobs.values() if other.key == job.key), None)
+            if not existing:
+                if self._active_count() >= self.max_pending:
+                    raise QueueFullError("Too many submissions in progress, please try again shortly.")
+                self._jobs[job.id] = job
+        if existing:
+            # A double click, rerun or resubmit of identical content joins the
+            # job already in progress (or retries it if it failed).
+            self._drop_staging(spec)
+            if existing.status == STATUS_FAILED:
+                self.retry(existing.id)
+            return existing.id
+
+        if self.journal:
+            record = self.journal.begin(job.key, spec["family_name"], entries_hash)
+            self._restore(job, record["steps"])
+            if job.steps["upload"] == STEP_DONE:
+                self._drop_staging(spec)
+            if record["completed_at"] or not job.pending_steps():
+                job.duplicate = True
+                self._drop_staging(spec)
+                job.spec["entries"] = []
+                self._finish(job)
+                return job.id
+
+        # The job holds its own references so the documents outlive the
+        # session that submitted them until the archive is written.
+        for ref in self._blob_refs(job):
+            self.blob_store.acquire(ref.digest)
+        self._pool.submit(self._run, job)
+        return job.id
+
+    def _drop_staging(self, spec):
+        staged = spec.get("staging")
+        if staged and self.stager:
+            self.stager.forget(staged["tasks"])
+            self.stager.discard(staged["path"])
+            spec["staging"] = None
+
+    def _restore(self, job, steps):
+        # Steps finished by an earlier attempt at the same content are marked
+        # done so they are not repeated. The archive lives in memory only, so
+        # it is rebuilt whenever anything that needs it is still pending.
+        for step in job.steps:
+            if step != "archive" and step in steps:
+                job.steps[step] = STEP_DONE
+        upload = steps.get("upload")
+        if upload:
+            job.web_url = upload.get("web_url")
+            job.share_link = upload.get("share_link")
+            job.staged_location = upload.get("staged_location")
+            job.upload_item = {"id": upload.get("item_id"), "webUrl": job.web_url}
+        folder = steps.get("folder")
+        if folder and self.folder_cache:
+            self.folder_cache.put("/".join(job.spec["folder_path"]), folder["id"])
+        if all(state == STEP_DONE for step, state in job.steps.items() if step != "archive"):
+            job.steps["archive"] = STEP_DONE
+
+    def _journal_step(self, job, step, result=None):
+        if self.journal and job.key:
+            self.journal.record_step(job.key, step, result)
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def queue_position(self, job_id):
+        # Place in line ("you are #3"): for one of the admission controller's
+        # upload slots, or behind earlier jobs still waiting for a worker
+        # thread. 0 once the job is under way.
+        job = self.get(job_id)
+        admission = self.client.admission
+        if not job:
+            return 0
+        position = admission.position(job.id) if admission else 0
+        if position or job.status != STATUS_QUEUED:
+            return position
+        with self._lock:
+            ahead = sum(
+                1 for other in self._jobs.values()
+                if other.status == STATUS_QUEUED and other.created_at < job.created_at
+            )
+        return ahead + 1 + (admission.stats()["waiting_uploads"] if admission else 0)
+
+    def retry(self, job_id):
+        job = self.get(job_id)
+        if not job:
+            return False
+        # Checked and set together, so two sessions retrying the same job
+        # cannot both start it.
+        with job.lock:
+            if job.status != STATUS_FAILED:
+                return False
+            job.status = STATUS_QUEUED
+            job.finished_at = None
+        self._pool.submit(self._run, job)
+        return True
+
+    def _run_step(self, job, step, func):
+        job.set_step(step, STEP_RUNNING)
+        try:
+            with tracing.span(f"submission.{step}", parent=job.span, job=job.id) as step_span:
+                func(job)
+                if step == "archive":
+                    step_span.set(bytes=job.archive_size)
+                elif step == "upload" and not job.spec.get("staging"):
+                    step_span.set(bytes=job.archive_size)
+        except (GraphError, GraphAuthError, OSError) as e:
+            job.set_step(step, STEP_FAILED, str(e) or e.__class__.__name__)
+            return False
+        except Exception as e:
+            tracing.logger.exception("Submission %s: %s step failed", job.id, step)
+            job.set_step(step, STEP_FAILED, f"Unexpected error: {e!r}")
+            return False
+        job.set_step(step, STEP_DONE)
+        self._journal_step(job, step, self._step_result(job, step))
+        return True
+
+    def _step_result(self, job, step):
+        if step == "archive":
+            return {"size": job.archive_size}
+        if step == "upload":
+            return {
+                "item_id": (job.upload_item or {}).get("id"),
+                "web_url": job.web_url,
+                "share_link": job.share_link,
+                "staged_location": job.staged_location,
+            }
+        return None
+
+    def _build_archive(self, job):
+        if job.archive:
+            job.archive.close()
+        if job.spec.get("archive_path"):
+            # Built ahead of time, e.g. by the batch CLI's process pool.
+            job.archive = SpooledArchive(path=job.spec["archive_path"])
+        else:
+            job.archive = onboarding.build_archive(
+                job.spec["entries"], read_blob=self.blob_store.get if self.blob_store else None,
+                image_settings=self.image_settings,
+            )
+        job.archive_size = job.archive.size
+        tracing.current_span().set(entries=len(job.spec["entries"]))
+        # The archive now holds everything a retry needs.
+        self._release_blobs(job)
+
+    def _upload(self, job, archive_future=None):
+        # archive_future is set when the archive is built alongside a staged
+        # upload; only the fallback to uploading the zip waits for it.
+        def progress(sent, total):
+            job.upload_progress = (sent, total)
+
+        staged = job.spec.get("staging")
+        if staged and self.stager and self.stager.wait(staged["tasks"], timeout=STAGING_WAIT_SECONDS):
+            item = self.stager.promote(
+                staged["path"], staged["final_name"], staged["details"], staged["manifest"], staged["tasks"]
+            )
+            self.stager.forget(staged["tasks"])
+            job.staged_location = "/".join(job.spec["folder_path"] + [staged["final_name"]])
+        else:
+            if staged and self.stager:
+                # A member's pre-upload failed or stalled; fall back to the
+                # archive and drop the partial staging folder.
+                self.stager.forget(staged["tasks"])
+                self.stager.discard(staged["path"])
+                job.spec["staging"] = None
+            if archive_future and not archive_future.result():
+                raise GraphError("The archive could not be built, so there is nothing to upload.")
+            folder_id = onedrive.create_onedrive_folder_if_not_exists(
+                self.client, self.sender, job.spec["folder_path"], self.folder_cache
+            )
+            self._journal_step(job, "folder", {"id": folder_id})
+            item = onedrive.upload_to_onedrive(
+                self.client, self.sender, job.archive.reader(), job.spec["folder_path"], job.spec["zip_name"],
+                progress=progress, folder_cache=self.folder_cache, owner=job.id
+            )
+        job.upload_item = item
+        job.web_url = item.get("webUrl")
+        if job.archive_size > mail.LINK_ONLY_THRESHOLD and not job.staged_location:
+            self._create_share_link(job)
+
+    def _create_share_link(self, job):
+        # Only the applicant needs a link that works outside the tenant, and
+        # it expires; the admin copy goes to the drive's owner, who opens
+        # webUrl directly (see _send_emails).
+        expires_at = datetime.now(timezone.utc) + timedelta(days=self.share_link_days)
+        try:
+            job.share_link = onedrive.create_sharing_link(
+                self.client, self.sender, job.upload_item["id"], scope="anonymous", expires_at=expires_at
+            )
+        except GraphError:
+            job.share_link = job.web_url
+
+    def _staged_emails(self, job, emails):
+        # The documents are already in OneDrive as a folder, not a zip: the
+        # admin gets the folder's link instead of a second copy of every
+        # document. The applicant still gets the archive, as without staging.
+        documents_line = f"Documents are saved to OneDrive: {job.staged_location}"
+        if job.web_url:
+            documents_line += f"\nOpen the folder: {job.web_url}"
+        admin_body = onboarding.admin_email_body(
+            job.spec["family_name"], job.spec.get("timestamp", ""),
+            [member["name"] for member in job.spec.get("members", [])], documents_line,
+        )
+        return [
+            dict(email, body=admin_body, attachment=None) if email["key"] == "admin_email" else email
+            for email in emails
+        ]
+
+    def _send_emails(self, job, emails, upload_future=None, archive_future=None):
+        if upload_future:
+            upload_future.result()
+        if archive_future:
+            archive_future.result()
+        attachment = job.archive
+        if job.spec.get("staging") or job.staged_location:
+            if not job.staged_location:
+                # The emails name the folder, so they wait for a successful
+                # upload; a retry sends them.
+                for email in emails:
+                    job.set_step(email["key"], STEP_FAILED, "Waiting for the documents to reach OneDrive")
+                return
+            if attachment is None:
+                # The applicant's copy of the documents is the archive.
+                for email in emails:
+                    if email["key"] != "admin_email":
+                        job.set_step(email["key"], STEP_FAILED, "Waiting for the archive")
+                emails = [email for email in emails if email["key"] == "admin_email"]
+                if not emails:
+                    return
+            if job.archive_size > mail.LINK_ONLY_THRESHOLD and not job.share_link:
+                # Too big to attach: the applicant gets an expiring link to
+                # the promoted folder instead.
+                self._create_share_link(job)
+            emails = self._staged_emails(job, emails)
+        elif job.web_url:
+            emails = [dict(email, share_link=job.web_url) if email["key"] == "admin_email" else email for email in emails]
+        # Pending recipients go out together, in one $batch call when the
+        # messages are small enough, but each keeps its own step and error.
+        for email in emails:
+            job.set_step(email["key"], STEP_RUNNING)
+        with tracing.span("submission.emails", parent=job.span, job=job.id, count=len(emails)) as emails_span:
+            try:
+                results = mail.send_emails(
+                    self.client, self.sender, emails,
+                    attachment=attachment, attachment_name=job.spec["zip_name"], share_link=job.share_link
+                )
+            except Exception as e:
+                tracing.logger.exception("Submission %s: sending emails failed", job.id)
+                results = {email["key"]: e for email in emails}
+        for email in emails:
+            result = results.get(email["key"])
+            # Emails share one request, so each gets the batch's duration.
+            tracing.record(
+                f"submission.{email['key']}", emails_span.duration, parent=emails_span, job=job.id,
+                status="error" if isinstance(result, Exception) else "ok",
+                mode=None if isinstance(result, Exception) else result,
+            )
+            if isinstance(result, (GraphError, GraphAuthError, OSError)):
+                job.set_step(email["key"], STEP_FAILED, str(result) or result.__class__.__name__)
+            elif isinstance(result, Exception):
+                job.set_step(email["key"], STEP_FAILED, f"Unexpected error: {result!r}")
+            else:
+                job.set_step(email["key"], STEP_DONE)
+                self._journal_step(job, email["key"])
+
+    def _run(self, job):
+        # RSS is process-wide, so with several jobs in flight this is an
+        # upper bound for the submission rather than its exact footprint.
+        with PeakRSSMonitor() as rss_monitor, tracing.span("submission", job=job.id) as root:
+            job.span = root
+            self._run_steps(job)
+            steps = job.snapshot()["steps"]
+            root.set(steps=steps)
+            if any(state != STEP_DONE for state in steps.values()):
+                root.status = "error"
+        job.peak_rss = rss_monitor.peak_rss
+        job.peak_delta = rss_monitor.peak_delta
+        self._finish(job)
+
+    def _run_steps(self, job):
+        pending = job.pending_steps()
+        staged = bool(job.spec.get("staging") and self.stager)
+        archive_future = None
+        if "archive" in pending:
+            if staged:
+                # Promoting the pre-uploaded folder does not need the zip, so
+                # it is built alongside, for the download button and emails.
+                archive_future = self._step_pool.submit(self._run_step, job, "archive", self._build_archive)
+            elif not self._run_step(job, "archive", self._build_archive):
+                return
+
+        # Emails run alongside the upload unless they need its result: the
+        # sharing link when the archive is too big to attach, or the folder
+        # when the documents were pre-uploaded.
+        needs_link = job.archive_size > mail.LINK_ONLY_THRESHOLD or bool(job.spec.get("staging"))
+        # {future: steps it is responsible for}
+        futures = {}
+        upload_future = None
+        if "upload" in pending:
+            upload = partial(self._upload, archive_future=archive_future)
+            upload_future = self._step_pool.submit(self._run_step, job, "upload", upload)
+            futures[upload_future] = ["upload"]
+        emails = [email for email in job.spec["emails"] if email["key"] in pending]
+        if emails:
+            email_future = self._step_pool.submit(
+                self._send_emails, job, emails, upload_future if needs_link else None, archive_future
+            )
+            futures[email_future] = [email["key"] for email in emails]
+        if archive_future:
+            futures[archive_future] = ["archive"]
+        wait(futures)
+        for future, steps in futures.items():
+            # _run_step records its own errors; this catches anything raised
+            # outside it, e.g. in _send_emails before its steps were set.
+            error = future.exception()
+            if error is None:
+                continue
+            tracing.logger.error("Submission %s: %s raised", job.id, ", ".join(steps), exc_info=error)
+            for step in steps:
+                if job.snapshot()["steps"][step] != STEP_DONE:
+                    job.set_step(step, STEP_FAILED, f"Unexpected error: {error!r}")
+
+    def _finish(self, job):
+        with job.lock:
+            failed = any(value != STEP_DONE for value in job.steps.values())
+            job.status = STATUS_FAILED if failed else STATUS_DONE
+            job.finished_at = time.time()
+        if not failed and self.journal and job.key:
+            self.journal.complete(job.key)
+            if not job.duplicate:
+                self._index(job)
+
+    def _index(self, job):
+        # Indexing is bookkeeping: a failure here must not fail a submission
+        # that has already been uploaded and emailed.
+        try:
+            self.journal.index_submission(
+                job.key, job.spec.get("members", []), job.created_at, job.archive_size,
+                (job.upload_item or {}).get("id"), job.web_url,
+            )
+        except sqlite3.Error as e:
+            tracing.logger.warning("Could not index submission %s: %s", job.id, e)
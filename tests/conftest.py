@@ -0,0 +1,44 @@
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+
+from fake_graph import FakeGraph  # noqa: E402
+from graph_auth import GraphCredential  # noqa: E402
+from graph_client import GraphClient  # noqa: E402
+
+SENDER = "sender@example.com"
+
+
+@pytest.fixture(scope="session")
+def graph():
+    # Retry-After is short so throttling tests stay fast.
+    with FakeGraph(retry_after=0.2) as server:
+        yield server
+
+
+@pytest.fixture
+def fresh_graph(graph):
+    graph._faults.clear()
+    graph.reset_stats()
+    return graph
+
+
+@pytest.fixture(scope="session")
+def credential(graph):
+    return GraphCredential(
+        "test-client", "test-secret", "test-tenant",
+        authority_base_url=graph.authority_base_url, verify=graph.ca_path,
+    )
+
+
+@pytest.fixture
+def make_client(fresh_graph, credential):
+    def make(**kwargs):
+        kwargs.setdefault("backoff_base", 0.01)
+        return GraphClient(credential, base_url=fresh_graph.graph_base_url, verify=fresh_graph.ca_path, **kwargs)
+    return make
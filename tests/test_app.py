@@ -0,0 +1,45 @@
+import logging
+import os
+
+import pytest
+from streamlit.testing.v1 import AppTest
+
+from bench_sessions import Session
+from conftest import ROOT
+
+APP = os.path.join(ROOT, "app.py")
+
+
+@pytest.fixture
+def secrets(fresh_graph, tmp_path):
+    logging.getLogger("streamlit.runtime.scriptrunner_utils.script_run_context").disabled = True
+    return {
+        "ONEDRIVE_CLIENT_ID": "test-client",
+        "ONEDRIVE_CLIENT_SECRET": "test-secret",
+        "ONEDRIVE_TENANT_ID": "test-tenant",
+        "GRAPH_BASE_URL": fresh_graph.graph_base_url,
+        "GRAPH_AUTHORITY_URL": fresh_graph.authority_base_url,
+        "GRAPH_CA_BUNDLE": fresh_graph.ca_path,
+        "SUBMISSION_JOURNAL_PATH": str(tmp_path / "submissions.sqlite3"),
+        "TRACE_LOG_LEVEL": "WARNING",
+    }
+
+
+def test_job_url_alone_does_not_expose_documents(secrets):
+    family = Session(0, secrets, members=1, doc_size=10_000)
+    while family.step():
+        pass
+    assert not family.failed
+    job_id = family.at.query_params["job"]
+    assert family.at.get("download_button")
+
+    # Someone else opens the copied URL.
+    visitor = AppTest.from_file(APP, default_timeout=60)
+    for key, value in secrets.items():
+        visitor.secrets[key] = value
+    visitor.query_params["job"] = job_id
+    visitor.run()
+    assert not visitor.exception
+    assert not visitor.get("download_button")
+    assert any("is complete" in element.value for element in visitor.success)
+    assert not any("fake.sharepoint" in element.value for element in visitor.markdown)
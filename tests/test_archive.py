@@ -0,0 +1,52 @@
+import io
+import random
+import zipfile
+
+import pytest
+
+import archive
+
+
+def entries():
+    rng = random.Random(3)
+    scan = b"".join(bytes([255] * rng.randint(200, 400) + [0] * rng.randint(5, 20)) for _ in range(2000))
+    return [
+        ("Family/details.txt", "Name: Test\nAge: 40\n"),
+        ("Family/cheque.bmp", scan),
+        ("Family/aadhaar.pdf", rng.randbytes(400_000)),
+        ("Family/noise.tiff", rng.randbytes(300_000)),
+    ]
+
+
+def build(max_workers):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w") as zipf, archive.ArchiveWriter(zipf, max_workers=max_workers) as writer:
+        for arcname, data in entries():
+            writer.add(arcname, data)
+    return zipfile.ZipFile(buffer)
+
+
+@pytest.mark.parametrize("max_workers", [1, 4])
+@pytest.mark.parametrize("supported", [True, False])
+def test_archive_round_trips(monkeypatch, max_workers, supported):
+    monkeypatch.setattr(archive, "PRECOMPRESSED_SUPPORTED", supported)
+    zipf = build(max_workers)
+    assert zipf.testzip() is None
+    methods = {info.filename: info.compress_type for info in zipf.infolist()}
+    for arcname, data in entries():
+        expected = data.encode() if isinstance(data, str) else data
+        assert zipf.read(arcname) == expected
+    assert methods["Family/cheque.bmp"] == zipfile.ZIP_DEFLATED
+    assert methods["Family/aadhaar.pdf"] == zipfile.ZIP_STORED
+    if supported:
+        # Random bytes do not deflate, so the writer stores them instead.
+        assert methods["Family/noise.tiff"] == zipfile.ZIP_STORED
+
+
+def test_probe_rejects_a_broken_precompressed_path(monkeypatch):
+    class Broken(archive._Precompressed):
+        def flush(self):
+            return b""
+
+    monkeypatch.setattr(archive, "_Precompressed", Broken)
+    assert archive._precompressed_supported() is False
@@ -0,0 +1,59 @@
+import argparse
+import base64
+import io
+import json
+import random
+import zipfile
+
+import batch_onboard
+import onboarding
+from conftest import SENDER
+
+# Two families share a name and a third has the same safe_name.
+FAMILIES = [("Amit Shah", "first@example.com"), ("Amit Shah", "second@example.com"), ("Amit-Shah", "third@example.com")]
+
+
+def manifest(tmp_path):
+    families = []
+    for position, (name, email) in enumerate(FAMILIES):
+        doc = tmp_path / f"doc{position}.pdf"
+        doc.write_bytes(random.Random(position).randbytes(5000 * (position + 1)))
+        families.append({"name": name, "members": [{"name": name, "email": email, "files": [doc.name]}]})
+    path = tmp_path / "manifest.json"
+    path.write_text(json.dumps({"families": families}))
+    return batch_onboard.families_from_manifest(path)
+
+
+def arguments(tmp_path, dry_run):
+    return argparse.Namespace(
+        processes=2, uploads=2, journal=str(tmp_path / "journal.sqlite3"),
+        archive_dir=str(tmp_path / "archives"), dry_run=dry_run,
+    )
+
+
+def test_families_with_the_same_name_keep_their_own_archives(tmp_path):
+    rows = batch_onboard.run(manifest(tmp_path), {}, arguments(tmp_path, dry_run=True))
+    assert [row["family"] for row in rows] == [name for name, _ in FAMILIES]
+    assert [row["status"] for row in rows] == ["archived"] * 3
+    sizes = [row["archive_bytes"] for row in rows]
+    assert len(set(sizes)) == 3
+    assert len(list((tmp_path / "archives").rglob("*.zip"))) == 3
+
+
+def test_each_applicant_is_sent_their_own_documents(tmp_path, fresh_graph, monkeypatch):
+    monkeypatch.setattr(onboarding, "EMAIL_ADDRESS", SENDER)
+    config = {
+        "ONEDRIVE_CLIENT_ID": "batch-client", "ONEDRIVE_CLIENT_SECRET": "secret", "ONEDRIVE_TENANT_ID": "tenant",
+        "GRAPH_AUTHORITY_URL": fresh_graph.authority_base_url, "GRAPH_BASE_URL": fresh_graph.graph_base_url,
+        "GRAPH_CA_BUNDLE": fresh_graph.ca_path,
+    }
+    rows = batch_onboard.run(manifest(tmp_path), config, arguments(tmp_path, dry_run=False))
+    assert [row["status"] for row in rows] == ["done"] * 3
+
+    for position, (_, email) in enumerate(FAMILIES):
+        [sent] = [m["message"] for m in fresh_graph.mails
+                  if m["message"]["toRecipients"][0]["emailAddress"]["address"] == email]
+        [attachment] = sent["attachments"]
+        with zipfile.ZipFile(io.BytesIO(base64.b64decode(attachment["contentBytes"]))) as zipf:
+            [doc] = [name for name in zipf.namelist() if name.endswith(".pdf")]
+            assert zipf.read(doc) == random.Random(position).randbytes(5000 * (position + 1))
@@ -0,0 +1,20 @@
+import tracing
+from graph_auth import GraphCredential
+
+
+def token_count(source):
+    return tracing.METRICS._counters.get(("onboarding_graph_tokens_total", (("source", source),)), 0)
+
+
+def test_token_sources_are_exported_as_metrics(graph):
+    credential = GraphCredential(
+        "metrics-client", "test-secret", "test-tenant",
+        authority_base_url=graph.authority_base_url, verify=graph.ca_path,
+    )
+    network, cache = token_count("network"), token_count("cache")
+    for _ in range(3):
+        credential.get_token()
+    assert credential.stats() == {"token_cache_hits": 2, "token_network_fetches": 1}
+    assert token_count("network") == network + 1
+    assert token_count("cache") == cache + 2
+    assert "# HELP onboarding_graph_tokens_total" in tracing.METRICS.render()
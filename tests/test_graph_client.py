@@ -0,0 +1,151 @@
+import io
+import time
+
+import pytest
+
+import mail
+import onedrive
+import tracing
+from archive import SpooledArchive
+from conftest import SENDER
+from graph_admission import AdmissionController
+from graph_batch import GraphBatch
+from graph_client import GraphClient, GraphError
+
+DRIVE_ROOT = f"users/{SENDER}/drive/root"
+SEND_MAIL = f"users/{SENDER}/sendMail"
+
+
+def message(to="someone@example.com"):
+    return {"message": mail.build_message(SENDER, to, "Subject", "Body"), "saveToSentItems": "false"}
+
+
+def test_throttled_get_waits_for_retry_after(make_client, fresh_graph):
+    fresh_graph.inject("/drive/root$", 429, 429)
+    client = make_client()
+    start = time.monotonic()
+    resp = client.get(DRIVE_ROOT)
+    assert resp.status_code == 200
+    # Two Retry-After: 0.2 pauses, not the 10 ms exponential backoff.
+    assert time.monotonic() - start >= 0.4
+    assert fresh_graph.requests["fault"] == 2
+    assert fresh_graph.requests["item"] == 1
+
+
+def test_throttled_post_is_replayed(make_client, fresh_graph):
+    fresh_graph.inject("/sendMail$", 429)
+    resp = make_client().post(SEND_MAIL, json=message())
+    assert resp.status_code == 202
+    assert len(fresh_graph.mails) == 1
+
+
+def test_retry_after_pauses_admission_controller(make_client, fresh_graph):
+    # Under admission control a 429 pauses every caller in the process
+    # instead of sleeping only in the one that saw it.
+    pauses = tracing.METRICS._counters.get(("onboarding_graph_pauses_total", ()), 0)
+    fresh_graph.inject("/drive/root$", 429)
+    client = make_client(admission=AdmissionController(rate=100, burst=10))
+    start = time.monotonic()
+    assert client.get(DRIVE_ROOT).status_code == 200
+    assert time.monotonic() - start >= 0.2
+    assert tracing.METRICS._counters[("onboarding_graph_pauses_total", ())] == pauses + 1
+
+
+def test_server_error_retried_for_get(make_client, fresh_graph):
+    fresh_graph.inject("/drive/root$", 503, 502)
+    assert make_client().get(DRIVE_ROOT).status_code == 200
+    assert fresh_graph.requests["item"] == 1
+
+
+def test_server_error_not_retried_for_post(make_client, fresh_graph):
+    fresh_graph.inject("/sendMail$", 503)
+    resp = make_client().post(SEND_MAIL, json=message())
+    assert resp.status_code == 503
+    assert fresh_graph.requests["fault"] == 1
+    assert fresh_graph.mails == []
+
+
+def test_gives_up_after_max_retries(make_client, fresh_graph):
+    fresh_graph.inject("/drive/root$", 503, 503, 503)
+    resp = make_client(max_retries=2).get(DRIVE_ROOT)
+    assert resp.status_code == 503
+    assert fresh_graph.requests["fault"] == 3
+
+
+def test_dropped_response_on_post_is_not_resent(make_client, fresh_graph):
+    # Graph accepted the mail but the response never arrived.
+    fresh_graph.inject("/sendMail$", "drop")
+    with pytest.raises(GraphError):
+        make_client().post(SEND_MAIL, json=message())
+    assert len(fresh_graph.mails) == 1
+
+
+def test_dropped_response_on_get_is_retried(make_client, fresh_graph):
+    fresh_graph.inject("/drive/root$", "drop")
+    assert make_client().get(DRIVE_ROOT).status_code == 200
+    assert fresh_graph.requests["item"] == 2
+
+
+def test_read_timeout_retried_for_get(make_client, fresh_graph):
+    fresh_graph.inject("/drive/root$", 1.0)
+    start = time.monotonic()
+    resp = make_client(read_timeout=0.3).get(DRIVE_ROOT)
+    assert resp.status_code == 200
+    assert time.monotonic() - start < 1.0
+
+
+def test_read_timeout_on_post_is_not_resent(make_client, fresh_graph):
+    fresh_graph.inject("/sendMail$", 1.0)
+    with pytest.raises(GraphError, match="timed out|Read timed out"):
+        make_client(read_timeout=0.3).post(SEND_MAIL, json=message())
+    time.sleep(1.0)  # the slow request still completes on the server
+    assert len(fresh_graph.mails) == 1
+
+
+def test_connection_refused_is_retried_even_for_post(credential, graph):
+    # Nothing listens on the port, so the request never left: safe to replay.
+    client = GraphClient(credential, base_url="https://127.0.0.1:9/v1.0", verify=graph.ca_path,
+                         max_retries=2, backoff_base=0.01)
+    with pytest.raises(GraphError, match="after 3 attempts"):
+        client.post(SEND_MAIL, json=message())
+
+
+def test_batch_retries_throttled_inner_requests_only(make_client, fresh_graph):
+    fresh_graph.inject("/sendMail$", 429, 503)
+    client = make_client()
+    batch = GraphBatch(client)
+    first = batch.add("POST", SEND_MAIL, json=message("a@example.com"))
+    second = batch.add("POST", SEND_MAIL, json=message("b@example.com"))
+    results = batch.execute()
+    # The 429 was replayed; the 503 on a sendMail may have been sent, so it
+    # is reported rather than resent.
+    assert sorted(resp.status_code for resp in (results[first], results[second])) == [202, 503]
+    assert len(fresh_graph.mails) == 1
+
+
+def test_throttled_upload_chunks_wait_under_admission_control(make_client, fresh_graph):
+    # Chunks go to the session's pre-authenticated URL without acquire(), so
+    # the client itself has to sit out the Retry-After.
+    fresh_graph.inject("^/upload/", 429, 429, 429)
+    client = make_client(admission=AdmissionController(rate=100, burst=10))
+    data = b"x" * 1000
+    start = time.monotonic()
+    item = onedrive.upload_large_file(client, SENDER, "root", "throttled.bin", io.BytesIO(data), len(data))
+    assert time.monotonic() - start >= 0.6
+    assert item["size"] == len(data)
+    assert fresh_graph.requests["fault"] == 3
+
+
+def test_failed_attachment_upload_deletes_the_draft(make_client, fresh_graph, monkeypatch):
+    monkeypatch.setattr(mail, "ATTACHMENT_CHUNK_SIZE", 1000)
+    archive = SpooledArchive()
+    with archive.open_zip() as zipf:
+        zipf.writestr("docs/aadhaar.pdf", b"x" * 5000)
+    fresh_graph.inject("^/upload/", 500, 500, 500, 500, method="PUT")
+    with pytest.raises(GraphError, match="attachment"):
+        mail._send_with_upload_session(
+            make_client(max_retries=0), SENDER, mail.build_message(SENDER, "a@example.com", "s", "b"),
+            archive, "docs.zip",
+        )
+    assert fresh_graph.drafts == {}
+    assert fresh_graph.mails == []
@@ -0,0 +1,48 @@
+import io
+
+from PIL import Image
+
+import images
+import onboarding
+
+
+def jpeg(size, dpi=(300, 300)):
+    out = io.BytesIO()
+    Image.radial_gradient("L").resize(size).convert("RGB").save(out, "JPEG", quality=95, dpi=dpi)
+    return out.getvalue()
+
+
+def test_documents_are_archived_untouched_by_default():
+    data = jpeg((3000, 2000))
+    assert onboarding.image_settings({}).normalize is False
+    assert images.normalize_image(data, "pan.jpg", images.ImageSettings()) is data
+
+
+def test_normalization_downsamples_when_enabled():
+    settings = onboarding.image_settings({"NORMALIZE_UPLOADED_IMAGES": True, "IMAGE_MAX_DIMENSION": 1000})
+    result = images.normalize_image(jpeg((3000, 2000)), "pan.jpg", settings)
+    with Image.open(io.BytesIO(result)) as img:
+        # 300 DPI is first brought down to 200, then capped at 1000 px.
+        assert max(img.size) == 1000
+        assert round(img.info["dpi"][0]) == 200
+
+
+def test_non_images_are_never_touched():
+    settings = images.ImageSettings(normalize=True)
+    data = b"%PDF-1.4\n..."
+    assert images.normalize_image(data, "aadhaar.pdf", settings) is data
+
+
+def test_thumbnail_cache_reads_the_photo_only_on_a_miss():
+    cache = images.ThumbnailCache(images.ImageSettings())
+    photo = jpeg((800, 600))
+    loads = []
+
+    def load():
+        loads.append(1)
+        return photo
+
+    digest = images.content_hash(photo)
+    first = cache.get(digest, load)
+    assert first and cache.get(digest, load) == first
+    assert len(loads) == 1
@@ -0,0 +1,43 @@
+import io
+import json
+
+from PIL import Image
+
+import images
+import onboarding
+import staging
+from blobstore import BlobRef, BlobStore
+from conftest import SENDER
+from test_images import jpeg
+
+
+def staged_file(fresh_graph, path):
+    return fresh_graph.drive.walk("root", path.split("/"))
+
+
+def test_preuploaded_images_are_normalized_like_the_archive(make_client, fresh_graph):
+    settings = onboarding.image_settings({"NORMALIZE_UPLOADED_IMAGES": True, "IMAGE_MAX_DIMENSION": 1000})
+    blob_store = BlobStore()
+    photo = jpeg((3000, 2000))
+    notes = b"not an image"
+    refs = [BlobRef(blob_store.put(data), name, len(data)) for name, data in (("pan.jpg", photo), ("notes.pdf", notes))]
+    stager = staging.MemberStager(make_client(), SENDER, blob_store, image_settings=settings)
+    family = ["Client Data", "Staged_Family"]
+    path = family + ["_staging_test", "Asha"]
+    task_id = stager.stage(path, [(ref.name, ref) for ref in refs])
+    assert stager.wait([task_id], timeout=30)
+
+    manifest = {"family": "Staged Family", "members": [{"name": "Asha", "folder": "Asha"}]}
+    stager.promote(family + ["_staging_test"], "Staged_Family_onboarding", [("Asha/details.txt", "Name: Asha")],
+                   manifest, [task_id])
+
+    folder = "Client Data/Staged_Family/Staged_Family_onboarding"
+    uploaded = staged_file(fresh_graph, f"{folder}/Asha/pan.jpg")["content"]
+    assert uploaded == images.normalize_image(photo, "pan.jpg", settings)
+    with Image.open(io.BytesIO(uploaded)) as img:
+        assert max(img.size) == 1000
+    written = json.loads(staged_file(fresh_graph, f"{folder}/manifest.json")["content"])
+    assert written["members"][0]["files"] == [
+        {"name": "pan.jpg", "sha256": images.content_hash(uploaded), "size": len(uploaded)},
+        {"name": "notes.pdf", "sha256": images.content_hash(notes), "size": len(notes)},
+    ]
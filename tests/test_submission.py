@@ -0,0 +1,202 @@
+import base64
+import io
+import random
+import threading
+import time
+import zipfile
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import mail
+import staging
+import submission
+from blobstore import BlobRef, BlobStore
+from conftest import SENDER
+
+
+def failed_job(worker):
+    job = submission.SubmissionJob({"family_name": "Test", "zip_name": "t.zip", "folder_path": [], "entries": [],
+                                    "emails": []})
+    job.status = submission.STATUS_FAILED
+    worker._jobs[job.id] = job
+    return job
+
+
+def test_concurrent_retries_start_the_job_once():
+    worker = submission.SubmissionWorker(client=None, sender="sender@example.com")
+    started = []
+    worker._run = started.append
+    for _ in range(50):
+        job = failed_job(worker)
+        barrier = threading.Barrier(4)
+
+        def retry():
+            barrier.wait()
+            worker.retry(job.id)
+
+        threads = [threading.Thread(target=retry) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    worker._pool.shutdown(wait=True)
+    assert len(started) == 50
+
+
+def test_retry_ignores_jobs_that_did_not_fail():
+    worker = submission.SubmissionWorker(client=None, sender="sender@example.com")
+    job = failed_job(worker)
+    job.status = submission.STATUS_DONE
+    assert worker.retry(job.id) is False
+
+
+def wait_for(worker, job_id, timeout=30):
+    deadline = time.monotonic() + timeout
+    job = worker.get(job_id)
+    while job.status not in (submission.STATUS_DONE, submission.STATUS_FAILED):
+        assert time.monotonic() < deadline, "submission did not finish"
+        time.sleep(0.02)
+    return job
+
+
+def test_link_mode_sends_an_expiring_link_to_the_applicant_only(make_client, fresh_graph, monkeypatch):
+    # Shrink the thresholds so a small archive is emailed as a link.
+    monkeypatch.setattr(mail, "INLINE_ATTACHMENT_LIMIT", 10_000)
+    monkeypatch.setattr(mail, "LINK_ONLY_THRESHOLD", 50_000)
+    worker = submission.SubmissionWorker(make_client(), SENDER, share_link_days=3)
+    spec = {
+        "family_name": "Link Family", "zip_name": "Link_Family_onboarding.zip",
+        "folder_path": ["Client Data", "Link_Family"],
+        "entries": [("Link_Family/aadhaar.pdf", random.Random(1).randbytes(100_000))],
+        "emails": [
+            {"key": "admin_email", "to": SENDER, "subject": "s", "body": "admin"},
+            {"key": "applicant_email", "to": "applicant@example.com", "subject": "s", "body": "applicant"},
+        ],
+    }
+    job = wait_for(worker, worker.submit(spec))
+    assert job.status == submission.STATUS_DONE
+
+    [link] = fresh_graph.links
+    assert link["scope"] == "anonymous"
+    expires = datetime.strptime(link["expirationDateTime"], "%Y-%m-%dT%H:%M:%SZ").replace(tzinfo=timezone.utc)
+    assert timedelta(days=2.9) < expires - datetime.now(timezone.utc) <= timedelta(days=3)
+    bodies = {mail_["message"]["toRecipients"][0]["emailAddress"]["address"]: mail_["message"]["body"]["content"]
+              for mail_ in fresh_graph.mails}
+    assert job.share_link in bodies["applicant@example.com"]
+    assert job.share_link not in bodies[SENDER]
+    assert job.web_url in bodies[SENDER]
+
+
+def test_submit_uses_the_callers_entries_hash(monkeypatch):
+    worker = submission.SubmissionWorker(client=None, sender="sender@example.com")
+    worker._run = lambda job: None
+    monkeypatch.setattr(submission.journal, "content_hash", lambda entries: pytest.fail("documents hashed again"))
+    spec = {"family_name": "Hash Family", "zip_name": "h.zip", "folder_path": [], "entries": [], "emails": []}
+    job = worker.get(worker.submit(spec, entries_hash="abc123"))
+    worker._pool.shutdown(wait=True)
+    assert job.key == submission.journal.submission_key("Hash Family", "abc123")
+
+
+def staged_spec(worker, blob_store, data):
+    ref = BlobRef(blob_store.put(data), "aadhaar.pdf", len(data))
+    folder_path = ["Client Data", "Staged_Family"]
+    # The fake drive lives for the whole session, so each staging folder and
+    # final name is new.
+    staging_folder = staging.staging_folder_name()
+    task_id = worker.stager.stage(folder_path + [staging_folder, "Asha"], [(ref.name, ref)])
+    blob_store.acquire(ref.digest)
+    return {
+        "family_name": "Staged Family", "timestamp": "20260101_120000", "zip_name": "Staged_Family_onboarding.zip",
+        "folder_path": folder_path,
+        "entries": [("Staged_Family/Asha/aadhaar.pdf", ref)],
+        "emails": [
+            {"key": "admin_email", "to": SENDER, "subject": "s", "body": "admin"},
+            {"key": "applicant_email", "to": "applicant@example.com", "subject": "s", "body": "applicant"},
+        ],
+        "members": [{"name": "Asha", "age": 40, "email": "applicant@example.com", "phone": ""}],
+        "staging": {
+            "path": folder_path + [staging_folder], "tasks": [task_id],
+            "final_name": f"Staged_Family_onboarding{staging_folder}",
+            "details": [("Asha/details.txt", "Name: Asha")], "manifest": {"members": [{"name": "Asha"}]},
+        },
+    }
+
+
+def staged_worker(make_client):
+    client = make_client()
+    blob_store = BlobStore()
+    stager = staging.MemberStager(client, SENDER, blob_store)
+    return submission.SubmissionWorker(client, SENDER, blob_store=blob_store, stager=stager), blob_store
+
+
+def test_staged_upload_does_not_wait_for_the_archive(make_client, fresh_graph):
+    worker, blob_store = staged_worker(make_client)
+    archive_may_finish = threading.Event()
+    build_archive = worker._build_archive
+
+    def slow_build_archive(job):
+        assert archive_may_finish.wait(10)
+        build_archive(job)
+
+    worker._build_archive = slow_build_archive
+    job = worker.get(worker.submit(staged_spec(worker, blob_store, b"%PDF staged")))
+    deadline = time.monotonic() + 10
+    while job.snapshot()["steps"]["upload"] != submission.STEP_DONE:
+        assert time.monotonic() < deadline, "promote waited for the archive"
+        time.sleep(0.02)
+    assert job.snapshot()["steps"]["archive"] == submission.STEP_RUNNING
+    archive_may_finish.set()
+    assert wait_for(worker, job.id).status == submission.STATUS_DONE
+
+
+def sent_to(fresh_graph, address):
+    [sent] = [m["message"] for m in fresh_graph.mails
+              if m["message"]["toRecipients"][0]["emailAddress"]["address"] == address]
+    return sent
+
+
+def test_staged_submission_still_sends_the_applicant_the_archive(make_client, fresh_graph):
+    worker, blob_store = staged_worker(make_client)
+    job = wait_for(worker, worker.submit(staged_spec(worker, blob_store, b"%PDF staged")))
+    assert job.status == submission.STATUS_DONE
+
+    admin = sent_to(fresh_graph, SENDER)
+    assert not admin.get("attachments")
+    assert job.staged_location in admin["body"]["content"]
+    [attachment] = sent_to(fresh_graph, "applicant@example.com")["attachments"]
+    with zipfile.ZipFile(io.BytesIO(base64.b64decode(attachment["contentBytes"]))) as zipf:
+        assert zipf.read("Staged_Family/Asha/aadhaar.pdf") == b"%PDF staged"
+
+
+def test_large_staged_submission_links_the_applicant_to_the_folder(make_client, fresh_graph, monkeypatch):
+    monkeypatch.setattr(mail, "INLINE_ATTACHMENT_LIMIT", 10_000)
+    monkeypatch.setattr(mail, "LINK_ONLY_THRESHOLD", 50_000)
+    worker, blob_store = staged_worker(make_client)
+    job = wait_for(worker, worker.submit(staged_spec(worker, blob_store, random.Random(2).randbytes(100_000))))
+    assert job.status == submission.STATUS_DONE
+
+    [link] = fresh_graph.links
+    assert link["scope"] == "anonymous" and link["expirationDateTime"]
+    applicant = sent_to(fresh_graph, "applicant@example.com")
+    assert job.share_link in applicant["body"]["content"]
+    assert not applicant.get("attachments")
+
+
+def test_errors_raised_outside_a_step_fail_it_and_are_logged(caplog):
+    worker = submission.SubmissionWorker(client=None, sender="sender@example.com")
+    job = submission.SubmissionJob({
+        "family_name": "Broken", "zip_name": "b.zip", "folder_path": [], "entries": [],
+        "emails": [{"key": "admin_email", "to": SENDER, "subject": "s", "body": "b"}],
+    })
+    job.steps.update(archive=submission.STEP_DONE, upload=submission.STEP_DONE)
+
+    def broken_send_emails(*args):
+        raise RuntimeError("boom")
+
+    worker._send_emails = broken_send_emails
+    with caplog.at_level("ERROR", logger="onboarding.trace"):
+        worker._run(job)
+    assert job.status == submission.STATUS_FAILED
+    assert "boom" in job.errors["admin_email"]
+    assert any(record.exc_info and "admin_email" in record.getMessage() for record in caplog.records)
@@ -0,0 +1,226 @@
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger("onboarding.trace")
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+
+def _label_key(labels):
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def _format_labels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+class Metrics:
+    # Process-wide counters and histograms rendered in the Prometheus text
+    # format, so p50/p95 latencies and throttling can be graphed.
+    def __init__(self, buckets=DURATION_BUCKETS):
+        self.buckets = buckets
+        self._counters = {}
+        self._histograms = {}
+        self._help = {}
+        self._lock = threading.Lock()
+
+    def describe(self, name, text):
+        self._help[name] = text
+
+    def inc(self, name, value=1, **labels):
+        key = (name, _label_key(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        key = (name, _label_key(labels))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = {"buckets": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    histogram["buckets"][i] += 1
+            histogram["sum"] += value
+            histogram["count"] += 1
+
+    def render(self):
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted((key, dict(value, buckets=list(value["buckets"]))) for key, value in self._histograms.items())
+        lines = []
+        seen = set()
+        for (name, key), value in counters:
+            if name not in seen:
+                seen.add(name)
+                if name in self._help:
+                    lines.append(f"# HELP {name} {self._help[name]}")
+                lines.append(f"# TYPE {name} counter")
+            lines.append(f"{name}{_format_labels(key)} {value}")
+        for (name, key), histogram in histograms:
+            if name not in seen:
+                seen.add(name)
+                if name in self._help:
+                    lines.append(f"# HELP {name} {self._help[name]}")
+                lines.append(f"# TYPE {name} histogram")
+            for bound, count in zip(self.buckets, histogram["buckets"]):
+                lines.append(f"{name}_bucket{_format_labels(key, [('le', str(bound))])} {count}")
+            lines.append(f"{name}_bucket{_format_labels(key, [('le', '+Inf')])} {histogram['count']}")
+            lines.append(f"{name}_sum{_format_labels(key)} {histogram['sum']}")
+            lines.append(f"{name}_count{_format_labels(key)} {histogram['count']}")
+        return "\n".join(lines) + "\n"
+
+
+METRICS = Metrics()
+METRICS.describe("onboarding_span_duration_seconds", "Duration of traced phases.")
+METRICS.describe("onboarding_span_bytes_total", "Bytes handled by traced phases.")
+METRICS.describe("onboarding_graph_requests_total", "Microsoft Graph responses by method and status.")
+METRICS.describe("onboarding_graph_retries_total", "Microsoft Graph requests retried, by reason.")
+METRICS.describe("onboarding_rerun_seconds", "Streamlit script and fragment rerun time.")
+METRICS.describe("onboarding_graph_admission_wait_seconds", "Time Graph callers waited for admission, by kind.")
+METRICS.describe("onboarding_graph_pauses_total", "Process-wide pauses after Microsoft Graph throttling.")
+METRICS.describe("onboarding_graph_tokens_total", "Microsoft Graph access tokens served, by source (cache or network).")
+
+_local = threading.local()
+
+
+class Span:
+    def __init__(self, name, parent=None, **attrs):
+        self.name = name
+        self.trace_id = parent.trace_id if parent else uuid.uuid4().hex[:16]
+        self.span_id = uuid.uuid4().hex[:8]
+        self.parent_id = parent.span_id if parent else None
+        self.attrs = attrs
+        self.status = "ok"
+        self.started_at = time.time()
+        self.duration = None
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def add(self, key, amount=1):
+        self.attrs[key] = self.attrs.get(key, 0) + amount
+
+
+def current_span():
+    stack = getattr(_local, "stack", None)
+    return stack[-1] if stack else None
+
+
+@contextmanager
+def span(name, parent=None, **attrs):
+    # parent defaults to the innermost span on this thread; pass it
+    # explicitly when work hops to a pool thread.
+    current = Span(name, parent or current_span(), **attrs)
+    stack = _local.__dict__.setdefault("stack", [])
+    stack.append(current)
+    start = time.perf_counter()
+    try:
+        yield current
+    except Exception as e:
+        current.status = "error"
+        current.attrs.setdefault("error", str(e) or e.__class__.__name__)
+        raise
+    finally:
+        stack.pop()
+        current.duration = time.perf_counter() - start
+        _finish(current)
+
+
+def record(name, seconds, parent=None, status="ok", **attrs):
+    # A span for work that was timed elsewhere.
+    finished = Span(name, parent or current_span(), **attrs)
+    finished.started_at = time.time() - seconds
+    finished.status = status
+    finished.duration = seconds
+    _finish(finished)
+    return finished
+
+
+def _finish(finished):
+    METRICS.observe("onboarding_span_duration_seconds", finished.duration, span=finished.name, status=finished.status)
+    if isinstance(finished.attrs.get("bytes"), int):
+        METRICS.inc("onboarding_span_bytes_total", finished.attrs["bytes"], span=finished.name)
+    if logger.isEnabledFor(logging.INFO):
+        logger.info(json.dumps({
+            "ts": round(finished.started_at, 3),
+            "span": finished.name,
+            "trace_id": finished.trace_id,
+            "span_id": finished.span_id,
+            "parent_id": finished.parent_id,
+            "duration_ms": round(finished.duration * 1000, 2),
+            "status": finished.status,
+            **finished.attrs,
+        }, default=str))
+
+
+def configure_logging(level=logging.INFO):
+    # Bare JSON lines on stderr, one per finished span.
+    if not logger.handlers:
+        handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        logger.addHandler(handler)
+        logger.propagate = False
+    logger.setLevel(level)
+
+
+class MetricsFileWriter:
+    # Rewrites the metrics file every few seconds, e.g. for node_exporter's
+    # textfile collector.
+    def __init__(self, path, interval=15, metrics=METRICS):
+        self.path = path
+        self.interval = interval
+        self.metrics = metrics
+        self._stop = threading.Event()
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._thread = threading.Thread(target=self._run, daemon=True, name="metrics-file")
+        self._thread.start()
+
+    def write(self):
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            f.write(self.metrics.render())
+        os.replace(tmp_path, self.path)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.write()
+            except OSError:
+                logger.warning("Could not write metrics to %s", self.path)
+
+    def close(self):
+        self._stop.set()
+
+
+def serve_metrics(port, host="0.0.0.0", metrics=METRICS):
+    # Minimal /metrics endpoint next to the Streamlit server.
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = metrics.render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True, name="metrics-http").start()
+    return server